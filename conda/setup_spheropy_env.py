@@ -15,7 +15,7 @@ def main():
     # Give python access to bluetooth
     if is_running_on_linux():
         subprocess.check_call(['sudo', 'apt-get', 'install', '-y', 'libcap2-bin'])
-        subprocess.check_call("sudo setcap 'cap_net_raw,cap_net_admin+eip' `which python3.6`", shell=True)
+        subprocess.check_call("sudo setcap 'cap_net_raw,cap_net_admin+eip' `which python3.7`", shell=True)
 
     print('Done setting up environment.')
 
@@ -32,7 +32,8 @@ def is_conda_available():
 
 def install_deps():
     subprocess.check_call(['conda', 'install', '--yes',
-        'python=3.6',
+        'python=3.7',
+        'numpy',
         'pylint',
         'git',
         'pexpect']
@@ -9,13 +9,14 @@ ext_modules = []
 extras_require = {
     'winble': ['winble'],
     'pygatt': ['pygatt'],
-    'pybluez': ['pybluez']
+    'pybluez': ['pybluez'],
+    'numpy': ['numpy']
 }
 
 install_requires = []
 
-if sys.version_info < (3,6):
-    sys.exit('Sorry, Python >= 3.6 is required')
+if sys.version_info < (3,7):
+    sys.exit('Sorry, Python >= 3.7 is required')
 
 setup(
     name='SpheroPy',
@@ -3,12 +3,24 @@
 Interact with Sphero devices.
 """
 import os
-import sys
+import errno
 import uuid
+import asyncio
 import threading
 import struct
-import queue
+import selectors
+import socket
 import enum
+import functools
+import time
+import collections
+import contextvars
+import concurrent.futures
+import heapq
+import itertools
+import random
+import math
+import mmap
 from collections import namedtuple
 
 
@@ -26,6 +38,13 @@ try:
 except Exception:
     HAS_PYGATT = False
 
+USE_NUMPY = True
+try:
+    import numpy
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+
 USE_WINBLE = True
 try:
     import winble
@@ -41,28 +60,257 @@ class RollMode(enum.Enum):
     IN_PLACE_ROTATE = enum.auto()
     FAST_ROTATE = enum.auto()
 
+
+class RawMotorMode(enum.Enum):
+    OFF = 0x00
+    FORWARD = 0x01
+    REVERSE = 0x02
+    BRAKE = 0x03
+    IGNORE = 0x04
+
+
+class CommandPriority(enum.IntEnum):
+    """Send priority classes. Lower values are sent first."""
+    CONTROL = 0
+    QUERY = 1
+    COSMETIC = 2
+
+
+class EventKind(enum.Enum):
+    """The kinds of asynchronous events a Sphero sends.
+
+    The values are the asynchronous message ID codes.
+    """
+    POWER_STATE_CHANGE = 0x01
+    LEVEL_1_DIAGNOSTIC = 0x02
+    SENSOR_DATA = 0x03
+    CONFIG_BLOCK = 0x04
+    PRE_SLEEP_WARNING = 0x05
+    MACRO_MARKER = 0x06
+    COLLISION = 0x07
+    ORBBASIC_PRINT = 0x08
+    ORBBASIC_ERROR_ASCII = 0x09
+    ORBBASIC_ERROR_BINARY = 0x0A
+    SELF_LEVEL_COMPLETE = 0x0B
+    GYRO_AXIS_LIMIT_EXCEEDED = 0x0C
+    SOUL_DATA = 0x0D
+    LEVEL_UP = 0x0E
+    SHIELD_DAMAGE = 0x0F
+    XP_UPDATE = 0x10
+    BOOST_UPDATE = 0x11
+
+
+class SetpointKind(enum.Enum):
+    """The commands that can be driven through a SetpointChannel."""
+    ROLL = enum.auto()
+    RGB_LED = enum.auto()
+    BACK_LED = enum.auto()
+    HEADING = enum.auto()
+
+
+class SensorChannel(enum.IntFlag):
+    """The sensor data channels that can be streamed with start_streaming.
+
+    Combine channels with |.
+    Each channel is a field of the streamed structured arrays,
+    named like the member in lower case (ACCEL_X is 'accel_x').
+
+    Units:
+        ACCEL_*_RAW: G (4 mG resolution)
+        GYRO_*_RAW: degrees per second (0.068 resolution)
+        *_MOTOR_BACK_EMF_RAW, *_MOTOR_PWM_RAW: raw device units
+        IMU_PITCH, IMU_ROLL, IMU_YAW: degrees
+        ACCEL_X, ACCEL_Y, ACCEL_Z: G (1/4096 resolution)
+        GYRO_X, GYRO_Y, GYRO_Z: degrees per second (0.1 resolution)
+        *_MOTOR_BACK_EMF: raw device units
+        QUATERNION_*: unitless (0.0001 resolution)
+        ODOMETER_X, ODOMETER_Y: centimeters
+        ACCEL_ONE: G (1 mG resolution)
+        VELOCITY_X, VELOCITY_Y: millimeters per second
+
+    The values are the bits of the command's first mask
+    shifted up by 32, or'ed with the bits of its second mask.
+    """
+    ACCEL_X_RAW = 0x80000000 << 32
+    ACCEL_Y_RAW = 0x40000000 << 32
+    ACCEL_Z_RAW = 0x20000000 << 32
+    GYRO_X_RAW = 0x10000000 << 32
+    GYRO_Y_RAW = 0x08000000 << 32
+    GYRO_Z_RAW = 0x04000000 << 32
+    RIGHT_MOTOR_BACK_EMF_RAW = 0x00400000 << 32
+    LEFT_MOTOR_BACK_EMF_RAW = 0x00200000 << 32
+    LEFT_MOTOR_PWM_RAW = 0x00100000 << 32
+    RIGHT_MOTOR_PWM_RAW = 0x00080000 << 32
+    IMU_PITCH = 0x00040000 << 32
+    IMU_ROLL = 0x00020000 << 32
+    IMU_YAW = 0x00010000 << 32
+    ACCEL_X = 0x00008000 << 32
+    ACCEL_Y = 0x00004000 << 32
+    ACCEL_Z = 0x00002000 << 32
+    GYRO_X = 0x00001000 << 32
+    GYRO_Y = 0x00000800 << 32
+    GYRO_Z = 0x00000400 << 32
+    RIGHT_MOTOR_BACK_EMF = 0x00000040 << 32
+    LEFT_MOTOR_BACK_EMF = 0x00000020 << 32
+    QUATERNION_Q0 = 0x80000000
+    QUATERNION_Q1 = 0x40000000
+    QUATERNION_Q2 = 0x20000000
+    QUATERNION_Q3 = 0x10000000
+    ODOMETER_X = 0x08000000
+    ODOMETER_Y = 0x04000000
+    ACCEL_ONE = 0x02000000
+    VELOCITY_X = 0x01000000
+    VELOCITY_Y = 0x00800000
+
+    # Groups of channels.
+    ACCELEROMETER = ACCEL_X | ACCEL_Y | ACCEL_Z
+    GYRO = GYRO_X | GYRO_Y | GYRO_Z
+    IMU_ANGLES = IMU_PITCH | IMU_ROLL | IMU_YAW
+    MOTOR_BACK_EMF = LEFT_MOTOR_BACK_EMF | RIGHT_MOTOR_BACK_EMF
+    QUATERNION = QUATERNION_Q0 | QUATERNION_Q1 | QUATERNION_Q2 | QUATERNION_Q3
+    ODOMETER = ODOMETER_X | ODOMETER_Y
+    VELOCITY = VELOCITY_X | VELOCITY_Y
+
 # region Sphero
 
 
 class Sphero(object):
-    """The main class that is used for interacting with a Sphero device."""
+    """The main class that is used for interacting with a Sphero device.
+
+    Args:
+        default_response_timeout_in_seconds (float, None):
+            The amount of time to wait for a response
+            when a command does not specify its own timeout.
+            If None, the timeout adapts to the round trip times
+            measured on the connection (see rtt_estimate).
+        response_timeout_overrides (dict, None):
+            Maps (device_id, command_id) to the amount of time
+            to wait for that command's response
+            when the command does not specify its own timeout.
+            Takes precedence over default_response_timeout_in_seconds.
+        max_commands_in_flight (int, DEFAULT_MAX_COMMANDS_IN_FLIGHT):
+            The maximum number of commands that can be waiting
+            for a response at the same time.
+            Commands sent once the window is full wait
+            until an earlier command completes.
+            Valid range is [1, 255].
+        write_coalescing_window_in_seconds (float, None):
+            If specified, packets written within this window
+            are packed into a single transport write.
+            If None, every packet is written as soon as it is sent
+            (except inside batch()).
+        write_coalescing_max_bytes (int, DEFAULT_WRITE_COALESCING_MAX_BYTES):
+            The maximum number of bytes packed into a single transport write.
+        retry_policy (RetryPolicy, None):
+            How idempotent commands are retried after a timeout.
+            If None, uses RetryPolicy().
+            Pass RetryPolicy(max_attempts=1) to disable retries.
+        io_reactor (IoReactor, None):
+            The reactor that reads and decodes this Sphero's received data.
+            If None, received data is read and decoded on the event loop
+            that called connect.
+        callback_executor (concurrent.futures.Executor, None):
+            The executor that runs the regular (non-coroutine) functions
+            in on_collision, on_power_state_change and on_self_level_complete.
+            If None, uses a thread pool with max_callback_workers threads.
+        max_callback_workers (int, DEFAULT_MAX_CALLBACK_WORKERS):
+            The number of threads of the default callback executor.
+        receive_queue_size (int, DEFAULT_RECEIVE_QUEUE_SIZE):
+            The maximum number of received asynchronous packets
+            waiting to be handled. See receive_stats.
+        receive_overflow (str, 'drop_oldest'):
+            What to do when the receive queue is full.
+            'drop_oldest' drops the oldest asynchronous packet
+            and 'block' makes a receiving thread wait.
+            Command responses are never queued or dropped.
+
+    Event callbacks:
+        on_collision, on_power_state_change and on_self_level_complete
+        are lists of callbacks called with the event's data.
+        subscribe adds callbacks for any EventKind
+        or for an ID code added with register_async_message.
+        Asynchronous messages nobody subscribed to are not parsed.
+        See async_message_stats.
+        Coroutine functions run as tasks on the event loop that called connect,
+        so they can send commands directly.
+        Regular functions run on the callback executor.
+        Each callback gets its events one at a time in the order they arrived,
+        while different callbacks run concurrently.
+        See callback_stats.
+    """
+
+    DEFAULT_MAX_COMMANDS_IN_FLIGHT = 64
+    DEFAULT_WRITE_COALESCING_MAX_BYTES = 128
+    DEFAULT_MAX_CALLBACK_WORKERS = 4
+    DEFAULT_EVENT_STREAM_MAXSIZE = 64
+    DEFAULT_RECEIVE_QUEUE_SIZE = 1024
+    MAX_STREAMING_RATE_HZ = 400
 
 # region Sphero public members
 
-    def __init__(self, default_response_timeout_in_seconds=0.5):
-        self.on_collision = []
-        self.on_power_state_change = []
-        self.on_self_level_complete = []
+    def __init__(self,
+                 default_response_timeout_in_seconds=None,
+                 response_timeout_overrides=None,
+                 max_commands_in_flight=DEFAULT_MAX_COMMANDS_IN_FLIGHT,
+                 write_coalescing_window_in_seconds=None,
+                 write_coalescing_max_bytes=DEFAULT_WRITE_COALESCING_MAX_BYTES,
+                 retry_policy=None,
+                 io_reactor=None,
+                 callback_executor=None,
+                 max_callback_workers=DEFAULT_MAX_CALLBACK_WORKERS,
+                 receive_queue_size=DEFAULT_RECEIVE_QUEUE_SIZE,
+                 receive_overflow='drop_oldest'):
+        if max_commands_in_flight < 1 or max_commands_in_flight > 0xFF:
+            raise ValueError(
+                f'max_commands_in_flight must be in the range [1, 255]. max_commands_in_flight was {max_commands_in_flight}')
 
         self._bluetooth_interface = None
+        self._transport = None
         self._default_response_timeout_in_seconds = default_response_timeout_in_seconds
+        self._response_timeout_overrides = dict(response_timeout_overrides or {})
+        self._rtt_estimator = _RttEstimator()
+        self._retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        # [commands, retries, recovered, failed]
+        self._retry_counters = [0, 0, 0, 0]
         self._command_sequence_number = 0x00
+        # Guards sequence number allocation and response handler registration.
+        self._command_sequence_number_lock = threading.Lock()
+        self._command_window = _CommandWindow(max_commands_in_flight)
+        self._write_coalescer = _WriteCoalescer(self._write_to_transport,
+                                                write_coalescing_window_in_seconds,
+                                                write_coalescing_max_bytes)
+        self._send_scheduler = _SendScheduler(self._write_coalescer.write)
+        # Incremented by every emergency stop.
+        # Motion commands sent before a stop are preempted by it.
+        self._emergency_stop_generation = 0
 
         # Message processing members
         self._commands_waiting_for_response = {}
-        # TODO: Consider passing in a max size for the queue.
-        self._message_receive_queue = queue.Queue()
-        self._message_processing_thread = None
+        self._receive_worker = _ReceiveWorker(self._handle_ack_packet,
+                                              self._handle_async_packet,
+                                              io_reactor,
+                                              receive_queue_size,
+                                              receive_overflow)
+        self._callback_dispatcher = _CallbackDispatcher(callback_executor, max_callback_workers)
+        # Maps asynchronous ID codes to their _AsyncDispatchEntry.
+        self._async_dispatch = {
+            id_code: _AsyncDispatchEntry(EventKind(id_code), parse)
+            for id_code, parse in _ASYNC_MESSAGE_PARSERS.items()
+        }
+        # Guards the dispatch entries' streams.
+        self._event_streams_lock = threading.Lock()
+        # Maps asynchronous ID codes to the number of packets received,
+        # and to the number thrown away because nobody subscribed.
+        self._async_message_counts = collections.Counter()
+        self._unhandled_async_message_counts = collections.Counter()
+        # The sample rate of the sensor data stream. None if not streaming.
+        self._streaming_rate_hz = None
+        # Maps the Sphero's millisecond timer onto time.monotonic().
+        self._device_clock = _ClockModel(1000, wrap=1 << 32)
+        self._sensor_stream_tracker = None
+        self._async_dispatch[EventKind.COLLISION.value].stamp = self._stamp_collision
+        self._async_dispatch[EventKind.SENSOR_DATA.value].stamp = self._stamp_sensor_data
+        self._wire_capture = None
 
     async def connect(self,
                       search_name=None,
@@ -70,7 +318,8 @@ class Sphero(object):
                       port=None,
                       bluetooth_interface=None,
                       use_ble=False,
-                      num_retry_attempts=1):
+                      num_retry_attempts=1,
+                      transport=None):
         """Connects to the Sphero.
 
         Must be called before calling any other methods.
@@ -92,42 +341,508 @@ class Sphero(object):
             num_retry_attempts (int):
                 The number of times to try to connect.
                 Defaults to 1.
+            transport (AsyncTransportBase):
+                A custom transport to use instead of a bluetooth interface.
         """
-        # Create the bluetooth interface
-        global HAS_PYBLUEZ
-        global USE_PYBLUEZ
-        global HAS_PYGATT
-        global USE_PYGATT
-        global HAS_WINBLE
-        global USE_WINBLE
-        if bluetooth_interface is None:
-            if use_ble:
-                if (HAS_PYGATT and USE_PYGATT) or (HAS_WINBLE and USE_WINBLE):
-                    self._bluetooth_interface = BleInterface(
-                        search_name=search_name, address=address, port=port)
-                else:
-                    raise RuntimeError(
-                        'Could not import a bluetooth LE Library.')
-            else:
-                if HAS_PYBLUEZ and USE_PYBLUEZ:
-                    self._bluetooth_interface = BluetoothInterface(
-                        search_name=search_name, address=address, port=port)
-                else:
-                    raise RuntimeError(
-                        'Could not import a bluetooth (non-BLE) library.')
-        else:
-            self._bluetooth_interface = bluetooth_interface
+        self._receive_worker.start(asyncio.get_running_loop())
+        self._callback_dispatcher.event_loop = asyncio.get_running_loop()
+        if transport is None:
+            transport = InterfaceTransport(self._create_bluetooth_interface(bluetooth_interface,
+                                                                            search_name,
+                                                                            address,
+                                                                            port,
+                                                                            use_ble))
+            self._bluetooth_interface = transport.bluetooth_interface
+
+        self._transport = transport
+        transport.data_received_handler = self._handle_data_received
+        transport.io_thread = self._receive_worker.io_thread
+        try:
+            await transport.connect(num_retry_attempts=num_retry_attempts)
+        except BaseException:
+            self._receive_worker.stop()
+            raise
 
-        self._bluetooth_interface.data_received_handler = self._handle_data_received
-        self._bluetooth_interface.connect(
-            num_retry_attempts=num_retry_attempts)
         print('Connected to Sphero.')
 
     def disconnect(self):
         """Disconnect from the Sphero.
         """
-        if self._bluetooth_interface:
-            self._bluetooth_interface.disconnect()
+        if self._transport:
+            self._write_coalescer.flush()
+            self._transport.close()
+
+        self._receive_worker.stop()
+        self.stop_wire_capture()
+
+    def start_wire_capture(self,
+                           path,
+                           segment_size_in_bytes=None,
+                           flush_interval_in_seconds=None):
+        """Starts recording every received and sent byte to a file.
+
+        Each chunk of received data and each transport write
+        is appended as a record with its time.monotonic_ns() time.
+        See WireCapture for the file format,
+        and WireCapture.read to read a capture back.
+        The capture is closed by stop_wire_capture or disconnect.
+
+        Args:
+            path (str):
+                The file to write. Replaced if it exists.
+            segment_size_in_bytes (int, None):
+                How much the file grows by at a time.
+                If None, uses WireCapture.DEFAULT_SEGMENT_SIZE_IN_BYTES.
+            flush_interval_in_seconds (float, None):
+                How long written records wait to be flushed to disk.
+                If None, uses WireCapture.DEFAULT_FLUSH_INTERVAL_IN_SECONDS.
+
+        Returns:
+            The WireCapture.
+        """
+        if self._wire_capture is not None:
+            raise SpheroError('A wire capture is already running.')
+
+        if segment_size_in_bytes is None:
+            segment_size_in_bytes = WireCapture.DEFAULT_SEGMENT_SIZE_IN_BYTES
+        if flush_interval_in_seconds is None:
+            flush_interval_in_seconds = WireCapture.DEFAULT_FLUSH_INTERVAL_IN_SECONDS
+        self._wire_capture = WireCapture(path, segment_size_in_bytes, flush_interval_in_seconds)
+        self._receive_worker.record_received = self._wire_capture.append
+        return self._wire_capture
+
+    def stop_wire_capture(self):
+        """Stops recording and closes the capture file, if a capture is running."""
+        wire_capture = self._wire_capture
+        self._wire_capture = None
+        self._receive_worker.record_received = None
+        if wire_capture is not None:
+            wire_capture.close()
+
+    @property
+    def wire_capture(self):
+        """The running WireCapture, or None."""
+        return self._wire_capture
+
+    def events(self,
+               kind,
+               maxsize=DEFAULT_EVENT_STREAM_MAXSIZE,
+               overflow='drop_oldest'):
+        """Subscribes to events of one kind.
+
+        Must be called from a coroutine.
+        Events are delivered to the returned stream
+        on the calling coroutine's event loop.
+        Each stream has its own bounded buffer,
+        so a slow consumer only loses its own events.
+
+        Usage:
+            async with sphero.events(spheropy.EventKind.COLLISION) as collisions:
+                async for collision_info in collisions:
+                    await sphero.roll(0, 0)
+
+        Args:
+            kind (spheropy.EventKind or int):
+                The kind of events to receive,
+                or an ID code added with register_async_message.
+                The events are the same values passed to the callbacks.
+            maxsize (int, DEFAULT_EVENT_STREAM_MAXSIZE):
+                The maximum number of events buffered for the stream.
+            overflow (str, 'drop_oldest'):
+                What to do with a new event when the buffer is full.
+                'drop_oldest' drops the oldest buffered event
+                and 'drop_newest' drops the new event.
+
+        Returns:
+            An EventStream. Close it to unsubscribe.
+        """
+        entry = self._get_async_dispatch_entry(kind)
+        stream = EventStream(kind,
+                             maxsize,
+                             overflow,
+                             asyncio.get_running_loop(),
+                             self._remove_event_stream)
+        with self._event_streams_lock:
+            entry.streams.append(stream)
+        return stream
+
+    @property
+    def on_collision(self):
+        """The list of callbacks called with a CollisionInfo for each collision."""
+        return self._async_dispatch[EventKind.COLLISION.value].callbacks
+
+    @on_collision.setter
+    def on_collision(self, callbacks):
+        self._async_dispatch[EventKind.COLLISION.value].callbacks = list(callbacks)
+
+    @property
+    def on_power_state_change(self):
+        """The list of callbacks called with the new power state (int)."""
+        return self._async_dispatch[EventKind.POWER_STATE_CHANGE.value].callbacks
+
+    @on_power_state_change.setter
+    def on_power_state_change(self, callbacks):
+        self._async_dispatch[EventKind.POWER_STATE_CHANGE.value].callbacks = list(callbacks)
+
+    @property
+    def on_self_level_complete(self):
+        """The list of callbacks called with a SelfLevelResult when self level finishes."""
+        return self._async_dispatch[EventKind.SELF_LEVEL_COMPLETE.value].callbacks
+
+    @on_self_level_complete.setter
+    def on_self_level_complete(self, callbacks):
+        self._async_dispatch[EventKind.SELF_LEVEL_COMPLETE.value].callbacks = list(callbacks)
+
+    def subscribe(self, kind, callback):
+        """Adds a callback for asynchronous events of one kind.
+
+        Callbacks run the same way as the ones in on_collision.
+        See the class docstring.
+
+        Args:
+            kind (spheropy.EventKind or int):
+                The kind of events,
+                or an ID code added with register_async_message.
+            callback (callable):
+                A coroutine function or regular function
+                called with each event's parsed data.
+        """
+        self._get_async_dispatch_entry(kind).callbacks.append(callback)
+
+    def unsubscribe(self, kind, callback):
+        """Removes a callback added with subscribe.
+
+        Raises:
+            ValueError if the callback is not subscribed to kind.
+        """
+        self._get_async_dispatch_entry(kind).callbacks.remove(callback)
+
+    def register_async_message(self, id_code, parse=bytes):
+        """Adds or replaces the parser of an asynchronous message ID code.
+
+        Use this to handle messages from newer firmware,
+        or to parse a message differently than this package does.
+        Afterwards, id_code can be passed to subscribe and events.
+
+        Args:
+            id_code (int):
+                The asynchronous message ID code.
+                Valid range is [0, 255].
+            parse (callable, bytes):
+                Called with the message's data (a bytes-like object)
+                and returns the event passed to callbacks and streams.
+                Must not keep a reference to the data.
+        """
+        if id_code < 0 or id_code > 0xFF:
+            raise ValueError(
+                f'id_code must be in the range [0, 255]. id_code was {id_code}')
+
+        entry = self._async_dispatch.get(id_code)
+        if entry is None:
+            self._async_dispatch[id_code] = _AsyncDispatchEntry(id_code, parse)
+        else:
+            entry.parse = parse
+            # Host timestamps are only added to this package's records.
+            entry.stamp = None
+
+    @property
+    def async_message_stats(self):
+        """Counts of the asynchronous messages received, by ID code.
+
+        Returns:
+            An AsyncMessageStats namedtuple.
+
+            received (dict):
+                Maps ID codes to the number of messages received.
+            unhandled (dict):
+                Maps ID codes to the number of messages thrown away
+                because no callback or stream was subscribed,
+                or no parser was registered.
+        """
+        return AsyncMessageStats(dict(self._async_message_counts),
+                                 dict(self._unhandled_async_message_counts))
+
+    def batch(self, response_timeout_in_seconds=None):
+        """Groups commands so they are sent together.
+
+        Commands sent inside the batch are not sent right away.
+        When the batch exits, they are packed in order
+        into as few transport writes as possible
+        and only the last command waits for a response.
+        Since the Sphero handles commands in order,
+        the response to the last command means the whole group was handled.
+
+        Commands that return data (get_* methods) cannot be batched.
+
+        The batch belongs to the task that opened it.
+        Commands sent to this Sphero from any other task,
+        including tasks started inside the batch body,
+        are sent right away.
+
+        If the batch body raises, the batched commands are not sent.
+        A SpheroError naming the dropped commands is raised
+        from the body's exception,
+        unless the body was cancelled.
+
+        Usage:
+            async with sphero.batch():
+                await sphero.set_rgb_led(red=0xFF)
+                await sphero.set_heading(90)
+                await sphero.roll(64, 90)
+
+        Args:
+            response_timeout_in_seconds (float, None):
+                The amount of time to wait for the response
+                to the last command.
+                If not specified or None, uses the default timeout
+                passed in the constructor of this Sphero.
+        """
+        return _CommandBatch(self, response_timeout_in_seconds)
+
+    def setpoint_channel(self, kind):
+        """Creates a latest-value-wins channel for a setpoint command.
+
+        Control loops that produce setpoints faster than the link can carry them
+        should update a channel instead of awaiting every command.
+        The channel has at most one command in flight.
+        A setpoint that is replaced before it is sent is dropped,
+        so control latency stays bounded by one round trip.
+
+        Must be called from a coroutine running on the event loop
+        the channel will be used from.
+
+        Usage:
+            channel = sphero.setpoint_channel(spheropy.SetpointKind.ROLL)
+            channel.update(64, 90)
+            ...
+            await channel.close()
+
+        Args:
+            kind (spheropy.SetpointKind):
+                The setpoint command to drive.
+                ROLL takes the arguments of roll,
+                RGB_LED of set_rgb_led,
+                BACK_LED of set_back_led
+                and HEADING of set_heading.
+
+        Returns:
+            A SetpointChannel.
+        """
+        send_functions = {
+            SetpointKind.ROLL: self.roll,
+            SetpointKind.RGB_LED: self.set_rgb_led,
+            SetpointKind.BACK_LED: self.set_back_led,
+            SetpointKind.HEADING: self.set_heading,
+        }
+        if kind not in send_functions:
+            raise ValueError(f'Unknown SetpointKind: {kind}')
+
+        return SetpointChannel(send_functions[kind])
+
+    @property
+    def rtt_estimate(self):
+        """The current round trip time estimate for this connection.
+
+        Every acknowledged command updates the estimate
+        with a TCP style smoothed mean and variance (RFC 6298).
+
+        Returns:
+            RttEstimate namedtuple.
+
+            smoothed_rtt_in_seconds (float):
+                The smoothed round trip time, or None before the first sample.
+            rtt_variation_in_seconds (float):
+                The smoothed mean deviation of the round trip time,
+                or None before the first sample.
+            response_timeout_in_seconds (float):
+                The timeout used for commands that do not specify one.
+            sample_count (int):
+                The number of round trip times measured.
+        """
+        return self._rtt_estimator.estimate
+
+    def set_response_timeout_override(self, device_id, command_id, response_timeout_in_seconds):
+        """Sets the response timeout for a command.
+
+        Used when the command is sent without its own timeout,
+        instead of the default or adaptive timeout.
+
+        Args:
+            device_id (int):
+                The device id of the command.
+            command_id (int):
+                The command id of the command.
+            response_timeout_in_seconds (float):
+                The amount of time to wait for the command's response.
+                None removes the override.
+        """
+        if response_timeout_in_seconds is None:
+            self._response_timeout_overrides.pop((device_id, command_id), None)
+        else:
+            self._response_timeout_overrides[(device_id, command_id)] = response_timeout_in_seconds
+
+    @property
+    def retry_stats(self):
+        """Statistics about automatic retries.
+
+        Only commands that wait for a response and are idempotent
+        (safe to send more than once) are retried.
+        Queries, ping, LED, heading, roll and configuration commands
+        are idempotent. self_level(start=True) is not.
+
+        Returns:
+            RetryStats namedtuple.
+
+            commands (int):
+                The number of commands sent that waited for a response.
+            retries (int):
+                The number of times a command was sent again after a timeout.
+            recovered (int):
+                The number of commands that succeeded after being retried.
+            failed (int):
+                The number of commands that raised CommandTimedOutError.
+        """
+        return RetryStats(*self._retry_counters)
+
+    @property
+    def callback_stats(self):
+        """Statistics of each event callback that has been called.
+
+        Returns:
+            A dict mapping each callback to a CallbackStats namedtuple.
+
+            calls (int):
+                The number of times the callback finished.
+            pending (int):
+                The number of events waiting for the callback.
+            mean_delay_in_seconds (float):
+                The mean time from an event being received
+                until the callback started handling it.
+            max_delay_in_seconds (float):
+                The largest delay.
+            mean_run_time_in_seconds (float):
+                The mean time the callback took.
+                For coroutine functions this includes the time spent awaiting.
+            max_run_time_in_seconds (float):
+                The largest run time.
+            last_run_time_in_seconds (float):
+                The run time of the last call.
+            errors (int):
+                The number of calls that raised an exception.
+            last_error (Exception):
+                The last exception raised by the callback.
+        """
+        return self._callback_dispatcher.stats
+
+    @property
+    def receive_stats(self):
+        """Statistics of received data.
+
+        Received data is decoded on the event loop,
+        or on an IoReactor thread if one was passed to the constructor.
+        Command responses are handled as soon as they are received.
+        Asynchronous packets (collisions, power notifications, ...)
+        are queued and handled a few at a time,
+        so a high notification rate does not delay command responses.
+        See receive_queue_size and receive_overflow.
+        Responses, and notifications, are each handled in the order they are received.
+
+        Returns:
+            A ReceiveStats namedtuple.
+
+            queue_depth (int):
+                The number of asynchronous packets waiting to be handled.
+            peak_queue_depth (int):
+                The high-water mark of queue_depth.
+            max_queue_size (int):
+                The size of the queue.
+            chunks (int):
+                The number of received chunks.
+            bytes (int):
+                The number of received bytes.
+            packets (int):
+                The number of valid packets handled.
+            dropped (int):
+                The number of asynchronous packets dropped
+                because the queue was full.
+            reader_blocks (int):
+                The number of times the receiving thread
+                waited for room in the queue.
+            mean_ack_lag_in_seconds (float):
+                The mean time from receiving a command response
+                until it was handled.
+            max_ack_lag_in_seconds (float):
+                The largest command response lag.
+            mean_lag_in_seconds (float):
+                The mean time from receiving an asynchronous packet
+                until it was handled.
+            max_lag_in_seconds (float):
+                The largest lag.
+            last_lag_in_seconds (float):
+                The lag of the last packet.
+            errors (int):
+                The number of errors raised while handling packets.
+            last_error (Exception):
+                The last error raised while handling a packet.
+        """
+        return self._receive_worker.stats
+
+    @property
+    def send_queue_stats(self):
+        """Queueing delay statistics for each CommandPriority class.
+
+        The queueing delay is the time from a command being sent
+        until it is written to the bluetooth interface,
+        including time spent waiting for the command window.
+
+        Commands are sent in CommandPriority order.
+        Roll commands are CONTROL commands
+        and a roll that stops the Sphero jumps ahead of every other command,
+        including commands waiting for the command window.
+        Roll commands that have not been written yet
+        when a stop is sent are dropped
+        and raise CommandPreemptedError if they wait for a response.
+
+        Returns:
+            A dict mapping each CommandPriority to a QueueDelayStats namedtuple.
+
+            count (int):
+                The number of commands written.
+            mean_delay_in_seconds (float):
+                The mean queueing delay.
+            max_delay_in_seconds (float):
+                The largest queueing delay.
+            last_delay_in_seconds (float):
+                The queueing delay of the last command written.
+        """
+        return self._send_scheduler.stats
+
+    @property
+    def command_window_stats(self):
+        """Statistics about the in-flight command window.
+
+        Useful for sizing max_commands_in_flight
+        for the bandwidth-delay product of the link.
+
+        Returns:
+            CommandWindowStats namedtuple.
+
+            window_size (int):
+                The maximum number of commands in flight.
+            in_flight (int):
+                The number of commands currently waiting for a response.
+            peak_in_flight (int):
+                The highest number of commands that were in flight at once.
+            mean_in_flight (float):
+                The time weighted average number of commands in flight.
+            total_commands (int):
+                The number of commands that entered the window.
+            total_waits (int):
+                The number of commands that had to wait for the window.
+            total_wait_time_in_seconds (float):
+                The total time commands spent waiting for the window.
+        """
+        return self._command_window.stats
 
     async def ping(self,
                    wait_for_response=True,
@@ -148,9 +863,11 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_ping_command(self._get_and_increment_command_sequence_number(),
-                                       wait_for_response=wait_for_response,
-                                       reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_PING,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds)
@@ -186,14 +903,16 @@ class Sphero(object):
             firmware_api_major_revision (int):
             firmware_api_minor_revision (int):
         """
-        command = _create_get_version_command(self._get_and_increment_command_sequence_number(),
-                                              wait_for_response=True,
-                                              reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_GET_VERSION,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         response_packet = await self._send_command(command,
                                                    response_timeout_in_seconds)
 
-        return _parse_version_info(response_packet.data)
+        return _GET_VERSION.decode_response(response_packet.data)
 
     async def set_device_name(self,
                               device_name,
@@ -220,10 +939,11 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_set_device_name_command(device_name=device_name,
-                                                  sequence_number=self._get_and_increment_command_sequence_number(),
-                                                  wait_for_response=wait_for_response,
-                                                  reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_DEVICE_NAME,
+                                  device_name.encode('utf-8'),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds)
@@ -248,14 +968,16 @@ class Sphero(object):
             bluetooth_address (str):
             id_colors (str):
         """
-        command = _create_get_bluetooth_info_command(sequence_number=self._get_and_increment_command_sequence_number(),
-                                                     wait_for_response=True,
-                                                     reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_GET_BLUETOOTH_INFO,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         response_packet = await self._send_command(command,
                                                    response_timeout_in_seconds)
 
-        return _parse_bluetooth_info(response_packet.data)
+        return _GET_BLUETOOTH_INFO.decode_response(response_packet.data)
 
     async def set_auto_reconnect(self,
                                  should_enable_auto_reconnect,
@@ -288,11 +1010,12 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_set_auto_reconnect_command(should_enable_auto_reconnect=should_enable_auto_reconnect,
-                                                     seconds_after_boot=seconds_after_boot,
-                                                     sequence_number=self._get_and_increment_command_sequence_number(),
-                                                     wait_for_response=wait_for_response,
-                                                     reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_AUTO_RECONNECT,
+                                  (1 if should_enable_auto_reconnect else 0,
+                                   seconds_after_boot),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds)
@@ -319,14 +1042,16 @@ class Sphero(object):
             total_number_of_recharges (int):
             seconds_awake_since_last_recharge (int):
         """
-        command = _create_get_auto_reconnect_command(sequence_number=self._get_and_increment_command_sequence_number(),
-                                                     wait_for_response=True,
-                                                     reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_GET_AUTO_RECONNECT,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         response_packet = await self._send_command(command,
                                                    response_timeout_in_seconds=response_timeout_in_seconds)
 
-        return _parse_auto_reconnect_info(response_packet.data)
+        return _GET_AUTO_RECONNECT.decode_response(response_packet.data)
 
     BATTERY_STATE_CHARGING = 0x01
     BATTERY_STATE_OK = 0x02
@@ -373,14 +1098,16 @@ class Sphero(object):
                 Seconds awake since last recharge.
                 Unsigned 16-bit value.
         """
-        command = _create_get_power_state_command(sequence_number=self._get_and_increment_command_sequence_number(),
-                                                  wait_for_response=True,
-                                                  reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_GET_POWER_STATE,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         response_packet = await self._send_command(command,
                                                    response_timeout_in_seconds=response_timeout_in_seconds)
 
-        return _parse_power_state(response_packet.data)
+        return _GET_POWER_STATE.decode_response(response_packet.data)
 
     # TODO: rename to something better if possible
     # maybe enable_power_notifications
@@ -411,10 +1138,11 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_set_power_notification_command(should_enable,
-                                                         sequence_number=self._get_and_increment_command_sequence_number(),
-                                                         wait_for_response=wait_for_response,
-                                                         reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_POWER_NOTIFICATION,
+                                  (1 if should_enable else 0,),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds=response_timeout_in_seconds)
@@ -450,10 +1178,11 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_set_heading_command(heading=heading,
-                                              sequence_number=self._get_and_increment_command_sequence_number(),
-                                              wait_for_response=wait_for_response,
-                                              reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_HEADING,
+                                  (heading,),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds=response_timeout_in_seconds)
@@ -487,10 +1216,11 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_set_stabilization_command(stabilization=stabilization,
-                                                    sequence_number=self._get_and_increment_command_sequence_number(),
-                                                    wait_for_response=wait_for_response,
-                                                    reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_STABILIZATION,
+                                  (1 if stabilization else 0,),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds=response_timeout_in_seconds)
@@ -554,15 +1284,17 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_self_level_command(start,
-                                             use_original_heading,
-                                             sleep,
-                                             turn_on_control_system,
-                                             angle_limit,
-                                             timeout,
-                                             true_time,
-                                             self._get_and_increment_command_sequence_number(),
-                                             wait_for_response, reset_inactivity_timeout)
+        options = ((1 if start else 0) |
+                   (1 if use_original_heading else 0) << 1 |
+                   (1 if sleep else 0) << 2 |
+                   (1 if turn_on_control_system else 0) << 3)
+        command = _create_command(_SELF_LEVEL,
+                                  (options, angle_limit, timeout, true_time),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
+        # Starting the routine again would restart it, aborting it is safe to repeat.
+        command.is_idempotent = not start
 
         await self._send_command(command, response_timeout_in_seconds)
 
@@ -600,13 +1332,14 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero.
         """
-        command = _create_configure_collision_detection_command(turn_on_collision_detection=turn_on_collision_detection,
-                                                                x_t=x_t, x_speed=x_speed,
-                                                                y_t=y_t, y_speed=y_speed,
-                                                                collision_dead_time=collision_dead_time,
-                                                                sequence_number=self._get_and_increment_command_sequence_number(),
-                                                                wait_for_response=wait_for_response,
-                                                                reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_CONFIGURE_COLLISION_DETECTION,
+                                  (1 if turn_on_collision_detection else 0,
+                                   x_t, x_speed,
+                                   y_t, y_speed,
+                                   collision_dead_time),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds)
@@ -621,12 +1354,13 @@ class Sphero(object):
                                 response_timeout_in_seconds=None):
         """
         """
-        command = _create_configure_locator_command(enable_auto_yaw_tare_correction=enable_auto_yaw_tare_correction,
-                                                    pos_x=pos_x, pos_y=pos_y,
-                                                    yaw_tare=yaw_tare,
-                                                    sequence_number=self._get_and_increment_command_sequence_number(),
-                                                    wait_for_response=wait_for_response,
-                                                    reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_CONFIGURE_LOCATOR,
+                                  (0x80 if enable_auto_yaw_tare_correction else 0x00,
+                                   pos_x, pos_y,
+                                   yaw_tare),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds)
@@ -666,11 +1400,238 @@ class Sphero(object):
                 speed_over_ground (int):
                     The speed over ground in unsigned cm/sec.
         """
-        command = _create_read_locator_command(sequence_number=self._get_and_increment_command_sequence_number(),
-                                               wait_for_response=True,
-                                               reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_READ_LOCATOR,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
         response_packet = await self._send_command(command, response_timeout_in_seconds)
-        return _parse_locator_info(response_packet.data)
+        return _READ_LOCATOR.decode_response(response_packet.data)
+
+    async def start_streaming(self,
+                              channels,
+                              rate_hz=10,
+                              frames_per_packet=1,
+                              packet_count=0,
+                              reset_inactivity_timeout=True,
+                              response_timeout_in_seconds=None):
+        """Starts streaming sensor data.
+
+        The Sphero samples the channels at rate_hz
+        and sends frames_per_packet samples in each packet.
+        Each packet is published as an EventKind.SENSOR_DATA event:
+        a NumPy structured array with one element per sample,
+        a 'time' field with the sample's host time (see streaming_stats)
+        and one float64 field per channel, scaled to the channel's units.
+        See SensorChannel.
+        Replaces the channels of a stream that is already running.
+
+        Requires NumPy.
+
+        Usage:
+            await sphero.start_streaming(spheropy.SensorChannel.ACCELEROMETER
+                                         | spheropy.SensorChannel.IMU_ANGLES,
+                                         rate_hz=100,
+                                         frames_per_packet=10)
+            async with sphero.events(spheropy.EventKind.SENSOR_DATA) as batches:
+                async for batch in batches:
+                    print(batch['accel_z'].mean(), batch['imu_yaw'][-1])
+
+        Args:
+            channels (SensorChannel):
+                The channels to stream.
+            rate_hz (float, 10):
+                The sample rate.
+                Valid range is (0, MAX_STREAMING_RATE_HZ].
+                The Sphero samples at MAX_STREAMING_RATE_HZ divided by an integer,
+                so the rate is rounded to the closest one it supports.
+            frames_per_packet (int, 1):
+                The number of samples in each packet.
+                Valid range is [1, 255].
+                More samples per packet costs less bandwidth and CPU
+                at the expense of latency.
+            packet_count (int, 0):
+                The number of packets to send before stopping.
+                Valid range is [0, 255].
+                0 streams until stop_streaming is called.
+            reset_inactivity_timeout (bool, True):
+                If True, will reset the inactivity timer on the Sphero.
+            response_timeout_in_seconds (float, None):
+                The amount of time to wait for a response.
+                If not specified or None, uses the default timeout
+                passed in the constructor of this Sphero.
+
+        Returns:
+            The sample rate in Hz the Sphero streams at.
+        """
+        if not (HAS_NUMPY and USE_NUMPY):
+            raise RuntimeError('Could not import numpy, which sensor data streaming requires.')
+
+        if rate_hz <= 0 or rate_hz > self.MAX_STREAMING_RATE_HZ:
+            raise ValueError(
+                f'rate_hz must be in the range (0, {self.MAX_STREAMING_RATE_HZ}]. rate_hz was {rate_hz}')
+
+        decoder = _SensorDataDecoder(channels)
+        rate_divisor = min(max(1, round(self.MAX_STREAMING_RATE_HZ / rate_hz)), 0xFFFF)
+        command = _create_command(_SET_DATA_STREAMING,
+                                  (rate_divisor,
+                                   frames_per_packet,
+                                   decoder.mask,
+                                   packet_count,
+                                   decoder.mask2),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
+
+        # Packets for the new channels can arrive before the response.
+        streaming_rate_hz = self.MAX_STREAMING_RATE_HZ / rate_divisor
+        self._sensor_stream_tracker = _SensorStreamTracker(streaming_rate_hz)
+        entry = self._async_dispatch[EventKind.SENSOR_DATA.value]
+        entry.parse = decoder.decode
+        entry.stamp = self._stamp_sensor_data
+        await self._send_command(command, response_timeout_in_seconds)
+        self._streaming_rate_hz = streaming_rate_hz
+        return streaming_rate_hz
+
+    async def stop_streaming(self,
+                             wait_for_response=True,
+                             reset_inactivity_timeout=True,
+                             response_timeout_in_seconds=None):
+        """Stops streaming sensor data.
+
+        Args:
+            wait_for_response (bool, True):
+                If True, will wait for a response from the Sphero
+            reset_inactivity_timeout (bool, True):
+                If True, will reset the inactivity timer on the Sphero.
+            response_timeout_in_seconds (float, None):
+                The amount of time to wait for a response.
+                If not specified or None, uses the default timeout
+                passed in the constructor of this Sphero.
+        """
+        command = _create_command(_SET_DATA_STREAMING,
+                                  (1, 1, 0, 0, 0),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
+
+        await self._send_command(command, response_timeout_in_seconds)
+        self._streaming_rate_hz = None
+
+    @property
+    def streaming_rate_hz(self):
+        """The sample rate of the sensor data stream, or None if not streaming."""
+        return self._streaming_rate_hz
+
+    @property
+    def streaming_stats(self):
+        """Statistics of the last sensor data stream.
+
+        Streamed samples carry no timestamp, only their place in the stream.
+        Their host times come from a clock model fitted to the packets' arrival times.
+        A lost packet makes every later packet arrive
+        a whole packet period later than the samples counted so far predict,
+        which is how dropped samples are detected.
+        Batches received just before a drop is detected
+        are timestamped up to the dropped duration early.
+
+        Returns:
+            A SensorStreamStats namedtuple, or None if nothing was streamed.
+
+            rate_hz (float):
+                The sample rate.
+            packets (int):
+                The number of packets received.
+            samples (int):
+                The number of samples received.
+            dropped_samples (int):
+                The number of samples detected as lost.
+            drops (int):
+                The number of times samples were lost.
+            drift_ppm (float):
+                How much faster the Sphero's sample clock runs
+                than the host clock, in parts per million.
+        """
+        tracker = self._sensor_stream_tracker
+        return None if tracker is None else tracker.stats
+
+    async def sync_clock(self,
+                         round_trips=8,
+                         response_timeout_in_seconds=None):
+        """Measures the Sphero's clock against the host's.
+
+        Sends round_trips poll packet times commands.
+        The Sphero's receive and transmit times in each response
+        are bracketed by the host's send and receive times.
+        Together with the arrival of timestamped records (collisions),
+        they fit the clock model that sets CollisionInfo.host_time
+        and that device_time_to_host_time uses.
+        Call again now and then to keep track of drift.
+
+        Args:
+            round_trips (int, 8):
+                The number of measurements.
+            response_timeout_in_seconds (float, None):
+                The amount of time to wait for each response.
+                If not specified or None, uses the default timeout
+                passed in the constructor of this Sphero.
+
+        Returns:
+            A ClockEstimate namedtuple. See clock_estimate.
+        """
+        for _ in range(round_trips):
+            host_send_time = time.monotonic()
+            command = _create_command(_POLL_PACKET_TIMES,
+                                      (int(host_send_time * 1000) & 0xFFFFFFFF,),
+                                      sequence_number=self._get_and_increment_command_sequence_number(),
+                                      wait_for_response=True,
+                                      reset_inactivity_timeout=False)
+            response_packet = await self._send_command(command, response_timeout_in_seconds)
+            host_receive_time = response_packet.receive_time or time.monotonic()
+            _, device_receive_time, device_transmit_time = _POLL_PACKET_TIMES.decode_response(
+                response_packet.data)
+            self._device_clock.add_round_trip(host_send_time,
+                                              device_receive_time,
+                                              device_transmit_time,
+                                              host_receive_time)
+
+        return self.clock_estimate
+
+    @property
+    def clock_estimate(self):
+        """The model of the Sphero's millisecond clock.
+
+        host time = offset + device time * (1 + drift)
+        in seconds of time.monotonic().
+
+        Returns:
+            A ClockEstimate namedtuple.
+
+            offset_in_seconds (float):
+                The host time of device time 0. None until the first measurement.
+            drift_ppm (float):
+                How much faster the Sphero's clock runs, in parts per million.
+            round_trips (int):
+                The number of sync_clock measurements.
+            arrivals (int):
+                The number of timestamped records received.
+            min_rtt_in_seconds (float):
+                The fastest round trip, which bounds the offset's error
+                to half its value. None without round trips.
+        """
+        return self._device_clock.stats
+
+    def device_time_to_host_time(self, device_time_in_ms):
+        """Converts a time of the Sphero's millisecond clock to host time.
+
+        Args:
+            device_time_in_ms (int):
+                A device timestamp, like CollisionInfo.timestamp.
+
+        Returns:
+            The time.monotonic() time, or None if the clock was never measured.
+        """
+        return self._device_clock.to_host_time(device_time_in_ms)
 
     async def set_rgb_led(self,
                           red=0,
@@ -712,13 +1673,12 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero object.
         """
-        command = _create_set_rgb_led_command(red,
-                                              green,
-                                              blue,
-                                              save_as_user_led_color,
-                                              sequence_number=self._get_and_increment_command_sequence_number(),
-                                              wait_for_response=wait_for_response,
-                                              reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_RGB_LED,
+                                  (red, green, blue,
+                                   1 if save_as_user_led_color else 0),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command,
                                  response_timeout_in_seconds=response_timeout_in_seconds)
@@ -745,15 +1705,16 @@ class Sphero(object):
             The user LED color as a list in the form
             [red, green, blue].
         """
-        command = _create_get_rgb_led_command(sequence_number=self._get_and_increment_command_sequence_number(),
-                                              # must wait for the response to get the result.
-                                              wait_for_response=True,
-                                              reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_GET_RGB_LED,
+                                  (),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=True,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         response_packet = await self._send_command(command,
                                                    response_timeout_in_seconds)
 
-        return response_packet.data
+        return _GET_RGB_LED.decode_response(response_packet.data)
 
     async def set_back_led(self,
                            brightness,
@@ -777,10 +1738,11 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero object.
         """
-        command = _create_set_back_led_output_command(brightness=brightness,
-                                                      sequence_number=self._get_and_increment_command_sequence_number(),
-                                                      wait_for_response=wait_for_response,
-                                                      reset_inactivity_timeout=reset_inactivity_timeout)
+        command = _create_command(_SET_BACK_LED_OUTPUT,
+                                  (brightness,),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
         await self._send_command(command, response_timeout_in_seconds)
 
@@ -821,182 +1783,1851 @@ class Sphero(object):
                 If not specified or None, uses the default timeout
                 passed in the constructor of this Sphero object.
         """
-        command = _create_roll_command(speed,
-                                       heading_in_degrees,
-                                       mode,
-                                       sequence_number=self._get_and_increment_command_sequence_number(),
-                                       wait_for_response=wait_for_response,
-                                       reset_inactivity_timeout=reset_inactivity_timeout)
+        speed, state = _get_roll_speed_and_state(speed, mode)
+        command = _create_command(_ROLL,
+                                  (speed, heading_in_degrees, state),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
+        command.is_emergency_stop = state == 0
 
         await self._send_command(command, response_timeout_in_seconds)
 
-# endregion Sphero public members
-
-# region Sphero private members
+    async def set_raw_motor_values(self,
+                                   left_mode,
+                                   left_power,
+                                   right_mode,
+                                   right_power,
+                                   wait_for_response=True,
+                                   reset_inactivity_timeout=True,
+                                   response_timeout_in_seconds=None):
+        """Drives the left and right motors directly.
+
+        This allows you to take over one or both of the motor output values,
+        instead of having the stabilization system control them.
+        Each motor (left and right) requires a mode and a power value.
+        Stabilization should be turned off with set_stabilization first.
 
-    async def _send_command(self,
-                            command,
-                            response_timeout_in_seconds):
-        """
+        Args:
+            left_mode (spheropy.RawMotorMode):
+                The mode for the left motor.
+            left_power (int):
+                The power for the left motor.
+                Valid range is [0, 255].
+            right_mode (spheropy.RawMotorMode):
+                The mode for the right motor.
+            right_power (int):
+                The power for the right motor.
+                Valid range is [0, 255].
+            wait_for_response (bool, True):
+                If True, will wait for a response from the Sphero
+            reset_inactivity_timeout (bool, True):
+                If True, will reset the inactivity timer on the Sphero.
+            response_timeout_in_seconds (float, None):
+                The amount of time to wait for a response.
+                If not specified or None, uses the default timeout
+                passed in the constructor of this Sphero object.
         """
-        response_event = threading.Event()
-        response_packet = None
-        if command.wait_for_response:
-            # define a generic response handler
-            # TODO: might need the ability to pass a custom handler
-            def handle_response(received_response_packet):
-                nonlocal response_packet
-                response_packet = received_response_packet
-                nonlocal response_event
-                response_event.set()
-
-            # Register the response handler for this commands sequence number
-            assert command.sequence_number not in self._commands_waiting_for_response, f'A response handler was already registered for the sequence number {command.sequence_number}'
-            self._commands_waiting_for_response[command.sequence_number] = handle_response
-
-        self._bluetooth_interface.send(command.bytes)
+        command = _create_command(_SET_RAW_MOTOR_VALUES,
+                                  (left_mode.value, left_power,
+                                   right_mode.value, right_power),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
-        # Wait for the response if necessary
-        if command.wait_for_response:
-            if response_timeout_in_seconds is None:
-                response_timeout_in_seconds = self._default_response_timeout_in_seconds
-
-            timed_out = not response_event.wait(response_timeout_in_seconds)
-            del self._commands_waiting_for_response[command.sequence_number]
-            response_event.clear()
-            if timed_out:
-                raise CommandTimedOutError()
+        await self._send_command(command, response_timeout_in_seconds)
 
-        return response_packet
+    async def send_raw(self,
+                       device_id,
+                       command_id,
+                       payload=b'',
+                       wait_for_response=True,
+                       reset_inactivity_timeout=True,
+                       response_timeout_in_seconds=None):
+        """Sends a command with a raw payload to the Sphero.
 
-    def _handle_data_received(self, received_data):
-        self._message_receive_queue.put(received_data)
-        if self._message_processing_thread is None or not self._message_processing_thread.is_alive():
-            self._message_processing_thread = threading.Thread(target=_process_messages,
-                                                               args=[self._message_receive_queue,
-                                                                     self._commands_waiting_for_response,
-                                                                     self.on_collision,
-                                                                     self.on_power_state_change,
-                                                                     self.on_self_level_complete])
-            self._message_processing_thread.start()
+        Useful for commands this package doesn't wrap yet.
+        The payload is sent as is, so multi-byte values must be big endian.
 
-    def _get_and_increment_command_sequence_number(self):
-        result = self._command_sequence_number
-        self._command_sequence_number += 1
+        Args:
+            device_id (int):
+                The device id of the command.
+            command_id (int):
+                The command id of the command.
+            payload (bytes, b''):
+                The data of the command.
+            wait_for_response (bool, True):
+                If True, will wait for a response from the Sphero
+            reset_inactivity_timeout (bool, True):
+                If True, will reset the inactivity timer on the Sphero.
+            response_timeout_in_seconds (float, None):
+                The amount of time to wait for a response.
+                If not specified or None, uses the default timeout
+                passed in the constructor of this Sphero object.
 
-        # Check if we have overflowed our sequence number byte.
-        # If we have, start the sequence back at 0.
-        if self._command_sequence_number > 0xFF:
-            self._command_sequence_number = 0x00
+        Returns:
+            The data of the response as bytes,
+            or None if wait_for_response is False.
+        """
+        if not 0 <= device_id <= 0xFF or not 0 <= command_id <= 0xFF:
+            raise ValueError('device_id and command_id must be in the range [0, 255].')
 
-        return result
+        if len(payload) > 0xFE:
+            raise ValueError(
+                f'payload must be at most 254 bytes long. payload was {len(payload)} bytes long')
 
+        command = _create_command(_create_raw_command_spec(device_id, command_id),
+                                  bytes(payload),
+                                  sequence_number=self._get_and_increment_command_sequence_number(),
+                                  wait_for_response=wait_for_response,
+                                  reset_inactivity_timeout=reset_inactivity_timeout)
 
-# endregion Sphero private members
+        response_packet = await self._send_command(command, response_timeout_in_seconds)
+        if response_packet is None:
+            return None
 
-# region Message processing
+        return response_packet.data
 
+# endregion Sphero public members
 
-def _process_messages(message_queue,
-                      commands_waiting_for_response,
-                      on_collision_callbacks,
-                      on_power_state_change_callbacks,
-                      on_self_level_complete_callbacks):
-    """Processes received messages."""
-    message = []
-    # Keep going as long as there is a message in the queue,
-    # or if we are still processing or looking for more data
-    # in message.
-    while (not message_queue.empty()) or message:
-        response_packet = None
-        message_part = message_queue.get()
-        if message_part is None:
-            return
+# region Sphero private members
 
-        message.extend(message_part)
-        response_packet = _parse_message(message)
-        if response_packet is not None:
-            if response_packet.is_async:
-                _handle_async_response(response_packet,
-                                       on_collision_callbacks,
-                                       on_power_state_change_callbacks,
-                                       on_self_level_complete_callbacks)
+    @staticmethod
+    def _create_bluetooth_interface(bluetooth_interface,
+                                    search_name,
+                                    address,
+                                    port,
+                                    use_ble):
+        # Create the bluetooth interface
+        global HAS_PYBLUEZ
+        global USE_PYBLUEZ
+        global HAS_PYGATT
+        global USE_PYGATT
+        global HAS_WINBLE
+        global USE_WINBLE
+        if bluetooth_interface is None:
+            if use_ble:
+                if (HAS_PYGATT and USE_PYGATT) or (HAS_WINBLE and USE_WINBLE):
+                    return BleInterface(
+                        search_name=search_name, address=address, port=port)
+                else:
+                    raise RuntimeError(
+                        'Could not import a bluetooth LE Library.')
+            else:
+                if HAS_PYBLUEZ and USE_PYBLUEZ:
+                    return BluetoothInterface(
+                        search_name=search_name, address=address, port=port)
+                else:
+                    raise RuntimeError(
+                        'Could not import a bluetooth (non-BLE) library.')
+
+        return bluetooth_interface
+
+    async def _send_command(self,
+                            command,
+                            response_timeout_in_seconds):
+        """Sends a command and waits for its response if requested.
+
+        Waiting for the response never blocks the event loop.
+        The response is delivered through a future bound to the loop
+        that sent the command. The future is completed directly
+        when the response is decoded on that loop,
+        and with call_soon_threadsafe otherwise.
+
+        Returns:
+            The _ResponsePacket for the command,
+            or None if the command did not wait for a response.
+        """
+        command_batch = _OPEN_COMMAND_BATCHES.get().get(self)
+        if command_batch is not None and command_batch.task is asyncio.current_task():
+            command_batch.add(command)
+            return None
+
+        return await self._send_command_group([command], response_timeout_in_seconds)
+
+    async def _send_command_group(self,
+                                  commands,
+                                  response_timeout_in_seconds):
+        """Sends commands in a single write and waits for the last one's response.
+
+        Only the last command can wait for a response.
+
+        Returns:
+            The _ResponsePacket for the last command,
+            or None if it did not wait for a response.
+        """
+        command = commands[-1]
+        priority = min(c.priority for c in commands)
+        send_time = time.monotonic()
+        if command.is_emergency_stop:
+            self._emergency_stop_generation += 1
+
+        for c in commands:
+            c.emergency_stop_generation = self._emergency_stop_generation
+
+        if not command.wait_for_response:
+            self._send_scheduler.submit(commands,
+                                        priority,
+                                        send_time,
+                                        self._is_preempted)
+            return None
+
+        can_retry = all(c.is_idempotent for c in commands)
+        retry_policy = self._retry_policy
+        start_time = send_time
+        attempt = 1
+        self._retry_counters[0] += 1
+        while True:
+            timeout = response_timeout_in_seconds
+            is_adaptive_timeout = False
+            if timeout is None:
+                timeout, is_adaptive_timeout = self._get_response_timeout(command)
+
+            if retry_policy.deadline_in_seconds is not None:
+                remaining_time = retry_policy.deadline_in_seconds - \
+                    (time.monotonic() - start_time)
+                if remaining_time < timeout:
+                    # A timeout cut short by the deadline says nothing about the link.
+                    timeout = max(remaining_time, 0)
+                    is_adaptive_timeout = False
+
+            try:
+                response_packet = await self._send_command_attempt(commands,
+                                                                   priority,
+                                                                   send_time,
+                                                                   timeout,
+                                                                   is_retry=attempt > 1,
+                                                                   is_adaptive_timeout=is_adaptive_timeout)
+            except CommandTimedOutError:
+                backoff = retry_policy.get_backoff(attempt)
+                can_retry_again = (can_retry and
+                                   attempt < retry_policy.max_attempts and
+                                   (retry_policy.deadline_in_seconds is None or
+                                    time.monotonic() - start_time + backoff < retry_policy.deadline_in_seconds))
+                if not can_retry_again:
+                    self._retry_counters[3] += 1
+                    raise
+
+                self._retry_counters[1] += 1
+                await asyncio.sleep(backoff)
+                attempt += 1
+                send_time = time.monotonic()
+                continue
+
+            if attempt > 1:
+                self._retry_counters[2] += 1
+
+            return response_packet
+
+    async def _send_command_attempt(self,
+                                    commands,
+                                    priority,
+                                    send_time,
+                                    response_timeout_in_seconds,
+                                    is_retry,
+                                    is_adaptive_timeout):
+        """Sends commands once and waits for the last one's response.
+
+        Only timeouts that came from the round trip time estimator
+        back the estimator off. Explicit and configured timeouts
+        don't change the timeout of other commands.
+
+        Raises:
+            CommandTimedOutError if the response does not arrive in time.
+        """
+        command = commands[-1]
+
+        # Wait for a free slot in the command window
+        # instead of overrunning the sequence number space.
+        # Emergency stops are allowed to exceed the window.
+        await self._command_window.acquire(priority,
+                                           can_exceed_window=command.is_emergency_stop)
+        try:
+            if self._is_preempted(command):
+                raise CommandPreemptedError()
+
+            command.write_time = None
+
+            event_loop = asyncio.get_event_loop()
+            response_future = event_loop.create_future()
+
+            # define a generic response handler
+            # TODO: might need the ability to pass a custom handler
+            def handle_response(received_response_packet):
+                # Called where received data is decoded,
+                # which is the command's event loop unless an IoReactor is used.
+                # Skip retries since the response may be for an earlier attempt
+                # (Karn's algorithm).
+                if command.write_time is not None and not is_retry:
+                    self._rtt_estimator.add_sample(time.monotonic() - command.write_time)
+
+                try:
+                    _call_on_loop(event_loop,
+                                  _set_future_result,
+                                  response_future,
+                                  received_response_packet)
+                except RuntimeError:
+                    # The event loop was closed before the response arrived.
+                    pass
+
+            def handle_preempted():
+                _call_on_loop(event_loop,
+                              _set_future_exception,
+                              response_future,
+                              CommandPreemptedError())
+
+            self._register_response_handler(command, handle_response)
+            try:
+                self._send_scheduler.submit(commands,
+                                            priority,
+                                            send_time,
+                                            self._is_preempted,
+                                            handle_preempted)
+
+                try:
+                    return await asyncio.wait_for(response_future, response_timeout_in_seconds)
+                except asyncio.TimeoutError:
+                    if is_adaptive_timeout:
+                        self._rtt_estimator.back_off()
+                    raise CommandTimedOutError()
+            finally:
+                del self._commands_waiting_for_response[command.sequence_number]
+        finally:
+            self._command_window.release()
+
+    def _get_response_timeout(self, command):
+        """Gets the response timeout for a command that did not specify one.
+
+        Returns:
+            The timeout in seconds and True if it came from the
+            round trip time estimator.
+        """
+        override = self._response_timeout_overrides.get((command.device_id, command.command_id))
+        if override is not None:
+            return override, False
+
+        if self._default_response_timeout_in_seconds is not None:
+            return self._default_response_timeout_in_seconds, False
+
+        return self._rtt_estimator.response_timeout, True
+
+    def _is_preempted(self, command):
+        """True if command is a motion command sent before the last emergency stop."""
+        return (command.is_motion and
+                not command.is_emergency_stop and
+                command.emergency_stop_generation != self._emergency_stop_generation)
+
+    def _write_to_transport(self, data):
+        wire_capture = self._wire_capture
+        if wire_capture is not None:
+            wire_capture.append(WireCapture.SENT, data)
+        self._transport.write(data)
+
+    def _register_response_handler(self, command, handler):
+        """Registers handler for the response to command.
+
+        If the command's sequence number was handed out again
+        while the command waited for the command window,
+        the command is given a new sequence number first.
+        """
+        with self._command_sequence_number_lock:
+            if command.sequence_number in self._commands_waiting_for_response:
+                command.sequence_number = self._get_and_increment_command_sequence_number()
+
+            self._commands_waiting_for_response[command.sequence_number] = handler
+
+    def _handle_data_received(self, received_data):
+        self._receive_worker.put(received_data)
+
+    def _handle_ack_packet(self, response_packet):
+        """Completes the command a response packet answers."""
+        _handle_sync_response(response_packet,
+                              self._commands_waiting_for_response)
+
+    def _handle_async_packet(self, response_packet):
+        """Parses an asynchronous packet and publishes its event."""
+        id_code = response_packet.id_code
+        self._async_message_counts[id_code] += 1
+        entry = self._async_dispatch.get(id_code)
+        if entry is None or not (entry.callbacks or entry.streams or entry.stamp):
+            # Don't pay for parsing what nobody will see.
+            self._unhandled_async_message_counts[id_code] += 1
+            return
+
+        value = entry.parse(response_packet.data)
+        if entry.stamp is not None:
+            receive_time = response_packet.receive_time
+            value = entry.stamp(value, time.monotonic() if receive_time is None else receive_time)
+
+        if entry.callbacks or entry.streams:
+            self._publish_event(entry, value)
+
+    def _stamp_collision(self, collision_info, receive_time):
+        """Feeds a collision's arrival to the device clock and sets its host_time."""
+        self._device_clock.add_arrival(collision_info.timestamp, receive_time)
+        return collision_info._replace(
+            host_time=self._device_clock.to_host_time(collision_info.timestamp))
+
+    def _stamp_sensor_data(self, batch, receive_time):
+        """Sets the host times of a sensor data batch."""
+        tracker = self._sensor_stream_tracker
+        if tracker is not None:
+            batch['time'] = tracker.stamp(len(batch), receive_time)
+        return batch
+
+    def _get_async_dispatch_entry(self, kind):
+        id_code = kind.value if isinstance(kind, EventKind) else kind
+        entry = self._async_dispatch.get(id_code)
+        if entry is None:
+            raise ValueError(
+                f'{kind!r} is not an EventKind or a registered asynchronous message ID code.')
+
+        return entry
+
+    def _publish_event(self, entry, value):
+        """Passes an event to its callbacks and streams."""
+        for callback in entry.callbacks:
+            self._callback_dispatcher.dispatch(callback, (value,))
+
+        if not entry.streams:
+            return
+
+        with self._event_streams_lock:
+            streams = tuple(entry.streams)
+        for stream in streams:
+            try:
+                _call_on_loop(stream.event_loop, stream._put, value)
+            except RuntimeError:
+                # The stream's event loop is closed.
+                self._remove_event_stream(stream)
+
+    def _remove_event_stream(self, stream):
+        entry = self._get_async_dispatch_entry(stream.kind)
+        with self._event_streams_lock:
+            streams = entry.streams
+            if stream in streams:
+                streams.remove(stream)
+
+    def _get_and_increment_command_sequence_number(self):
+        """Allocates the next sequence number that is not waiting for a response."""
+        with self._command_sequence_number_lock:
+            # The command window is never larger than 255
+            # so at least one sequence number is always free.
+            while True:
+                result = self._command_sequence_number
+
+                # Wrap back to 0 when we overflow the sequence number byte.
+                self._command_sequence_number = (self._command_sequence_number + 1) & 0xFF
+
+                if result not in self._commands_waiting_for_response:
+                    return result
+
+
+# endregion Sphero private members
+
+# region Message processing
+
+
+def _handle_sync_response(response_packet,
+                          commands_waiting_for_response):
+    """
+    """
+    # for ACK/synchronous responses we only need to call the registered
+    # callback.
+    sequence_number = response_packet.sequence_number
+    if sequence_number in commands_waiting_for_response:
+        # The response is completed on another thread,
+        # after the framer may have reused its buffer.
+        response_packet.detach()
+        # TODO: check to make sure handler is callable before invoking.
+        commands_waiting_for_response[sequence_number](response_packet)
+        # NOTE: it is up to the callback/waiting function to remove the
+        # handler.
+
+# endregion
+# endregion Sphero
+
+# region Retry Policy
+
+
+class RetryPolicy(object):
+    """Describes how idempotent commands are retried after a timeout.
+
+    The delay before retry n (starting at 1) is
+    initial_backoff_in_seconds * backoff_multiplier ** (n - 1),
+    capped at max_backoff_in_seconds
+    and reduced by a random fraction of up to jitter.
+
+    Args:
+        max_attempts (int, 3):
+            The maximum number of times a command is sent.
+            1 disables retries.
+        initial_backoff_in_seconds (float, 0.01):
+            The delay before the first retry.
+        max_backoff_in_seconds (float, 0.5):
+            The largest delay between retries.
+        backoff_multiplier (float, 2.0):
+            How much the delay grows with each retry.
+        jitter (float, 0.5):
+            The largest fraction of the delay that is randomly removed.
+            Valid range is [0, 1].
+        deadline_in_seconds (float, None):
+            The maximum total time spent on a command, including all attempts.
+            If None, there is no overall deadline.
+    """
+
+    def __init__(self,
+                 max_attempts=3,
+                 initial_backoff_in_seconds=0.01,
+                 max_backoff_in_seconds=0.5,
+                 backoff_multiplier=2.0,
+                 jitter=0.5,
+                 deadline_in_seconds=None):
+        if max_attempts < 1:
+            raise ValueError(
+                f'max_attempts must be at least 1. max_attempts was {max_attempts}')
+
+        if jitter < 0 or jitter > 1:
+            raise ValueError(
+                f'jitter must be in the range [0, 1]. jitter was {jitter}')
+
+        self.max_attempts = max_attempts
+        self.initial_backoff_in_seconds = initial_backoff_in_seconds
+        self.max_backoff_in_seconds = max_backoff_in_seconds
+        self.backoff_multiplier = backoff_multiplier
+        self.jitter = jitter
+        self.deadline_in_seconds = deadline_in_seconds
+
+    def get_backoff(self, attempt):
+        """Gets the delay in seconds before retrying after the given attempt.
+
+        Args:
+            attempt (int):
+                The attempt that timed out, starting at 1.
+        """
+        backoff = min(self.initial_backoff_in_seconds * self.backoff_multiplier ** (attempt - 1),
+                      self.max_backoff_in_seconds)
+        return backoff * (1 - self.jitter * random.random())
+
+
+RetryStats = namedtuple("RetryStats",
+                        ["commands",
+                         "retries",
+                         "recovered",
+                         "failed"])
+
+# endregion
+
+# region Setpoint Channel
+
+
+class SetpointChannel(object):
+    """Sends the latest of a stream of setpoints.
+
+    Created with Sphero.setpoint_channel.
+    Each setpoint is sent with wait_for_response=True
+    and the next one is only sent once the response arrives.
+    Setpoints that are replaced while waiting are dropped.
+
+    Args:
+        send_function (coroutine function):
+            The Sphero method used to send each setpoint.
+    """
+
+    def __init__(self, send_function):
+        self._send_function = send_function
+        self._pending_setpoint = None
+        self._pending_event = asyncio.Event()
+        self._idle_event = asyncio.Event()
+        self._idle_event.set()
+        self._num_updates = 0
+        self._num_sent = 0
+        self._num_dropped = 0
+        self._num_errors = 0
+        self._last_error = None
+        self._sender_task = asyncio.ensure_future(self._run_sender())
+
+    def update(self, *args, **kwargs):
+        """Sets the next setpoint to send.
+
+        Takes the same arguments as the channel's Sphero method,
+        except wait_for_response.
+        Replaces the pending setpoint if it has not been sent yet.
+        Does not wait for the setpoint to be sent.
+        """
+        if self._sender_task.done():
+            raise SpheroError('The setpoint channel is closed.')
+
+        if self._pending_setpoint is not None:
+            self._num_dropped += 1
+
+        self._num_updates += 1
+        self._pending_setpoint = (args, kwargs)
+        self._idle_event.clear()
+        self._pending_event.set()
+
+    async def feed(self, setpoints):
+        """Updates the channel from an async iterator of setpoints.
+
+        Returns once the iterator is exhausted
+        and the last setpoint has been sent.
+
+        Args:
+            setpoints (async iterable):
+                Each setpoint is a tuple of positional arguments
+                or a dict of keyword arguments for the channel's Sphero method.
+        """
+        async for setpoint in setpoints:
+            if isinstance(setpoint, dict):
+                self.update(**setpoint)
             else:
-                _handle_sync_response(response_packet,
-                                      commands_waiting_for_response)
+                self.update(*setpoint)
+
+        await self.drain()
+
+    async def drain(self):
+        """Waits until there is no pending or in flight setpoint."""
+        await self._idle_event.wait()
+
+    async def close(self):
+        """Stops the channel. Pending setpoints are dropped."""
+        self._sender_task.cancel()
+        try:
+            await self._sender_task
+        except asyncio.CancelledError:
+            pass
+
+        self._idle_event.set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    @property
+    def stats(self):
+        """Statistics about the channel.
+
+        Returns:
+            SetpointChannelStats namedtuple.
+
+            updates (int):
+                The number of setpoints passed to update.
+            sent (int):
+                The number of setpoints that were sent.
+            dropped (int):
+                The number of setpoints replaced before they were sent.
+            errors (int):
+                The number of setpoints that failed to send.
+            last_error (Exception):
+                The last error raised while sending a setpoint, or None.
+        """
+        return SetpointChannelStats(self._num_updates,
+                                    self._num_sent,
+                                    self._num_dropped,
+                                    self._num_errors,
+                                    self._last_error)
+
+    async def _run_sender(self):
+        while True:
+            await self._pending_event.wait()
+            self._pending_event.clear()
+            args, kwargs = self._pending_setpoint
+            self._pending_setpoint = None
+            try:
+                await self._send_function(*args, wait_for_response=True, **kwargs)
+                self._num_sent += 1
+            except (SpheroError, ValueError) as error:
+                self._num_errors += 1
+                self._last_error = error
+
+            if self._pending_setpoint is None:
+                self._idle_event.set()
+
+
+SetpointChannelStats = namedtuple("SetpointChannelStats",
+                                  ["updates",
+                                   "sent",
+                                   "dropped",
+                                   "errors",
+                                   "last_error"])
+
+# endregion
+
+# region Event Stream
+
+
+class EventStream(object):
+    """An async iterator over one kind of Sphero event.
+
+    Created by Sphero.events.
+    Events are buffered in a bounded queue.
+    When the queue is full the overflow policy drops an event
+    and the drop is counted in stats.
+
+    Args:
+        kind (spheropy.EventKind):
+            The kind of events in the stream.
+        maxsize (int):
+            The maximum number of buffered events.
+        overflow (str):
+            DROP_OLDEST or DROP_NEWEST.
+        event_loop (asyncio.AbstractEventLoop):
+            The event loop events are delivered on.
+        unsubscribe (callable):
+            Called with the stream when it is closed.
+    """
+
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    def __init__(self, kind, maxsize, overflow, event_loop, unsubscribe):
+        if maxsize < 1:
+            raise ValueError(f'maxsize must be at least 1. maxsize was {maxsize}')
+
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError(
+                f'overflow must be {self.DROP_OLDEST!r} or {self.DROP_NEWEST!r}. overflow was {overflow!r}')
+
+        self.kind = kind
+        self.event_loop = event_loop
+        self._maxsize = maxsize
+        self._drop_newest = overflow == self.DROP_NEWEST
+        self._unsubscribe = unsubscribe
+        self._events = collections.deque()
+        self._waiter = None
+        self._is_closed = False
+        self._num_received = 0
+        self._num_dropped = 0
+        self._peak_size = 0
+
+    @property
+    def stats(self):
+        """Statistics of the stream.
+
+        Returns:
+            An EventStreamStats namedtuple.
+
+            received (int):
+                The number of events delivered to the stream,
+                including dropped events.
+            dropped (int):
+                The number of events dropped because the buffer was full.
+            pending (int):
+                The number of buffered events.
+            peak_pending (int):
+                The largest number of buffered events.
+        """
+        return EventStreamStats(self._num_received,
+                                self._num_dropped,
+                                len(self._events),
+                                self._peak_size)
+
+    def close(self):
+        """Unsubscribes. Iteration ends after the buffered events."""
+        if self._is_closed:
+            return
+
+        self._is_closed = True
+        self._unsubscribe(self)
+        self._wake_waiter()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._events:
+            if self._is_closed:
+                raise StopAsyncIteration
+
+            self._waiter = self.event_loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        return self._events.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _put(self, event):
+        """Buffers an event. Called on event_loop."""
+        if self._is_closed:
+            return
+
+        self._num_received += 1
+        if len(self._events) >= self._maxsize:
+            self._num_dropped += 1
+            if self._drop_newest:
+                return
+            self._events.popleft()
+
+        self._events.append(event)
+        if len(self._events) > self._peak_size:
+            self._peak_size = len(self._events)
+        self._wake_waiter()
+
+    def _wake_waiter(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+EventStreamStats = namedtuple("EventStreamStats",
+                              ["received",
+                               "dropped",
+                               "pending",
+                               "peak_pending"])
+
+# endregion
+
+# region Telemetry Store
+
+
+class TelemetryStore(object):
+    """Keeps a robot's recent telemetry in fixed memory.
+
+    Each channel is a preallocated NumPy ring of capacity samples.
+    Once full, every new sample overwrites the oldest one,
+    so memory use does not grow however long a session runs.
+    Every sample has a 'time' field with its host time (time.monotonic()),
+    followed by one float64 field per value.
+
+    Queries return views into the ring, without copying.
+    A view is only valid until capacity more samples are appended,
+    so copy it to keep it longer.
+    Time ranges are found by binary search.
+
+    Requires NumPy.
+
+    Usage:
+        store = spheropy.TelemetryStore()
+        store.attach(sphero)
+        await sphero.start_streaming(spheropy.SensorChannel.ACCELEROMETER, rate_hz=100)
+        store.append('locator', await sphero.get_locator_info())
+        ...
+        now = time.monotonic()
+        store.mean('sensor_data', 'accel_z', now - 1.0, now)
+        store.range('collision', now - 60.0)
+
+    Args:
+        capacity (int, DEFAULT_CAPACITY):
+            The number of samples kept per channel.
+    """
+
+    DEFAULT_CAPACITY = 0x10000
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if not (HAS_NUMPY and USE_NUMPY):
+            raise RuntimeError('Could not import numpy, which TelemetryStore requires.')
+
+        if capacity < 1:
+            raise ValueError(f'capacity must be at least 1. capacity was {capacity}')
+
+        self.capacity = capacity
+        # Maps channel name to _TelemetryRing.
+        self._rings = {}
+        # Appends come from callback threads while queries run on the event loop.
+        self._lock = threading.Lock()
+        # Maps Sphero to the (EventKind, callback) pairs attach subscribed.
+        self._subscriptions = {}
+
+    @property
+    def channels(self):
+        """The names of the channels."""
+        return tuple(self._rings)
+
+    @property
+    def memory_in_bytes(self):
+        """The memory preallocated for all channels."""
+        return sum(ring.nbytes for ring in self._rings.values())
+
+    def add_channel(self, channel, fields):
+        """Adds a channel.
+
+        Channels are also added by the first append to them,
+        with the fields of the appended values.
+
+        Args:
+            channel (str):
+                The channel name.
+            fields (list):
+                The names of the values of each sample.
+        """
+        with self._lock:
+            self._add_channel(channel, fields)
+
+    def append(self, channel, samples, timestamp=None, sample_period_in_seconds=0.0):
+        """Appends one sample or a batch of samples to a channel.
+
+        Args:
+            channel (str):
+                The channel name.
+            samples:
+                One sample as a namedtuple (LocatorInfo, PowerState, CollisionInfo, ...)
+                or a sequence of numbers,
+                or a batch as a NumPy structured array
+                (such as an EventKind.SENSOR_DATA batch).
+            timestamp (float, None):
+                The host time of the sample, or of the last sample of a batch.
+                If None, uses time.monotonic().
+                Times earlier than the channel's newest sample
+                are raised to its time, so the times stay sorted.
+            sample_period_in_seconds (float, 0.0):
+                The time between the samples of a batch.
+                The earlier samples are timestamped back from timestamp.
+                Batches with a 'time' field (sensor data batches)
+                keep their own times instead.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        is_batch = isinstance(samples, numpy.ndarray) and samples.dtype.names is not None
+        with self._lock:
+            ring = self._rings.get(channel)
+            if ring is None:
+                if is_batch:
+                    fields = [name for name in samples.dtype.names if name != 'time']
+                else:
+                    fields = getattr(samples, '_fields', None) or [f'value_{i}' for i in range(len(samples))]
+                ring = self._add_channel(channel, fields)
+
+            if is_batch:
+                ring.extend(samples, timestamp, sample_period_in_seconds)
+            else:
+                ring.append(samples, timestamp)
+
+    def attach(self, sphero):
+        """Records a Sphero's collisions, power notifications and sensor data.
+
+        The events are appended to the 'collision', 'power_state_change'
+        and 'sensor_data' channels when the Sphero's callbacks run.
+        Collisions and sensor data are stored at the host times
+        the Sphero's clock model gives them.
+        """
+        def append_collision(collision_info):
+            self.append('collision', collision_info, timestamp=collision_info.host_time)
+
+        def append_power_state(power_state):
+            self.append('power_state_change', (power_state,))
+
+        def append_sensor_data(batch):
+            self.append('sensor_data', batch)
+
+        subscriptions = [(EventKind.COLLISION, append_collision),
+                         (EventKind.POWER_STATE_CHANGE, append_power_state),
+                         (EventKind.SENSOR_DATA, append_sensor_data)]
+        for kind, callback in subscriptions:
+            sphero.subscribe(kind, callback)
+        self._subscriptions.setdefault(sphero, []).extend(subscriptions)
+
+    def detach(self, sphero):
+        """Stops recording a Sphero's events."""
+        for kind, callback in self._subscriptions.pop(sphero, []):
+            sphero.unsubscribe(kind, callback)
+
+    def latest(self, channel):
+        """The newest sample of a channel, or None if it has none."""
+        window = self._get_window(channel)
+        return window[-1] if len(window) else None
+
+    def range(self, channel, start_time=None, end_time=None):
+        """The samples with start_time <= time <= end_time.
+
+        Args:
+            channel (str):
+                The channel name.
+            start_time (float, None):
+                If None, starts at the oldest sample.
+            end_time (float, None):
+                If None, ends at the newest sample.
+
+        Returns:
+            A structured array view, oldest sample first.
+        """
+        with self._lock:
+            ring = self._get_ring(channel)
+            return ring.range(start_time, end_time)
+
+    def mean(self, channel, field, start_time=None, end_time=None):
+        """The mean of a field over a time range. None if the range is empty."""
+        values = self.range(channel, start_time, end_time)[field]
+        return float(values.mean()) if len(values) else None
+
+    def max(self, channel, field, start_time=None, end_time=None):
+        """The largest value of a field over a time range. None if the range is empty."""
+        values = self.range(channel, start_time, end_time)[field]
+        return float(values.max()) if len(values) else None
+
+    def rate(self, channel, start_time=None, end_time=None):
+        """The number of samples per second over a time range.
+
+        If start_time or end_time is None,
+        the range is measured between the samples it contains.
+        """
+        times = self.range(channel, start_time, end_time)['time']
+        if start_time is not None and end_time is not None:
+            duration = end_time - start_time
+            count = len(times)
+        elif len(times) > 1:
+            duration = times[-1] - times[0]
+            count = len(times) - 1
+        else:
+            return 0.0
+
+        return count / duration if duration > 0 else 0.0
+
+    def _add_channel(self, channel, fields):
+        if channel in self._rings:
+            raise ValueError(f'{channel!r} is already a channel.')
+
+        ring = _TelemetryRing(fields, self.capacity)
+        self._rings[channel] = ring
+        return ring
+
+    def _get_ring(self, channel):
+        try:
+            return self._rings[channel]
+        except KeyError:
+            raise ValueError(f'{channel!r} is not a channel.')
+
+    def _get_window(self, channel):
+        with self._lock:
+            return self._get_ring(channel).window
+
+# endregion
+
+# region Locator Tracker
+
+
+class LocatorTracker(object):
+    """Keeps an always-current estimate of a Sphero's position.
+
+    Streams the odometer and velocity channels (see Sphero.start_streaming)
+    instead of calling get_locator_info over and over,
+    so no command/response exchange competes with control commands.
+    Between samples, the position is extrapolated from the velocity.
+
+    Firmware without locator streaming never sends the samples.
+    Then the tracker polls get_locator_info instead,
+    every min_poll_interval_in_seconds while the Sphero moves,
+    backing off up to max_poll_interval_in_seconds while it stands still.
+
+    The tracker owns the Sphero's sensor data stream while started.
+
+    Usage:
+        tracker = spheropy.LocatorTracker(sphero)
+        await tracker.start()
+        ...
+        x, y = tracker.position_at(time.monotonic())
+        ...
+        await tracker.stop()
+
+    Args:
+        sphero (Sphero):
+            A connected Sphero.
+        max_extrapolation_in_seconds (float, 0.5):
+            How far from the last sample the position is extrapolated.
+            Later times get the position at that point,
+            so a lost stream doesn't send the estimate off forever.
+    """
+
+    DEFAULT_RATE_HZ = 20
+    # The streamed velocity is in mm/s while LocatorInfo uses cm/s.
+    _VELOCITY_SCALE = 0.1
+
+    def __init__(self, sphero, max_extrapolation_in_seconds=0.5):
+        if max_extrapolation_in_seconds < 0:
+            raise ValueError(
+                f'max_extrapolation_in_seconds must be at least 0. max_extrapolation_in_seconds was {max_extrapolation_in_seconds}')
+
+        self._sphero = sphero
+        self.max_extrapolation_in_seconds = max_extrapolation_in_seconds
+        # (host time, LocatorInfo) of the latest sample.
+        # Replaced as a whole so readers on other threads see a consistent pair.
+        self._sample = None
+        self._mode = None
+        self._first_sample_event = None
+        self._poll_task = None
+        self._poll_interval = None
+        self._num_samples = 0
+        self._num_polls = 0
+        self._num_poll_errors = 0
+        self._last_poll_error = None
+
+    @property
+    def mode(self):
+        """'streaming', 'polling', or None if not started."""
+        return self._mode
+
+    @property
+    def locator_info(self):
+        """The latest measured LocatorInfo, or None before the first sample."""
+        sample = self._sample
+        return None if sample is None else sample[1]
+
+    @property
+    def last_sample_time(self):
+        """The host time (time.monotonic()) of the latest sample, or None."""
+        sample = self._sample
+        return None if sample is None else sample[0]
+
+    @property
+    def stats(self):
+        """A LocatorTrackerStats namedtuple.
+
+        mode (str):
+            See mode.
+        samples (int):
+            The number of positions received.
+        polls (int):
+            The number of get_locator_info calls.
+        poll_errors (int):
+            The number of failed get_locator_info calls.
+        poll_interval_in_seconds (float):
+            The current poll interval, or None if not polling.
+        last_poll_error (Exception):
+            The latest poll error, or None.
+        """
+        return LocatorTrackerStats(self._mode,
+                                   self._num_samples,
+                                   self._num_polls,
+                                   self._num_poll_errors,
+                                   self._poll_interval if self._mode == 'polling' else None,
+                                   self._last_poll_error)
+
+    def position_at(self, host_time=None):
+        """The estimated (x, y) position in centimeters at a host time.
+
+        Args:
+            host_time (float, None):
+                A time.monotonic() time. If None, now.
+
+        Returns:
+            The position, or None before the first sample.
+        """
+        locator_info = self.locator_info_at(host_time)
+        return None if locator_info is None else (locator_info.pos_x, locator_info.pos_y)
+
+    def locator_info_at(self, host_time=None):
+        """The estimated LocatorInfo at a host time.
+
+        The position is extrapolated from the latest sample's velocity
+        and is a float. The velocities are the latest sample's.
+
+        Args:
+            host_time (float, None):
+                A time.monotonic() time. If None, now.
+
+        Returns:
+            A LocatorInfo namedtuple, or None before the first sample.
+        """
+        sample = self._sample
+        if sample is None:
+            return None
+
+        sample_time, locator_info = sample
+        if host_time is None:
+            host_time = time.monotonic()
+
+        elapsed = max(-self.max_extrapolation_in_seconds,
+                      min(host_time - sample_time, self.max_extrapolation_in_seconds))
+        return locator_info._replace(pos_x=locator_info.pos_x + locator_info.vel_x * elapsed,
+                                     pos_y=locator_info.pos_y + locator_info.vel_y * elapsed)
+
+    async def start(self,
+                    rate_hz=DEFAULT_RATE_HZ,
+                    extra_channels=SensorChannel(0),
+                    stream_timeout_in_seconds=1.0,
+                    min_poll_interval_in_seconds=0.05,
+                    max_poll_interval_in_seconds=1.0):
+        """Starts tracking.
+
+        Args:
+            rate_hz (float, DEFAULT_RATE_HZ):
+                The locator sample rate when streaming.
+            extra_channels (SensorChannel, SensorChannel(0)):
+                More channels to stream along with the locator channels.
+                Subscribe to EventKind.SENSOR_DATA to receive them.
+            stream_timeout_in_seconds (float, 1.0):
+                How long to wait for the first streamed sample
+                before falling back to polling.
+            min_poll_interval_in_seconds (float, 0.05):
+                The poll interval while the Sphero moves.
+            max_poll_interval_in_seconds (float, 1.0):
+                The longest poll interval while the Sphero stands still.
+
+        Returns:
+            The mode, 'streaming' or 'polling'.
+        """
+        if self._mode is not None:
+            raise SpheroError('The locator tracker is already started.')
+
+        if not 0 < min_poll_interval_in_seconds <= max_poll_interval_in_seconds:
+            raise ValueError(
+                'min_poll_interval_in_seconds must be in the range (0, max_poll_interval_in_seconds]. '
+                f'min_poll_interval_in_seconds was {min_poll_interval_in_seconds}')
+
+        self._min_poll_interval = min_poll_interval_in_seconds
+        self._max_poll_interval = max_poll_interval_in_seconds
+        if await self._start_streaming(rate_hz, extra_channels, stream_timeout_in_seconds):
+            self._mode = 'streaming'
+        else:
+            self._mode = 'polling'
+            self._poll_interval = min_poll_interval_in_seconds
+            self._poll_task = asyncio.ensure_future(self._run_poller())
+
+        return self._mode
+
+    async def stop(self):
+        """Stops tracking. The latest estimate stays available."""
+        mode = self._mode
+        self._mode = None
+        if mode == 'streaming':
+            self._sphero.unsubscribe(EventKind.SENSOR_DATA, self._handle_sensor_data)
+            await self._sphero.stop_streaming()
+        elif mode == 'polling':
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+
+    async def _start_streaming(self, rate_hz, extra_channels, stream_timeout_in_seconds):
+        """Returns True if locator samples arrive."""
+        self._first_sample_event = asyncio.Event()
+        self._sphero.subscribe(EventKind.SENSOR_DATA, self._handle_sensor_data)
+        try:
+            await self._sphero.start_streaming(SensorChannel.ODOMETER | SensorChannel.VELOCITY | extra_channels,
+                                               rate_hz=rate_hz)
+            await asyncio.wait_for(self._first_sample_event.wait(), stream_timeout_in_seconds)
+            return True
+        except (SpheroError, RuntimeError, asyncio.TimeoutError):
+            # No NumPy, or firmware without these channels.
+            self._sphero.unsubscribe(EventKind.SENSOR_DATA, self._handle_sensor_data)
+            try:
+                await self._sphero.stop_streaming()
+            except SpheroError:
+                pass
+            return False
+
+    async def _handle_sensor_data(self, batch):
+        # Runs on the event loop, like every coroutine callback.
+        sample_time = batch['time'][-1]
+        if math.isnan(sample_time):
+            sample_time = time.monotonic()
+
+        vel_x = float(batch['velocity_x'][-1]) * self._VELOCITY_SCALE
+        vel_y = float(batch['velocity_y'][-1]) * self._VELOCITY_SCALE
+        self._sample = (float(sample_time),
+                        LocatorInfo(float(batch['odometer_x'][-1]),
+                                    float(batch['odometer_y'][-1]),
+                                    vel_x,
+                                    vel_y,
+                                    math.hypot(vel_x, vel_y)))
+        self._num_samples += len(batch)
+        self._first_sample_event.set()
+
+    async def _run_poller(self):
+        while True:
+            send_time = time.monotonic()
+            try:
+                locator_info = await self._sphero.get_locator_info(reset_inactivity_timeout=False)
+            except SpheroError as error:
+                self._num_poll_errors += 1
+                self._last_poll_error = error
+            else:
+                # The Sphero answered about halfway through the round trip.
+                self._sample = ((send_time + time.monotonic()) / 2, locator_info)
+                self._num_samples += 1
+                if locator_info.speed_over_ground > 0:
+                    self._poll_interval = self._min_poll_interval
+                else:
+                    self._poll_interval = min(2 * self._poll_interval, self._max_poll_interval)
+            finally:
+                self._num_polls += 1
+
+            await asyncio.sleep(max(0.0, send_time + self._poll_interval - time.monotonic()))
+
+# endregion
+
+# region Wire Capture
+
+
+class WireCapture(object):
+    """Records the raw bytes a Sphero receives and sends to a file.
+
+    Created with Sphero.start_wire_capture.
+    Recording only timestamps the data and queues a copy,
+    so it adds little to the receive path.
+    A background thread is woken when records are queued,
+    copies them into a memory mapped file a few milliseconds later
+    and flushes the mapped pages to disk
+    flush_interval_in_seconds after the first unflushed write.
+    It sleeps while the capture is idle.
+    The file grows one segment at a time
+    and is cut to the recorded length when the capture is closed.
+
+    File format (little endian):
+        header:
+            8 bytes MAGIC,
+            u64 time.time_ns() and u64 time.monotonic_ns()
+            at the start of the capture.
+        records, one per received chunk or sent write:
+            u32 data length, u8 direction (RECEIVED or SENT),
+            u64 time.monotonic_ns(), then the data.
+    A capture that was not closed ends in zeros,
+    which read takes as the end of the records.
+
+    Args:
+        path (str):
+            The file to write. Replaced if it exists.
+        segment_size_in_bytes (int, DEFAULT_SEGMENT_SIZE_IN_BYTES):
+            How much the file grows by at a time.
+            Rounded up to a multiple of mmap.ALLOCATIONGRANULARITY.
+        flush_interval_in_seconds (float, DEFAULT_FLUSH_INTERVAL_IN_SECONDS):
+            How long written records wait to be flushed to disk.
+    """
+
+    MAGIC = b'SPHCAP1\x00'
+    RECEIVED = 0
+    SENT = 1
+    DEFAULT_SEGMENT_SIZE_IN_BYTES = 1 << 22
+    DEFAULT_FLUSH_INTERVAL_IN_SECONDS = 1.0
+    # How long the writer lets records queue up after it is woken.
+    _WRITE_INTERVAL_IN_SECONDS = 0.01
+
+    def __init__(self,
+                 path,
+                 segment_size_in_bytes=DEFAULT_SEGMENT_SIZE_IN_BYTES,
+                 flush_interval_in_seconds=DEFAULT_FLUSH_INTERVAL_IN_SECONDS):
+        if segment_size_in_bytes < 1:
+            raise ValueError(
+                f'segment_size_in_bytes must be at least 1. segment_size_in_bytes was {segment_size_in_bytes}')
+
+        if flush_interval_in_seconds <= 0:
+            raise ValueError(
+                f'flush_interval_in_seconds must be greater than 0. flush_interval_in_seconds was {flush_interval_in_seconds}')
+
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.path = path
+        self.segment_size = -(-segment_size_in_bytes // granularity) * granularity
+        self._flush_interval = flush_interval_in_seconds
+        # (direction, time.monotonic_ns() time, data) records waiting to be written.
+        # deque.append is atomic, so queueing takes no lock.
+        self._pending = collections.deque()
+        # Set when records are queued or the capture is closed.
+        self._wake_event = threading.Event()
+        self._closed = False
+        # Guards the file, the mapped segment and the position.
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        self._map = None
+        self._segment_start = 0
+        self._segment_end = 0
+        # Full segments waiting for their last flush.
+        self._retired_maps = []
+        self._position = 0
+        self._num_records = 0
+        self._num_flushes = 0
+        self._map_next_segment()
+        self._write(_WIRE_CAPTURE_HEADER.pack(self.MAGIC, time.time_ns(), time.monotonic_ns()))
+
+        self._stop_event = threading.Event()
+        self._writer = threading.Thread(target=self._run_writer,
+                                        name='SpheroWireCapture',
+                                        daemon=True)
+        self._writer.start()
 
-            # Remove the packet we just handled
-            del message[:response_packet.packet_length]
+    @property
+    def stats(self):
+        """A WireCaptureStats namedtuple.
+
+        records (int):
+            The number of records written to the file.
+        bytes (int):
+            The length of the capture, including the file header.
+        flushes (int):
+            The number of flushes to disk.
+        pending (int):
+            The number of records waiting to be written.
+        """
+        return WireCaptureStats(self._num_records, self._position, self._num_flushes, len(self._pending))
 
-        message_queue.task_done()
+    @property
+    def closed(self):
+        """True once the capture is closed."""
+        return self._closed
 
+    def append(self, direction, data):
+        """Queues a record. Does nothing once the capture is closed.
 
-def _parse_message(message):
-    while len(message) >= _MIN_PACKET_LENGTH:
-        response_packet = _ResponsePacket(message)
-        if response_packet.status == _ResponsePacketStatus.VALID:
-            # we have a valid response to handle
-            # break out of the inner while loop to handle
-            # the response.
-            return response_packet
-        elif response_packet.status == _ResponsePacketStatus.NOT_ENOUGH_BUFFER:
-            # Return and wait to get more data.
-            return None
-        else:
-            # There is an error in the packet format.
-            # Remove all the bytes until the next SOP1 byte.
-            del message[: message.index(_ResponsePacket._START_OF_PACKET_1)]
-            continue
+        Args:
+            direction (int):
+                RECEIVED or SENT.
+            data (bytes-like):
+                The raw bytes. Copied before returning.
+        """
+        if self._closed:
+            return
 
-    return None
+        self._pending.append((direction, time.monotonic_ns(), bytes(data)))
+        # Event.set takes a lock, so skip it while the writer is already due to run.
+        if not self._wake_event.is_set():
+            self._wake_event.set()
+
+    def flush(self):
+        """Writes the queued records and flushes the file to disk."""
+        with self._lock:
+            if self._map is None:
+                return
+
+            self._write_pending()
+            for retired_map in self._retired_maps:
+                retired_map.flush()
+                retired_map.close()
+            self._retired_maps = []
+            self._map.flush()
+            self._num_flushes += 1
+
+    def close(self):
+        """Writes the queued records and cuts the file to the recorded length."""
+        if self._closed:
+            return
 
+        self._closed = True
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._writer is not threading.current_thread():
+            self._writer.join()
+        self.flush()
+        with self._lock:
+            self._map.close()
+            self._map = None
+            os.ftruncate(self._fd, self._position)
+            os.close(self._fd)
 
-def _handle_async_response(response_packet,
-                           on_collision_callbacks,
-                           on_power_state_change_callbacks,
-                           on_self_level_complete_callbacks):
-    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def read(cls, path):
+        """Reads the records of a capture file.
+
+        Args:
+            path (str):
+                The capture file.
+
+        Yields:
+            WireRecord namedtuples, in the order they were appended.
+
+            direction (int):
+                WireCapture.RECEIVED or WireCapture.SENT.
+            time_ns (int):
+                The time.monotonic_ns() time the data was received or sent.
+            data (bytes):
+                The raw bytes.
+        """
+        with open(path, 'rb') as capture_file:
+            header = capture_file.read(_WIRE_CAPTURE_HEADER.size)
+            if len(header) < _WIRE_CAPTURE_HEADER.size or header[:len(cls.MAGIC)] != cls.MAGIC:
+                raise ValueError(f'{path} is not a wire capture.')
+
+            while True:
+                record_header = capture_file.read(_WIRE_CAPTURE_RECORD_HEADER.size)
+                if len(record_header) < _WIRE_CAPTURE_RECORD_HEADER.size:
+                    return
+
+                size, direction, time_ns = _WIRE_CAPTURE_RECORD_HEADER.unpack(record_header)
+                if time_ns == 0:
+                    # The unused end of a capture that was not closed.
+                    return
+
+                data = capture_file.read(size)
+                if len(data) < size:
+                    return
+
+                yield WireRecord(direction, time_ns, data)
+
+    def _run_writer(self):
+        # None while everything written has been flushed.
+        next_flush_time = None
+        while True:
+            timeout = None
+            if next_flush_time is not None:
+                timeout = max(0.0, next_flush_time - time.monotonic())
+
+            is_woken = self._wake_event.wait(timeout)
+            if self._stop_event.is_set():
+                return
+
+            if is_woken:
+                # Let a burst of records queue up so they are written together.
+                if self._stop_event.wait(self._WRITE_INTERVAL_IN_SECONDS):
+                    return
+
+                # Clear before writing so records queued from now on wake the writer again.
+                self._wake_event.clear()
+                with self._lock:
+                    self._write_pending()
+                if next_flush_time is None:
+                    next_flush_time = time.monotonic() + self._flush_interval
+
+            if next_flush_time is not None and time.monotonic() >= next_flush_time:
+                self.flush()
+                next_flush_time = None
+
+    def _write_pending(self):
+        pending = self._pending
+        pack = _WIRE_CAPTURE_RECORD_HEADER.pack
+        parts = []
+        # Only take what is queued now, so a busy stream can't keep the writer here.
+        for _ in range(len(pending)):
+            direction, record_time, data = pending.popleft()
+            parts.append(pack(len(data), direction, record_time))
+            parts.append(data)
+
+        if parts:
+            self._write(b''.join(parts))
+            self._num_records += len(parts) // 2
+
+    def _write(self, data):
+        start = self._position - self._segment_start
+        if self._position + len(data) <= self._segment_end:
+            self._map[start:start + len(data)] = data
+            self._position += len(data)
+            return
+
+        view = memoryview(data)
+        while view:
+            start = self._position - self._segment_start
+            count = min(len(view), self._segment_end - self._position)
+            self._map[start:start + count] = view[:count]
+            self._position += count
+            view = view[count:]
+            if self._position == self._segment_end:
+                self._retired_maps.append(self._map)
+                self._map_next_segment()
+
+    def _map_next_segment(self):
+        start = self._segment_end
+        os.ftruncate(self._fd, start + self.segment_size)
+        self._map = mmap.mmap(self._fd, self.segment_size, access=mmap.ACCESS_WRITE, offset=start)
+        self._segment_start = start
+        self._segment_end = start + self.segment_size
+
+# endregion
+
+# region IO Reactor
+
+
+class IoReactor(object):
+    """Runs bluetooth I/O and packet decoding for many Spheros on a few threads.
+
+    Every connection is pinned to one reactor thread,
+    which reads its socket (when the bluetooth interface has one)
+    and decodes its received data in order.
+    Connections are spread over the threads by connection count.
+
+    By default a Sphero reads and decodes on its asyncio event loop.
+    Passing a reactor to Sphero moves that work off the loop.
+    IoReactor.default() is a shared reactor with one thread,
+    and a process driving many Spheros can create one with more threads.
+
+    Args:
+        num_threads (int, 1):
+            The number of reactor threads.
     """
-    if response_packet.id_code is _ID_CODE_COLLISION_DETECTED:
-        collision_info = _parse_collision_info(response_packet.data)
-        for func in on_collision_callbacks:
-            _call_callback(func, [collision_info])
-    elif response_packet.id_code is _ID_CODE_POWER_NOTIFICATION:
-        power_state = response_packet.data[0]
-        for func in on_power_state_change_callbacks:
-            _call_callback(func, [power_state])
-    elif response_packet.id_code is _ID_CODE_SELF_LEVEL_COMPLETE:
-        result = _parse_self_level_result(response_packet.data)
-        for func in on_self_level_complete_callbacks:
-            _call_callback(func, [result])
-
-
-def _call_callback(callback, args):
-    # Schedule the callback on its own thread.
-    # TODO: there is probably a more asyncio way of doing this, but do
-    # we care?
-    # Maybe we can run the function on the main thread's event loop?
-    # TODO: Refactor kicking off callback in seperate thread to a function
-    callback_thread = threading.Thread(target=callback, args=args)
-    callback_thread.daemon = True
-    callback_thread.start()
 
+    _default = None
+    _default_lock = threading.Lock()
 
-def _handle_sync_response(response_packet,
-                          commands_waiting_for_response):
+    def __init__(self, num_threads=1):
+        if num_threads < 1:
+            raise ValueError(
+                f'num_threads must be at least 1. num_threads was {num_threads}')
+
+        self._threads = [_IoThread(f'spheropy-io-{i}')
+                         for i in range(num_threads)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        """The reactor shared by Spheros that are not given one."""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @property
+    def stats(self):
+        """Statistics of the reactor.
+
+        Returns:
+            An IoReactorStats namedtuple.
+
+            connections (tuple):
+                The number of connections on each thread.
+            tasks (int):
+                The number of I/O callbacks and decode tasks run.
+            errors (int):
+                The number of errors raised by callbacks and tasks.
+            last_error (Exception):
+                The last error raised by a callback or task.
+        """
+        last_errors = [t.last_error for t in self._threads if t.last_error is not None]
+        return IoReactorStats(tuple(t.connection_count for t in self._threads),
+                              sum(t.num_tasks for t in self._threads),
+                              sum(t.num_errors for t in self._threads),
+                              last_errors[-1] if last_errors else None)
+
+    def assign(self):
+        """Pins a new connection to the least busy thread and returns the thread."""
+        with self._lock:
+            io_thread = min(self._threads, key=lambda t: t.connection_count)
+            io_thread.connection_count += 1
+            io_thread.start()
+            return io_thread
+
+    def release(self, io_thread):
+        """Unpins a connection from io_thread."""
+        with self._lock:
+            io_thread.connection_count -= 1
+
+    def stop(self):
+        """Stops all reactor threads."""
+        for io_thread in self._threads:
+            io_thread.stop()
+
+
+IoReactorStats = namedtuple("IoReactorStats",
+                            ["connections",
+                             "tasks",
+                             "errors",
+                             "last_error"])
+
+
+class _IoThread(object):
+    """One IoReactor thread.
+
+    Waits on a selector for readable sockets
+    and runs tasks queued with call_soon between waits.
+    A socket pair wakes the selector when a task is queued
+    from another thread.
     """
+
+    # The selector can watch any socket.
+    can_watch_sockets = True
+
+    def __init__(self, name):
+        self.name = name
+        self.connection_count = 0
+        self.num_tasks = 0
+        self.num_errors = 0
+        self.last_error = None
+        self._tasks = collections.deque()
+        self._thread = None
+        self._thread_id = None
+        self._selector = None
+        self._wakeup_reader = None
+        self._wakeup_writer = None
+        self._is_wakeup_pending = False
+        self._is_stopping = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Starts the thread if it is not running."""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._tasks.clear()
+            self._is_stopping = False
+            self._is_wakeup_pending = False
+            self._selector = selectors.DefaultSelector()
+            self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+            self._wakeup_reader.setblocking(False)
+            self._wakeup_writer.setblocking(False)
+            self._selector.register(self._wakeup_reader,
+                                    selectors.EVENT_READ,
+                                    [self._drain_wakeup, None])
+            self._thread = threading.Thread(target=self._run,
+                                            name=self.name,
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the thread after the tasks already queued."""
+        thread = self._thread
+        if thread is None:
+            return
+
+        self.call_soon(self._set_stopping)
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def is_current(self):
+        """True if called from this thread."""
+        return threading.get_ident() == self._thread_id
+
+    def call_soon(self, callback, *args):
+        """Queues callback to run on this thread. Thread safe."""
+        self._tasks.append((callback, args))
+        if not self._is_wakeup_pending and not self.is_current():
+            self._is_wakeup_pending = True
+            try:
+                self._wakeup_writer.send(b'\0')
+            except OSError:
+                # The socket buffer is full, so a wake up is already pending.
+                pass
+
+    def register_reader(self, fileobj, callback):
+        """Calls callback on this thread whenever fileobj is readable. Thread safe."""
+        self.call_soon(self._set_callback, fileobj, 0, callback)
+
+    def register_writer(self, fileobj, callback):
+        """Calls callback on this thread whenever fileobj is writable. Thread safe."""
+        self.call_soon(self._set_callback, fileobj, 1, callback)
+
+    def unregister_writer(self, fileobj):
+        """Stops watching fileobj for writability. Thread safe."""
+        self.call_soon(self._set_callback, fileobj, 1, None)
+
+    def unregister(self, fileobj, close=False):
+        """Stops watching fileobj and optionally closes it on this thread. Thread safe."""
+        self.call_soon(self._unregister, fileobj, close)
+
+    def _set_callback(self, fileobj, index, callback):
+        # The key's data is [read_callback, write_callback].
+        try:
+            callbacks = list(self._selector.get_key(fileobj).data)
+            is_registered = True
+        except KeyError:
+            callbacks = [None, None]
+            is_registered = False
+
+        callbacks[index] = callback
+        events = ((selectors.EVENT_READ if callbacks[0] is not None else 0) |
+                  (selectors.EVENT_WRITE if callbacks[1] is not None else 0))
+        if not events:
+            if is_registered:
+                self._selector.unregister(fileobj)
+        elif is_registered:
+            self._selector.modify(fileobj, events, callbacks)
+        else:
+            self._selector.register(fileobj, events, callbacks)
+
+    def _unregister(self, fileobj, close):
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+        if close:
+            fileobj.close()
+
+    def _set_stopping(self):
+        self._is_stopping = True
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def _run(self):
+        self._thread_id = threading.get_ident()
+        selector = self._selector
+        tasks = self._tasks
+        try:
+            while not self._is_stopping:
+                for key, events in selector.select(0 if tasks else None):
+                    read_callback, write_callback = key.data
+                    if events & selectors.EVENT_READ and read_callback is not None:
+                        self._call(read_callback, ())
+                    if events & selectors.EVENT_WRITE and write_callback is not None:
+                        self._call(write_callback, ())
+
+                # Clear the flag before running the tasks,
+                # so a task queued while they run wakes the selector again.
+                self._is_wakeup_pending = False
+                for _ in range(len(tasks)):
+                    callback, args = tasks.popleft()
+                    self._call(callback, args)
+        finally:
+            selector.close()
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+
+    def _call(self, callback, args):
+        self.num_tasks += 1
+        try:
+            callback(*args)
+        except Exception as error:
+            # Keep serving the other connections.
+            self.num_errors += 1
+            self.last_error = error
+
+
+class _LoopIoThread(object):
+    """Runs a connection's I/O and decoding on an asyncio event loop.
+
+    Has the same interface as _IoThread,
+    so the event loop can stand in for a reactor thread.
+    Must be created on the event loop's thread.
     """
-    # for ACK/synchronous responses we only need to call the registered
-    # callback.
-    sequence_number = response_packet.sequence_number
-    if sequence_number in commands_waiting_for_response:
-        # TODO: check to make sure handler is callable before invoking.
-        commands_waiting_for_response[sequence_number](response_packet)
-        # NOTE: it is up to the callback/waiting function to remove the
-        # handler.
+
+    def __init__(self, event_loop):
+        self._event_loop = event_loop
+        self._thread_id = threading.get_ident()
+        # The proactor event loop on Windows can't watch sockets.
+        proactor_event_loop_type = getattr(asyncio, 'ProactorEventLoop', ())
+        self.can_watch_sockets = not isinstance(event_loop, proactor_event_loop_type)
+
+    def is_current(self):
+        """True if called from the event loop's thread."""
+        return threading.get_ident() == self._thread_id
+
+    def call_soon(self, callback, *args):
+        """Queues callback to run on the event loop. Thread safe."""
+        if self.is_current():
+            self._event_loop.call_soon(callback, *args)
+        else:
+            self._event_loop.call_soon_threadsafe(callback, *args)
+
+    def register_reader(self, fileobj, callback):
+        """Calls callback on the event loop whenever fileobj is readable. Thread safe."""
+        self.call_soon(self._event_loop.add_reader, fileobj, callback)
+
+    def register_writer(self, fileobj, callback):
+        """Calls callback on the event loop whenever fileobj is writable. Thread safe."""
+        self.call_soon(self._event_loop.add_writer, fileobj, callback)
+
+    def unregister_writer(self, fileobj):
+        """Stops watching fileobj for writability. Thread safe."""
+        self.call_soon(self._event_loop.remove_writer, fileobj)
+
+    def unregister(self, fileobj, close=False):
+        """Stops watching fileobj and optionally closes it on the event loop. Thread safe."""
+        self.call_soon(self._unregister, fileobj, close)
+
+    def _unregister(self, fileobj, close):
+        self._event_loop.remove_reader(fileobj)
+        self._event_loop.remove_writer(fileobj)
+        if close:
+            fileobj.close()
 
 # endregion
-# endregion Sphero
 
 # region Public Exceptions
 
@@ -1013,6 +3644,13 @@ class CommandTimedOutError(SpheroError):
     def __init__(self, message="Command timeout reached."):
         super().__init__(message)
 
+
+class CommandPreemptedError(SpheroError):
+    """Exception thrown when a command is dropped because an emergency stop was sent after it."""
+
+    def __init__(self, message="Command preempted by an emergency stop."):
+        super().__init__(message)
+
 # endregion
 
 # region Bluetooth Interfaces
@@ -1040,7 +3678,15 @@ class BluetoothInterfaceBase(object):
 
     def __init__(self, search_name=None, address=None, port=None):
         super().__init__()
+        # Called with the received data.
+        # The data may be a view of a buffer that is reused by the next receive,
+        # so the handler must copy any data it keeps.
         self.data_received_handler = None
+        # The thread that decodes the connection's data:
+        # the event loop or an IoReactor thread. Set before connect.
+        # Interfaces with a socket can watch it on this thread
+        # instead of starting their own receive thread.
+        self.io_thread = None
         self._search_name = self.DEFAULT_SEARCH_NAME if search_name is None else search_name
         self._port = self.DEFAULT_PORT if port is None else port
         self._address = address
@@ -1055,6 +3701,11 @@ class BluetoothInterfaceBase(object):
         """
         pass
 
+    @property
+    def can_send_without_blocking(self):
+        """True if send never blocks the calling thread."""
+        return False
+
     def send(self, data):
         """Sends raw data to the device.
 
@@ -1070,21 +3721,33 @@ class BluetoothInterfaceBase(object):
 
 
 class BluetoothInterface(BluetoothInterfaceBase):
-    """Legacy Bluetooth Interface"""
+    """Legacy Bluetooth Interface
+
+    Received data is read with recv_into into a preallocated buffer.
+    When io_thread is set, the socket is non-blocking
+    and is read on io_thread (the event loop or an IoReactor thread)
+    when it is readable.
+    Writes that don't fit in the socket buffer are kept
+    and finished when the socket is writable.
+    Otherwise a receive thread blocks on the socket
+    from connect until disconnect.
+    Either way nothing runs while no data arrives.
+    """
 
     DEFAULT_SEARCH_NAME = 'Sphero'
     DEFAULT_PORT = 1
 
+    _RECEIVE_BUFFER_SIZE = 1024
+
     def __init__(self, search_name=None, address=None, port=None):
         super().__init__(search_name, address, port)
         self._sock = None
-
-        # setup thread for receiving responses
-        self._class_destroy_event = threading.Event()
-        self._receive_thread = threading.Thread(
-            target=self._receive_thread_run)
-        self._receive_thread.daemon = True
-        self._receive_thread.start()
+        self._receive_thread = None
+        self._receive_buffer = bytearray(self._RECEIVE_BUFFER_SIZE)
+        self._receive_buffer_view = memoryview(self._receive_buffer)
+        self._is_non_blocking = False
+        self._pending_send = bytearray()
+        self._send_lock = threading.Lock()
 
     def connect(self, num_retry_attempts=1):
         super().connect(num_retry_attempts)
@@ -1096,6 +3759,7 @@ class BluetoothInterface(BluetoothInterfaceBase):
             if self._address is not None:
                 self._sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
                 self._sock.connect((self._address, self._port))
+                self._start_receiving(self._sock)
                 is_connected = True
                 break
 
@@ -1106,30 +3770,147 @@ class BluetoothInterface(BluetoothInterfaceBase):
             raise RuntimeError(
                 f'Count not connect to device {self._address} after {num_retry_attempts} tries.')
 
+    @property
+    def can_send_without_blocking(self):
+        return self._is_non_blocking
+
     def send(self, data):
-        if self._sock is not None:
-            self._sock.send(data)
+        sock = self._sock
+        if sock is None:
+            return
+
+        if not self._is_non_blocking:
+            sock.send(data)
+            return
+
+        with self._send_lock:
+            if self._pending_send:
+                # Keep the order of writes.
+                self._pending_send += data
+                return
+
+            sent = self._try_send(sock, data)
+            if sent < len(data):
+                self._pending_send += data[sent:]
+                self.io_thread.register_writer(sock, self._handle_writable)
+
+    def _handle_writable(self):
+        """Sends the pending data when the reactor reports the socket writable."""
+        sock = self._sock
+        if sock is None:
+            return
+
+        with self._send_lock:
+            sent = self._try_send(sock, self._pending_send)
+            del self._pending_send[:sent]
+            if not self._pending_send:
+                self.io_thread.unregister_writer(sock)
+
+    @staticmethod
+    def _try_send(sock, data):
+        """Sends what fits in the socket buffer and returns the number of bytes sent."""
+        try:
+            return sock.send(data)
+        except BlockingIOError:
+            return 0
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            raise
 
     def disconnect(self):
-        if self._sock is not None:
-            self._sock.close()
-
-    def _receive_thread_run(self):
-        """Checks for received data and calls handler.
-
-        Used to create background thread to listen
-        for data received from device.
-        """
-        while not self._class_destroy_event.is_set():
-            if self._sock is not None:
-                data = self._sock.recv(1024)
-                if data is not None and len(data) > 0:
-                    if self.data_received_handler is not None:
-                        if callable(self.data_received_handler):
-                            self.data_received_handler(data)
-                        else:
-                            raise ValueError(
-                                'data_received_handler is not callable.')
+        sock = self._sock
+        if sock is None:
+            return
+
+        self._sock = None
+        if self._is_non_blocking:
+            self._is_non_blocking = False
+            self._pending_send.clear()
+            self.io_thread.unregister(sock, close=True)
+        else:
+            try:
+                # Wakes the receive thread from its blocking receive.
+                sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            sock.close()
+            receive_thread = self._receive_thread
+            self._receive_thread = None
+            if receive_thread is not None and receive_thread is not threading.current_thread():
+                receive_thread.join(1.0)
+
+    def _start_receiving(self, sock):
+        if self.io_thread is not None and self.io_thread.can_watch_sockets:
+            sock.setblocking(False)
+            self._is_non_blocking = True
+            self.io_thread.register_reader(sock, self._handle_readable)
+        else:
+            self._receive_thread = threading.Thread(target=self._receive_thread_run,
+                                                    args=[sock],
+                                                    name='spheropy-bluetooth-receive',
+                                                    daemon=True)
+            self._receive_thread.start()
+
+    def _handle_readable(self):
+        """Reads the socket when the reactor reports it readable."""
+        sock = self._sock
+        if sock is None:
+            return
+
+        try:
+            data = self._receive(sock)
+        except BlockingIOError:
+            return
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = None
+
+        if not data:
+            # The connection was closed.
+            self.io_thread.unregister(sock)
+            return
+
+        self._handle_data_received(data)
+
+    def _receive_thread_run(self, sock):
+        """Blocks on sock and calls the handler with received data.
+
+        Used when there is no reactor thread.
+        Returns when the socket is closed.
+        """
+        while True:
+            try:
+                data = self._receive(sock)
+            except OSError:
+                return
+
+            if not data:
+                return
+
+            self._handle_data_received(data)
+
+    def _receive(self, sock):
+        """Receives into the preallocated buffer.
+
+        Returns:
+            A view of the received bytes
+            that is only valid until the next receive.
+            Empty if the connection was closed.
+        """
+        if hasattr(sock, 'recv_into'):
+            return self._receive_buffer_view[:sock.recv_into(self._receive_buffer)]
+
+        return sock.recv(self._RECEIVE_BUFFER_SIZE)
+
+    def _handle_data_received(self, data):
+        if self.data_received_handler is not None:
+            if callable(self.data_received_handler):
+                self.data_received_handler(data)
+            else:
+                raise ValueError(
+                    'data_received_handler is not callable.')
 
     @staticmethod
     def _find_device(search_name):
@@ -1335,17 +4116,169 @@ class BleInterface(BluetoothInterfaceBase):
 
         return found_device
 
+
+class AsyncTransportBase(object):
+    """Base class for asyncio transports to a Sphero.
+
+    connect is a coroutine and write never blocks the event loop.
+    Transports whose device can't be written without blocking
+    hand the writes to a thread of their own, in order.
+    Received data is passed to data_received_handler.
+    Transports that watch their socket through io_thread
+    call it on the event loop that decodes the data,
+    so no thread hand off is needed.
+    Transports that receive on other threads can call it from there,
+    and Sphero hands the data over to the decoding thread.
+
+    Attributes:
+        data_received_handler (callable):
+            Called with received data. Set by Sphero before connect.
+            The data can be a view of a buffer that is reused
+            after the call returns.
+        io_thread:
+            The thread received data is decoded on,
+            either the event loop or an IoReactor thread.
+            Set by Sphero before connect.
+            Has call_soon, register_reader, register_writer,
+            unregister_writer and unregister methods.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.data_received_handler = None
+        self.io_thread = None
+
+    async def connect(self, num_retry_attempts=1):
+        """Connects to the device.
+
+        Args:
+            num_retry_attempts (int):
+                The number of times to try to connect.
+                Defaults to 1.
+        """
+        pass
+
+    def write(self, data):
+        """Queues data to be sent. Must not block.
+
+        Args:
+            data (bytes-like):
+                The raw data to send.
+        """
+        pass
+
+    def close(self):
+        """Disconnects from the device."""
+        pass
+
+
+class InterfaceTransport(AsyncTransportBase):
+    """Adapts a BluetoothInterfaceBase to AsyncTransportBase.
+
+    The interface connects on the event loop's default executor,
+    so searching for and connecting to the device doesn't block the loop.
+    BluetoothInterface watches its socket through io_thread,
+    so by default its data is read and decoded on the event loop.
+    BleInterface and other interfaces deliver data on their own threads.
+
+    Only a BluetoothInterface socket watched through io_thread
+    is written directly, since its writes never block.
+    Writes to any other interface, such as GATT writes over BLE
+    or a blocking RFCOMM socket, are queued for a writer thread
+    that sends them one at a time in the order they were written.
+
+    Args:
+        bluetooth_interface (BluetoothInterfaceBase):
+            The interface to adapt.
+    """
+
+    # How long close waits for queued writes to be sent.
+    _CLOSE_TIMEOUT_IN_SECONDS = 1.0
+
+    def __init__(self, bluetooth_interface):
+        super().__init__()
+        self.bluetooth_interface = bluetooth_interface
+        # The number of writes that raised and the last error.
+        # Only counts writes made on the writer thread.
+        self.num_write_errors = 0
+        self.last_write_error = None
+        self._write_queue = collections.deque()
+        self._write_condition = threading.Condition()
+        self._writer_thread = None
+        self._is_closing = False
+
+    async def connect(self, num_retry_attempts=1):
+        bluetooth_interface = self.bluetooth_interface
+        bluetooth_interface.data_received_handler = self.data_received_handler
+        bluetooth_interface.io_thread = self.io_thread
+        self._is_closing = False
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(bluetooth_interface.connect,
+                              num_retry_attempts=num_retry_attempts))
+
+    def write(self, data):
+        bluetooth_interface = self.bluetooth_interface
+        if bluetooth_interface.can_send_without_blocking:
+            bluetooth_interface.send(data)
+            return
+
+        with self._write_condition:
+            if self._is_closing:
+                return
+
+            # The data can be a view of a packet that is changed when it is resent.
+            self._write_queue.append(bytes(data))
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._run_writer,
+                                                       args=[self._write_queue],
+                                                       name='spheropy-transport-writer',
+                                                       daemon=True)
+                self._writer_thread.start()
+            else:
+                self._write_condition.notify()
+
+    def close(self):
+        with self._write_condition:
+            self._is_closing = True
+            # The writer sends what is left in its queue and stops.
+            # A writer stuck in a send can't take writes made after a reconnect.
+            self._write_queue = collections.deque()
+            self._write_condition.notify_all()
+            writer_thread = self._writer_thread
+            self._writer_thread = None
+
+        # Let the writer send what was written before close.
+        if writer_thread is not None and writer_thread is not threading.current_thread():
+            writer_thread.join(self._CLOSE_TIMEOUT_IN_SECONDS)
+
+        self.bluetooth_interface.disconnect()
+
+    def _run_writer(self, write_queue):
+        send = self.bluetooth_interface.send
+        while True:
+            with self._write_condition:
+                while not write_queue and write_queue is self._write_queue:
+                    self._write_condition.wait()
+
+                if not write_queue:
+                    return
+
+                data = write_queue.popleft()
+
+            try:
+                send(data)
+            except Exception as error:
+                # Keep sending the writes that follow.
+                self.num_write_errors += 1
+                self.last_write_error = error
+
 # endregion
 
 
 # Minimum length of a valid packet
 _MIN_PACKET_LENGTH = 6
-
-# TODO: where to put these
-_ID_CODE_POWER_NOTIFICATION = 0x01
-_ID_CODE_COLLISION_DETECTED = 0x07
-_ID_CODE_SELF_LEVEL_COMPLETE = 0x0B
-# TODO: Fill the rest as needed
+_START_OF_PACKET_1_BYTES = b'\xff'
 
 # region Data Tuples and Parsers
 VersionInfo = namedtuple("VersionInfo",
@@ -1361,17 +4294,15 @@ VersionInfo = namedtuple("VersionInfo",
                           "firmware_api_minor_revision"])
 
 
+_VERSION_INFO_STRUCT = struct.Struct('>10B')
+
+
 def _parse_version_info(data):
-    return VersionInfo(data[0] if data else None,
-                       data[1] if len(data) > 1 else None,
-                       data[2] if len(data) > 2 else None,
-                       data[3] if len(data) > 3 else None,
-                       data[4] if len(data) > 4 else None,
-                       data[5] if len(data) > 5 else None,
-                       data[6] if len(data) > 6 else None,
-                       data[7] if len(data) > 7 else None,
-                       data[8] if len(data) > 8 else None,
-                       data[9] if len(data) > 9 else None)
+    if len(data) >= _VERSION_INFO_STRUCT.size:
+        return VersionInfo._make(_VERSION_INFO_STRUCT.unpack_from(data))
+
+    # Older firmware sends shorter records.
+    return VersionInfo._make(tuple(data) + (None,) * (_VERSION_INFO_STRUCT.size - len(data)))
 
 
 BluetoothInfo = namedtuple("BluetoothInfo",
@@ -1383,11 +4314,11 @@ BluetoothInfo = namedtuple("BluetoothInfo",
 def _parse_bluetooth_info(data):
     """
     """
-    # Combine the bytes as a char string and then strip off extra bytes.
-    name = ''.join(chr(i) for i in data[:16]).partition('\0')[0]
-    return BluetoothInfo(name,
-                         ''.join(chr(i) for i in data[16:28]),
-                         ''.join(chr(i) for i in data[29:]))
+    data = bytes(data)
+    # Strip the padding off the name.
+    return BluetoothInfo(data[:16].partition(b'\0')[0].decode('latin-1'),
+                         data[16:28].decode('latin-1'),
+                         data[29:].decode('latin-1'))
 
 
 AutoReconnectInfo = namedtuple("AutoReconnectInfo",
@@ -1395,80 +4326,98 @@ AutoReconnectInfo = namedtuple("AutoReconnectInfo",
                                 "seconds_after_boot"])
 
 
+_AUTO_RECONNECT_INFO_STRUCT = struct.Struct('>BB')
+
+
 def _parse_auto_reconnect_info(data):
     """
     """
-    if len(data) is not 2:
+    if len(data) != _AUTO_RECONNECT_INFO_STRUCT.size:
         raise ValueError(
             "data is not 2 bytes long. Actual length: {}".format(len(data)))
 
-    return AutoReconnectInfo(data[0] is not 0,
-                             data[1])
+    is_enabled, seconds_after_boot = _AUTO_RECONNECT_INFO_STRUCT.unpack_from(data)
+    return AutoReconnectInfo(is_enabled != 0, seconds_after_boot)
 
 
-PowerState = namedtuple("PowerState",
-                        ["record_version",
-                         "battery_state",
-                         "battery_voltage",
-                         "total_number_of_recharges",
-                         "seconds_awake_since_last_recharge"])
+class PowerState(namedtuple("PowerState",
+                            ["record_version",
+                             "battery_state",
+                             "battery_voltage",
+                             "total_number_of_recharges",
+                             "seconds_awake_since_last_recharge"])):
+    """The response to get_power_state.
 
-
-def _parse_power_state(data):
-    """
+    battery_voltage is in hundredths of a volt.
     """
-    return PowerState(data[0],
-                      data[1],
-                      _pack_bytes(data[2:4]),
-                      _pack_bytes(data[4:6]),
-                      _pack_bytes(data[6:8]))
+    __slots__ = ()
 
+    @property
+    def battery_voltage_in_volts(self):
+        return self.battery_voltage / 100.0
 
-LocatorInfo = namedtuple("LocatorInfo",
-                         ["pos_x",
-                          "pos_y",
-                          "vel_x",
-                          "vel_y",
-                          "speed_over_ground"])
 
+class LocatorInfo(namedtuple("LocatorInfo",
+                             ["pos_x",
+                              "pos_y",
+                              "vel_x",
+                              "vel_y",
+                              "speed_over_ground"])):
+    """The response to get_locator_info.
 
-def _parse_locator_info(data):
+    Positions are in centimeters and velocities in centimeters per second.
     """
+    __slots__ = ()
+
+    @property
+    def position_in_meters(self):
+        """The (x, y) position in meters."""
+        return (self.pos_x / 100.0, self.pos_y / 100.0)
+
+    @property
+    def velocity_in_meters_per_second(self):
+        """The (x, y) velocity in meters per second."""
+        return (self.vel_x / 100.0, self.vel_y / 100.0)
+
+    @property
+    def speed_over_ground_in_meters_per_second(self):
+        return self.speed_over_ground / 100.0
+
+
+class CollisionInfo(namedtuple("CollisionInfo",
+                               ["x_impact",
+                                "y_impact",
+                                "z_impact",
+                                "axis",
+                                "x_magnitude",
+                                "y_magnitude",
+                                "speed",
+                                "timestamp",
+                                "host_time"])):
+    """A collision notification.
+
+    timestamp is the Sphero's millisecond timer at the time of impact.
+    host_time is the same moment in host time (time.monotonic()),
+    estimated by the Sphero's clock model. See Sphero.sync_clock.
     """
-    return LocatorInfo(_pack_bytes_signed(data[0:2]),
-                       _pack_bytes_signed(data[2:4]),
-                       _pack_bytes_signed(data[4:6]),
-                       _pack_bytes_signed(data[6:8]),
-                       _pack_bytes(data[8:10]))
+    __slots__ = ()
+
+    @property
+    def timestamp_in_seconds(self):
+        return self.timestamp / 1000.0
 
 
-CollisionInfo = namedtuple("CollisionInfo",
-                           ["x_impact",
-                            "y_impact",
-                            "z_impact",
-                            "axis",
-                            "x_magnitude",
-                            "y_magnitude",
-                            "speed",
-                            "timestamp"])
+_COLLISION_INFO_STRUCT = struct.Struct('>hhhBHHBI')
 
 
 def _parse_collision_info(data):
     """
     """
-
-    if len(data) is not 0x10:
+    if len(data) != _COLLISION_INFO_STRUCT.size:
         raise ValueError(
             "data is not 16 bytes long. Actual length: {}".format(len(data)))
 
-    return CollisionInfo(_pack_bytes_signed(data[0:2]),
-                         _pack_bytes_signed(data[2:4]),
-                         _pack_bytes_signed(data[4:6]),
-                         data[6],
-                         _pack_bytes(data[7:9]),
-                         _pack_bytes(data[9:11]),
-                         data[11],
-                         _pack_bytes(data[12:16]))
+    return CollisionInfo._make(_COLLISION_INFO_STRUCT.unpack_from(data) + (None,))
 
 
 class SelfLevelResult(enum.Enum):
@@ -1483,404 +4432,1443 @@ class SelfLevelResult(enum.Enum):
 def _parse_self_level_result(data):
     return SelfLevelResult(data[0])
 
+
+def _parse_power_notification(data):
+    return data[0]
+
+
+def _parse_ascii(data):
+    return bytes(data).decode('ascii', 'replace')
+
+
+def _parse_no_data(data):
+    return None
+
+
+ClockEstimate = namedtuple("ClockEstimate",
+                           ["offset_in_seconds",
+                            "drift_ppm",
+                            "round_trips",
+                            "arrivals",
+                            "min_rtt_in_seconds"])
+
+
+SensorStreamStats = namedtuple("SensorStreamStats",
+                               ["rate_hz",
+                                "packets",
+                                "samples",
+                                "dropped_samples",
+                                "drops",
+                                "drift_ppm"])
+
+
+LocatorTrackerStats = namedtuple("LocatorTrackerStats",
+                                 ["mode",
+                                  "samples",
+                                  "polls",
+                                  "poll_errors",
+                                  "poll_interval_in_seconds",
+                                  "last_poll_error"])
+
+
+WireCaptureStats = namedtuple("WireCaptureStats",
+                              ["records",
+                               "bytes",
+                               "flushes",
+                               "pending"])
+
+
+WireRecord = namedtuple("WireRecord",
+                        ["direction",
+                         "time_ns",
+                         "data"])
+
+
+_WIRE_CAPTURE_HEADER = struct.Struct('<8sQQ')
+_WIRE_CAPTURE_RECORD_HEADER = struct.Struct('<IBQ')
+
+
+AsyncMessageStats = namedtuple("AsyncMessageStats",
+                               ["received",
+                                "unhandled"])
+
+
+RttEstimate = namedtuple("RttEstimate",
+                         ["smoothed_rtt_in_seconds",
+                          "rtt_variation_in_seconds",
+                          "response_timeout_in_seconds",
+                          "sample_count"])
+
+
+QueueDelayStats = namedtuple("QueueDelayStats",
+                             ["count",
+                              "mean_delay_in_seconds",
+                              "max_delay_in_seconds",
+                              "last_delay_in_seconds"])
+
+
+ReceiveStats = namedtuple("ReceiveStats",
+                          ["queue_depth",
+                           "peak_queue_depth",
+                           "max_queue_size",
+                           "chunks",
+                           "bytes",
+                           "packets",
+                           "dropped",
+                           "reader_blocks",
+                           "mean_ack_lag_in_seconds",
+                           "max_ack_lag_in_seconds",
+                           "mean_lag_in_seconds",
+                           "max_lag_in_seconds",
+                           "last_lag_in_seconds",
+                           "errors",
+                           "last_error"])
+
+
+CallbackStats = namedtuple("CallbackStats",
+                           ["calls",
+                            "pending",
+                            "mean_delay_in_seconds",
+                            "max_delay_in_seconds",
+                            "mean_run_time_in_seconds",
+                            "max_run_time_in_seconds",
+                            "last_run_time_in_seconds",
+                            "errors",
+                            "last_error"])
+
+
+CommandWindowStats = namedtuple("CommandWindowStats",
+                                ["window_size",
+                                 "in_flight",
+                                 "peak_in_flight",
+                                 "mean_in_flight",
+                                 "total_commands",
+                                 "total_waits",
+                                 "total_wait_time_in_seconds"])
+
 # endregion
 
 
-# region Command Factory Methods
-_DEVICE_ID_CORE = 0x00
+# region Private Package Classes
 
-_COMMAND_ID_PING = 0x01
 
+class _CommandWindow(object):
+    """Limits the number of commands waiting for a response.
 
-def _create_ping_command(sequence_number,
-                         wait_for_response,
-                         reset_inactivity_timeout):
-    """
+    Commands acquire a slot before they are sent and release it
+    once their response arrives or they time out.
+    When the window is full, acquire waits without blocking the event loop
+    and slots are handed to waiters in the order they arrived.
+    Waiters may belong to different event loops.
+
+    Args:
+        size (int):
+            The maximum number of commands in flight.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_PING,
-                                sequence_number=sequence_number,
-                                data=None,
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    def __init__(self, size):
+        self._size = size
+        self._lock = threading.Lock()
+        # Heap of waiters ordered by priority and then arrival.
+        # Each waiter is a list of
+        # [priority, arrival_order, event_loop, future, was_granted_slot].
+        self._waiters = []
+        self._arrival_order = itertools.count()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._total_commands = 0
+        self._total_waits = 0
+        self._total_wait_time = 0.0
+        self._in_flight_time_integral = 0.0
+        self._start_time = time.monotonic()
+        self._last_change_time = self._start_time
+
+    async def acquire(self, priority=CommandPriority.QUERY, can_exceed_window=False):
+        """Waits until a slot is free and takes it.
 
-_COMMAND_ID_GET_VERSION = 0x02
+        Args:
+            priority (CommandPriority):
+                Waiters with a higher priority get free slots first.
+            can_exceed_window (bool):
+                If True, takes a slot right away even if the window is full.
+                Used by emergency stops.
+                The window never exceeds 255 commands
+                so sequence numbers cannot run out.
+        """
+        with self._lock:
+            if ((self._in_flight < self._size and not self._waiters) or
+                    (can_exceed_window and self._in_flight < 0xFF)):
+                self._take_slot()
+                return
+
+            event_loop = asyncio.get_event_loop()
+            waiter = [priority, next(self._arrival_order),
+                      event_loop, event_loop.create_future(), False]
+            heapq.heappush(self._waiters, waiter)
+            self._total_waits += 1
+
+        wait_start_time = time.monotonic()
+        try:
+            await waiter[3]
+        except asyncio.CancelledError:
+            with self._lock:
+                was_granted_slot = waiter[4]
+                if not was_granted_slot and waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+
+            if was_granted_slot:
+                # The slot was handed to us as we were cancelled.
+                self.release()
+
+            raise
+        finally:
+            with self._lock:
+                self._total_wait_time += time.monotonic() - wait_start_time
+
+    def release(self):
+        """Frees a slot, handing it to the first waiter if there is one."""
+        with self._lock:
+            if self._in_flight <= self._size:
+                while self._waiters:
+                    waiter = heapq.heappop(self._waiters)
+                    _, _, event_loop, future, _ = waiter
+                    if future.done():
+                        continue
+
+                    try:
+                        _call_on_loop(event_loop, _set_future_result, future, None)
+                    except RuntimeError:
+                        # The waiter's event loop is closed.
+                        continue
+
+                    # The slot is transferred so in_flight does not change.
+                    waiter[4] = True
+                    self._total_commands += 1
+                    return
+
+            self._update_in_flight(self._in_flight - 1)
 
+    @property
+    def stats(self):
+        """The current CommandWindowStats."""
+        with self._lock:
+            now = time.monotonic()
+            integral = self._in_flight_time_integral + \
+                self._in_flight * (now - self._last_change_time)
+            elapsed = now - self._start_time
+            return CommandWindowStats(self._size,
+                                      self._in_flight,
+                                      self._peak_in_flight,
+                                      integral / elapsed if elapsed > 0 else 0.0,
+                                      self._total_commands,
+                                      self._total_waits,
+                                      self._total_wait_time)
+
+    def _take_slot(self):
+        self._total_commands += 1
+        self._update_in_flight(self._in_flight + 1)
+
+    def _update_in_flight(self, in_flight):
+        now = time.monotonic()
+        self._in_flight_time_integral += self._in_flight * \
+            (now - self._last_change_time)
+        self._last_change_time = now
+        self._in_flight = in_flight
+        self._peak_in_flight = max(self._peak_in_flight, in_flight)
+
+
+# Maps each Sphero to the batch open in the current task.
+# Never mutated; entering a batch sets a new dict.
+_OPEN_COMMAND_BATCHES = contextvars.ContextVar('spheropy_open_command_batches', default={})
+
+
+class _CommandBatch(object):
+    """Async context manager returned by Sphero.batch()."""
+
+    def __init__(self, sphero, response_timeout_in_seconds):
+        self._sphero = sphero
+        self._response_timeout_in_seconds = response_timeout_in_seconds
+        self._commands = []
+        self._context_token = None
+        # Tasks started inside the batch inherit its context,
+        # so commands are only batched from the task that opened it.
+        self.task = None
+
+    def add(self, command):
+        """Adds command to the batch."""
+        if command.expects_response_data:
+            raise SpheroError('Commands that return data cannot be sent in a batch.')
+
+        self._commands.append(command)
+
+    async def __aenter__(self):
+        open_batches = _OPEN_COMMAND_BATCHES.get()
+        open_batch = open_batches.get(self._sphero)
+        if open_batch is not None and open_batch.task is asyncio.current_task():
+            raise SpheroError('Batches cannot be nested.')
+
+        open_batches = dict(open_batches)
+        open_batches[self._sphero] = self
+        self._context_token = _OPEN_COMMAND_BATCHES.set(open_batches)
+        self.task = asyncio.current_task()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.task = None
+        _OPEN_COMMAND_BATCHES.reset(self._context_token)
+        self._context_token = None
+        if exc_type is not None:
+            # Cancellation and other BaseExceptions propagate unchanged.
+            if self._commands and issubclass(exc_type, Exception):
+                dropped = ', '.join(command.spec.name for command in self._commands)
+                raise SpheroError(
+                    f'The batch was not sent because its body raised. Dropped commands: {dropped}') from exc
+            return
 
-def _create_get_version_command(sequence_number,
-                                wait_for_response,
-                                reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_GET_VERSION,
-                                sequence_number=sequence_number,
-                                data=None,
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+        if not self._commands:
+            return
 
+        for command in self._commands[:-1]:
+            command.wait_for_response = False
 
-_COMMAND_ID_SET_DEVICE_NAME = 0x10
+        self._commands[-1].wait_for_response = True
+        await self._sphero._send_command_group(self._commands,
+                                               self._response_timeout_in_seconds)
 
 
-def _create_set_device_name_command(device_name,
-                                    sequence_number,
-                                    wait_for_response,
-                                    reset_inactivity_timeout):
-    """
+class _WriteCoalescer(object):
+    """Packs packets into as few transport writes as possible.
+
+    Packets are always written in the order they are given.
+    With a coalescing window, packets are held until the window
+    after the first held packet expires or max_bytes would be exceeded.
+    Without a window, only packets passed to the same write call
+    are packed together.
+
+    Args:
+        write_function (callable):
+            Writes bytes to the transport.
+        window_in_seconds (float):
+            How long to hold packets waiting for more.
+            None to disable holding packets.
+        max_bytes (int):
+            The maximum number of bytes in a single write.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_SET_DEVICE_NAME,
-                                sequence_number=sequence_number,
-                                data=[ord(i) for i in device_name],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    def __init__(self, write_function, window_in_seconds, max_bytes):
+        self._write_function = write_function
+        self._window_in_seconds = window_in_seconds
+        self._max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._pending = bytearray()
+        self._flush_timer = None
 
-_COMMAND_ID_GET_BLUETOOTH_INFO = 0x11
+    def write(self, *packets, flush=False):
+        """Writes packets, possibly holding them for the coalescing window.
 
+        If flush is True, the packets and all held packets are written now.
+        """
+        with self._lock:
+            if (len(packets) == 1 and not self._pending and
+                    (flush or self._window_in_seconds is None)):
+                # Nothing to pack with, so skip the copy.
+                self._write_function(packets[0])
+                return
 
-def _create_get_bluetooth_info_command(sequence_number,
-                                       wait_for_response,
-                                       reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_GET_BLUETOOTH_INFO,
-                                sequence_number=sequence_number,
-                                data=None,
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+            for packet in packets:
+                if self._pending and len(self._pending) + len(packet) > self._max_bytes:
+                    self._flush_pending()
 
+                self._pending.extend(packet)
 
-_COMMAND_ID_SET_AUTO_RECONNECT = 0x12
+            if flush or self._window_in_seconds is None or len(self._pending) >= self._max_bytes:
+                self.flush()
+            elif self._pending and self._flush_timer is None:
+                self._flush_timer = asyncio.get_event_loop().call_later(self._window_in_seconds,
+                                                                        self.flush)
 
+    def flush(self):
+        """Writes all held packets now."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
 
-def _create_set_auto_reconnect_command(should_enable_auto_reconnect,
-                                       seconds_after_boot,
-                                       sequence_number,
-                                       wait_for_response,
-                                       reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_SET_AUTO_RECONNECT,
-                                sequence_number=sequence_number,
-                                data=[0x01 if should_enable_auto_reconnect else 0x00,
-                                      seconds_after_boot],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+            if self._pending:
+                self._flush_pending()
+
+    def _flush_pending(self):
+        data = bytes(self._pending)
+        self._pending.clear()
+        self._write_function(data)
 
 
-_COMMAND_ID_GET_AUTO_RECONNECT = 0x13
+class _RttEstimator(object):
+    """Estimates round trip time and response timeout like TCP (RFC 6298).
 
+    Thread safe, since samples are added from the message processing thread.
 
-def _create_get_auto_reconnect_command(sequence_number,
-                                       wait_for_response,
-                                       reset_inactivity_timeout):
-    """
+    Args:
+        initial_timeout_in_seconds (float):
+            The timeout used before the first sample.
+        min_timeout_in_seconds (float):
+            The lower bound of the timeout.
+        max_timeout_in_seconds (float):
+            The upper bound of the timeout.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_GET_AUTO_RECONNECT,
-                                sequence_number=sequence_number,
-                                data=None,
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    _ALPHA = 1 / 8
+    _BETA = 1 / 4
+    _K = 4
 
-_COMMAND_ID_GET_POWER_STATE = 0x20
+    def __init__(self,
+                 initial_timeout_in_seconds=0.5,
+                 min_timeout_in_seconds=0.1,
+                 max_timeout_in_seconds=5.0):
+        self._min_timeout = min_timeout_in_seconds
+        self._max_timeout = max_timeout_in_seconds
+        self._lock = threading.Lock()
+        self._smoothed_rtt = None
+        self._rtt_variation = None
+        self._timeout = initial_timeout_in_seconds
+        self._sample_count = 0
+
+    def add_sample(self, rtt):
+        """Updates the estimate with a measured round trip time in seconds."""
+        with self._lock:
+            if self._smoothed_rtt is None:
+                self._smoothed_rtt = rtt
+                self._rtt_variation = rtt / 2
+            else:
+                self._rtt_variation = ((1 - self._BETA) * self._rtt_variation +
+                                       self._BETA * abs(self._smoothed_rtt - rtt))
+                self._smoothed_rtt = (1 - self._ALPHA) * self._smoothed_rtt + self._ALPHA * rtt
 
+            self._sample_count += 1
+            self._timeout = self._clamp(self._smoothed_rtt + self._K * self._rtt_variation)
 
-def _create_get_power_state_command(sequence_number,
-                                    wait_for_response,
-                                    reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_GET_POWER_STATE,
-                                sequence_number=sequence_number,
-                                data=None,
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+    def back_off(self):
+        """Doubles the timeout after a timeout, until the next sample."""
+        with self._lock:
+            self._timeout = self._clamp(self._timeout * 2)
+
+    @property
+    def response_timeout(self):
+        """The current response timeout in seconds."""
+        return self._timeout
 
+    @property
+    def estimate(self):
+        """The current RttEstimate."""
+        with self._lock:
+            return RttEstimate(self._smoothed_rtt,
+                               self._rtt_variation,
+                               self._timeout,
+                               self._sample_count)
 
-_COMMAND_ID_SET_POWER_NOTIFICATION = 0x21
+    def _clamp(self, timeout):
+        return min(max(timeout, self._min_timeout), self._max_timeout)
 
 
-def _create_set_power_notification_command(should_enable,
-                                           sequence_number,
-                                           wait_for_response,
-                                           reset_inactivity_timeout):
-    """
+class _SendScheduler(object):
+    """Writes commands in priority order.
+
+    Commands submitted while the event loop is busy are queued
+    and written in CommandPriority order on the next loop iteration.
+    Commands of the same priority keep the order they were submitted in.
+    CONTROL commands are flushed through the write coalescer right away.
+
+    Args:
+        write_function (callable):
+            Writes packets. Called as write_function(*packets, flush=bool).
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_CORE,
-                                command_id=_COMMAND_ID_SET_POWER_NOTIFICATION,
-                                sequence_number=sequence_number,
-                                data=[0x01 if should_enable else 0x00],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    def __init__(self, write_function):
+        self._write_function = write_function
+        self._lock = threading.Lock()
+        self._queue = []
+        self._submit_order = itertools.count()
+        self._is_drain_scheduled = False
+        self._delay_totals = {priority: [0, 0.0, 0.0, 0.0]
+                              for priority in CommandPriority}
 
-_DEVICE_ID_SPHERO = 0x02
+    def submit(self, commands, priority, send_time, is_preempted, on_preempted=None):
+        """Queues commands to be written together.
 
-_COMMAND_ID_SET_HEADING = 0x01
+        Args:
+            commands (list):
+                The _ClientCommandPackets to write in a single write.
+            priority (CommandPriority):
+                The priority of the commands.
+            send_time (float):
+                The time.monotonic() the commands were sent at.
+                Used to measure queueing delay.
+            is_preempted (callable):
+                Called with each command before it is written.
+                Commands for which it returns True are dropped.
+            on_preempted (callable):
+                Called if the last command is dropped.
+        """
+        with self._lock:
+            heapq.heappush(self._queue,
+                           (priority, next(self._submit_order),
+                            commands, send_time, is_preempted, on_preempted))
+            if not self._is_drain_scheduled:
+                self._is_drain_scheduled = True
+                asyncio.get_event_loop().call_soon(self._drain)
 
+    @property
+    def stats(self):
+        """A dict of QueueDelayStats by CommandPriority."""
+        with self._lock:
+            return {priority: QueueDelayStats(count,
+                                              total / count if count else 0.0,
+                                              max_delay,
+                                              last_delay)
+                    for priority, (count, total, max_delay, last_delay)
+                    in self._delay_totals.items()}
+
+    def _drain(self):
+        with self._lock:
+            queue_entries = self._queue
+            self._queue = []
+            self._is_drain_scheduled = False
+
+        while queue_entries:
+            priority, _, commands, send_time, is_preempted, on_preempted = heapq.heappop(
+                queue_entries)
+            packets = [c.bytes for c in commands if not is_preempted(c)]
+            if is_preempted(commands[-1]) and on_preempted is not None:
+                on_preempted()
+
+            if not packets:
+                continue
+
+            self._write_function(*packets,
+                                 flush=priority is CommandPriority.CONTROL)
+            write_time = time.monotonic()
+            commands[-1].write_time = write_time
+            self._record_delay(priority, write_time - send_time)
+
+    def _record_delay(self, priority, delay):
+        with self._lock:
+            totals = self._delay_totals[priority]
+            totals[0] += 1
+            totals[1] += delay
+            totals[2] = max(totals[2], delay)
+            totals[3] = delay
+
+
+class _ReceiveWorker(object):
+    """Decodes the data received on one connection.
+
+    Decoding runs on the event loop,
+    or on the IoReactor thread the connection is pinned to.
+    Packets are sorted into two lanes when they are framed:
+        * Command responses (acks) are handled right away,
+          or as soon as the decoding thread gets to them
+          if they were received on another thread.
+          Acks are never dropped or blocked on.
+        * Asynchronous packets (telemetry) are queued and handled
+          a slice at a time, so parsing and dispatching them
+          never holds up an ack for long.
+    Each lane keeps the order its packets were received in.
+
+    The telemetry queue is bounded. When it is full:
+        * BLOCK makes a receiving thread other than the decoding thread
+          wait for room, which pushes back on the bluetooth library.
+        * DROP_OLDEST drops the oldest queued packet.
+    The decoding thread never waits on itself,
+    so it always drops the oldest packet.
 
-def _create_set_heading_command(heading,
-                                sequence_number,
-                                wait_for_response,
-                                reset_inactivity_timeout):
-    """
+    Args:
+        handle_ack (callable):
+            Called on the decoding thread with each synchronous _ResponsePacket.
+        handle_telemetry (callable):
+            Called on the decoding thread with each asynchronous _ResponsePacket.
+        io_reactor (IoReactor, None):
+            The reactor to run on. If None, runs on the event loop passed to start.
+        max_queue_size (int):
+            The maximum number of queued asynchronous packets.
+        overflow (str):
+            BLOCK or DROP_OLDEST.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_SET_HEADING,
-                                sequence_number=sequence_number,
-                                data=[_get_byte_at_index(heading, 1),
-                                      _get_byte_at_index(heading, 0)],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
 
-_COMMAND_ID_SET_STABILIZATION = 0x02
+    # The number of asynchronous packets handled before
+    # the decoding thread goes back to receiving.
+    _TELEMETRY_SLICE_SIZE = 16
 
+    def __init__(self,
+                 handle_ack,
+                 handle_telemetry,
+                 io_reactor=None,
+                 max_queue_size=1024,
+                 overflow=DROP_OLDEST):
+        if max_queue_size < 1:
+            raise ValueError(
+                f'receive_queue_size must be at least 1. receive_queue_size was {max_queue_size}')
+
+        if overflow not in (self.BLOCK, self.DROP_OLDEST):
+            raise ValueError(
+                f'receive_overflow must be {self.BLOCK!r} or {self.DROP_OLDEST!r}. receive_overflow was {overflow!r}')
+
+        self._handle_ack_packet = handle_ack
+        self._handle_telemetry_packet = handle_telemetry
+        self._io_reactor = io_reactor
+        self._max_queue_size = max_queue_size
+        self._block_on_overflow = overflow == self.BLOCK
+        self._framer = _ReceiveFramer()
+        # The thread received data is decoded on.
+        self.io_thread = None
+        # WireCapture.append, called with each received chunk. None if not capturing.
+        self.record_received = None
+        # (receive time, _ResponsePacket)
+        self._queue = collections.deque()
+        self._queue_condition = threading.Condition()
+        self._is_drain_scheduled = False
+        self._peak_queue_depth = 0
+        self._num_chunks = 0
+        self._num_acks = 0
+        self._num_packets = 0
+        self._num_dropped = 0
+        self._num_reader_blocks = 0
+        self._total_ack_lag = 0.0
+        self._max_ack_lag = 0.0
+        self._total_lag = 0.0
+        self._max_lag = 0.0
+        self._last_lag = 0.0
+        self._num_errors = 0
+        self._last_error = None
 
-def _create_set_stabilization_command(stabilization,
-                                      sequence_number,
-                                      wait_for_response,
-                                      reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_SET_STABILIZATION,
-                                sequence_number=sequence_number,
-                                data=[0x01 if stabilization else 0x00],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+    @property
+    def is_running(self):
+        """True if the worker is attached to a loop or reactor thread."""
+        return self.io_thread is not None
 
+    @property
+    def stats(self):
+        """A ReceiveStats namedtuple."""
+        num_acks = self._num_acks
+        num_packets = self._num_packets
+        return ReceiveStats(len(self._queue),
+                            self._peak_queue_depth,
+                            self._max_queue_size,
+                            self._num_chunks,
+                            self._framer.bytes_received,
+                            num_acks + num_packets,
+                            self._num_dropped,
+                            self._num_reader_blocks,
+                            self._total_ack_lag / num_acks if num_acks else 0.0,
+                            self._max_ack_lag,
+                            self._total_lag / num_packets if num_packets else 0.0,
+                            self._max_lag,
+                            self._last_lag,
+                            self._num_errors,
+                            self._last_error)
+
+    def start(self, event_loop):
+        """Attaches the connection to event_loop or to a reactor thread.
+
+        Must be called on event_loop's thread.
+        """
+        if self.is_running:
+            return
 
-_COMMAND_ID_SELF_LEVEL = 0x09
+        # Bytes of a partial packet from a previous connection are stale.
+        self._framer = _ReceiveFramer()
+        if self._io_reactor is None:
+            self.io_thread = _LoopIoThread(event_loop)
+        else:
+            self.io_thread = self._io_reactor.assign()
 
+    def stop(self):
+        """Detaches the connection. Packets already queued are still handled."""
+        io_thread = self.io_thread
+        if io_thread is None:
+            return
 
-def _create_self_level_command(start,
-                               use_original_heading,
-                               sleep,
-                               turn_on_control_system,
-                               angle_limit,
-                               timeout,
-                               true_time,
-                               sequence_number,
-                               wait_for_response,
-                               reset_inactivity_timeout):
-    """
-    """
-    options = ((1 if start else 0) | (1 if use_original_heading else 0) >> 1 | (
-        1 if sleep else 0) >> 2 | (1 if turn_on_control_system else 0) >> 3)
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_SELF_LEVEL,
-                                sequence_number=sequence_number,
-                                data=[options, angle_limit,
-                                      timeout, true_time],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+        self.io_thread = None
+        with self._queue_condition:
+            # Release blocked receiving threads.
+            self._queue_condition.notify_all()
 
+        if self._io_reactor is not None:
+            self._io_reactor.release(io_thread)
 
-_COMMAND_ID_CONFIGURE_COLLISION_DETECTION = 0x12
+    def put(self, data):
+        """Frames received data and sorts the packets into the lanes.
 
+        Called from the transport's receiving thread,
+        one call at a time.
+        """
+        io_thread = self.io_thread
+        if io_thread is None:
+            return
 
-def _create_configure_collision_detection_command(turn_on_collision_detection,
-                                                  x_t,
-                                                  x_speed,
-                                                  y_t,
-                                                  y_speed,
-                                                  collision_dead_time,
-                                                  sequence_number,
-                                                  wait_for_response,
-                                                  reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_CONFIGURE_COLLISION_DETECTION,
-                                sequence_number=sequence_number,
-                                data=[0x01 if turn_on_collision_detection else 0x00,
-                                      x_t, x_speed,
-                                      y_t, y_speed,
-                                      collision_dead_time],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+        receive_time = time.monotonic()
+        record_received = self.record_received
+        if record_received is not None:
+            # Copies the data, which can be a view of a buffer that is reused,
+            # only while the capture is open.
+            record_received(WireCapture.RECEIVED, data)
+
+        self._num_chunks += 1
+        response_packets = self._framer.feed(data)
+        if not response_packets:
+            return
 
+        is_io_thread = io_thread.is_current()
+        telemetry_packets = None
+        for response_packet in response_packets:
+            response_packet.receive_time = receive_time
+            if response_packet.is_async:
+                if telemetry_packets is None:
+                    telemetry_packets = []
+                telemetry_packets.append(response_packet)
+            elif is_io_thread:
+                self._handle_ack(receive_time, response_packet)
+            else:
+                # The framer reuses its buffer on the next feed.
+                response_packet.detach()
+                io_thread.call_soon(self._handle_ack, receive_time, response_packet)
+
+        if telemetry_packets is not None:
+            self._enqueue(io_thread, is_io_thread, receive_time, telemetry_packets)
+
+    def _enqueue(self, io_thread, is_io_thread, receive_time, response_packets):
+        can_block = self._block_on_overflow and not is_io_thread
+        queue = self._queue
+        with self._queue_condition:
+            for response_packet in response_packets:
+                response_packet.detach()
+                if len(queue) >= self._max_queue_size:
+                    if can_block:
+                        self._num_reader_blocks += 1
+                        self._schedule_drain(io_thread)
+                        while len(queue) >= self._max_queue_size and self.io_thread is io_thread:
+                            self._queue_condition.wait()
+
+                    if len(queue) >= self._max_queue_size:
+                        queue.popleft()
+                        self._num_dropped += 1
+
+                queue.append((receive_time, response_packet))
+                if len(queue) > self._peak_queue_depth:
+                    self._peak_queue_depth = len(queue)
+
+            self._schedule_drain(io_thread)
+
+    def _schedule_drain(self, io_thread):
+        if not self._is_drain_scheduled:
+            self._is_drain_scheduled = True
+            io_thread.call_soon(self._drain)
+
+    def _drain(self):
+        """Handles a slice of the telemetry queue and reschedules itself if more is queued."""
+        queue = self._queue
+        with self._queue_condition:
+            items = [queue.popleft() for _ in range(min(len(queue), self._TELEMETRY_SLICE_SIZE))]
+            self._queue_condition.notify_all()
+
+        for receive_time, response_packet in items:
+            self._num_packets += 1
+            self._call(self._handle_telemetry_packet, response_packet)
+            lag = time.monotonic() - receive_time
+            self._total_lag += lag
+            self._last_lag = lag
+            if lag > self._max_lag:
+                self._max_lag = lag
+
+        with self._queue_condition:
+            io_thread = self.io_thread
+            if queue and io_thread is not None:
+                # Go back to receiving before the next slice,
+                # so acks that arrived meanwhile are not kept waiting.
+                io_thread.call_soon(self._drain)
+            else:
+                self._is_drain_scheduled = False
 
-_COMMAND_ID_CONFIGURE_LOCATOR = 0x13
+    def _handle_ack(self, receive_time, response_packet):
+        self._num_acks += 1
+        self._call(self._handle_ack_packet, response_packet)
+        lag = time.monotonic() - receive_time
+        self._total_ack_lag += lag
+        if lag > self._max_ack_lag:
+            self._max_ack_lag = lag
 
+    def _call(self, handler, response_packet):
+        try:
+            handler(response_packet)
+        except Exception as error:
+            # Keep decoding. One bad packet or handler
+            # must not stop responses from being delivered.
+            self._num_errors += 1
+            self._last_error = error
+
+
+# (SensorChannel, scale) in the order the channels appear in a frame.
+_SENSOR_CHANNEL_SCALES = [
+    (SensorChannel.ACCEL_X_RAW, 0.004),
+    (SensorChannel.ACCEL_Y_RAW, 0.004),
+    (SensorChannel.ACCEL_Z_RAW, 0.004),
+    (SensorChannel.GYRO_X_RAW, 0.068),
+    (SensorChannel.GYRO_Y_RAW, 0.068),
+    (SensorChannel.GYRO_Z_RAW, 0.068),
+    (SensorChannel.RIGHT_MOTOR_BACK_EMF_RAW, 1.0),
+    (SensorChannel.LEFT_MOTOR_BACK_EMF_RAW, 1.0),
+    (SensorChannel.LEFT_MOTOR_PWM_RAW, 1.0),
+    (SensorChannel.RIGHT_MOTOR_PWM_RAW, 1.0),
+    (SensorChannel.IMU_PITCH, 1.0),
+    (SensorChannel.IMU_ROLL, 1.0),
+    (SensorChannel.IMU_YAW, 1.0),
+    (SensorChannel.ACCEL_X, 1.0 / 4096),
+    (SensorChannel.ACCEL_Y, 1.0 / 4096),
+    (SensorChannel.ACCEL_Z, 1.0 / 4096),
+    (SensorChannel.GYRO_X, 0.1),
+    (SensorChannel.GYRO_Y, 0.1),
+    (SensorChannel.GYRO_Z, 0.1),
+    (SensorChannel.RIGHT_MOTOR_BACK_EMF, 1.0),
+    (SensorChannel.LEFT_MOTOR_BACK_EMF, 1.0),
+    (SensorChannel.QUATERNION_Q0, 0.0001),
+    (SensorChannel.QUATERNION_Q1, 0.0001),
+    (SensorChannel.QUATERNION_Q2, 0.0001),
+    (SensorChannel.QUATERNION_Q3, 0.0001),
+    (SensorChannel.ODOMETER_X, 1.0),
+    (SensorChannel.ODOMETER_Y, 1.0),
+    (SensorChannel.ACCEL_ONE, 0.001),
+    (SensorChannel.VELOCITY_X, 1.0),
+    (SensorChannel.VELOCITY_Y, 1.0),
+]
+
+
+class _SensorDataDecoder(object):
+    """Decodes sensor data packets into NumPy structured arrays.
+
+    A packet is a sequence of frames,
+    each holding one big endian int16 per channel.
+    The whole packet is converted and scaled in one vectorized step.
 
-def _create_configure_locator_command(enable_auto_yaw_tare_correction,
-                                      pos_x,
-                                      pos_y,
-                                      yaw_tare,
-                                      sequence_number,
-                                      wait_for_response,
-                                      reset_inactivity_timeout):
-    """
+    Args:
+        channels (SensorChannel):
+            The streamed channels.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_CONFIGURE_LOCATOR,
-                                sequence_number=sequence_number,
-                                data=[0x80 if enable_auto_yaw_tare_correction else 0,
-                                      _get_byte_at_index(pos_x, 0),
-                                      _get_byte_at_index(pos_x, 1),
-                                      _get_byte_at_index(pos_y, 0),
-                                      _get_byte_at_index(pos_y, 1),
-                                      _get_byte_at_index(yaw_tare, 0),
-                                      _get_byte_at_index(yaw_tare, 0)],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    def __init__(self, channels):
+        channels = SensorChannel(channels)
+        if not channels:
+            raise ValueError('channels must include at least one SensorChannel.')
+
+        names = []
+        scales = []
+        for channel, scale in _SENSOR_CHANNEL_SCALES:
+            if channel & channels:
+                names.append(channel.name.lower())
+                scales.append(scale)
+
+        self.channels = channels
+        self.mask = int(channels) >> 32
+        self.mask2 = int(channels) & 0xFFFFFFFF
+        self.dtype = numpy.dtype([('time', numpy.float64)]
+                                 + [(name, numpy.float64) for name in names])
+        self._frame_size = 2 * len(names)
+        self._scales = numpy.array(scales, dtype=numpy.float64)
+
+    def decode(self, data):
+        """Returns a structured array with one element per frame.
+
+        The 'time' field is NaN until the batch is timestamped.
+        """
+        if len(data) % self._frame_size != 0:
+            raise ValueError(
+                f'Sensor data is {len(data)} bytes long. Expected a multiple of {self._frame_size} bytes.')
+
+        raw = numpy.frombuffer(data, dtype='>i2').reshape(-1, len(self._scales))
+        # Scale into the columns after the time column.
+        # The (frames, 1 + channels) array is contiguous,
+        # so each row can be viewed as one structured element.
+        values = numpy.empty((len(raw), len(self._scales) + 1), dtype=numpy.float64)
+        values[:, 0] = numpy.nan
+        numpy.multiply(raw, self._scales, out=values[:, 1:])
+        return values.view(self.dtype)[:, 0]
 
-_COMMAND_ID_READ_LOCATOR = 0x15
 
+class _TelemetryRing(object):
+    """A fixed size NumPy ring of timestamped samples.
 
-def _create_read_locator_command(sequence_number,
-                                 wait_for_response,
-                                 reset_inactivity_timeout):
-    """
+    Each sample is written twice, capacity apart,
+    so the newest samples are always one contiguous slice
+    and can be returned as a view even after the ring wraps.
+    The times are also kept in their own contiguous array
+    so searching them never copies.
+
+    Args:
+        fields (list):
+            The names of the values of each sample.
+        capacity (int):
+            The number of samples kept.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_READ_LOCATOR,
-                                sequence_number=sequence_number,
-                                data=None,
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    def __init__(self, fields, capacity):
+        self.capacity = capacity
+        self.dtype = numpy.dtype([('time', numpy.float64)]
+                                 + [(name, numpy.float64) for name in fields])
+        self._samples = numpy.zeros(2 * capacity, dtype=self.dtype)
+        self._times = numpy.zeros(2 * capacity, dtype=numpy.float64)
+        # The index the next sample is written to, in [0, capacity).
+        self._next = 0
+        self._count = 0
+        self._last_time = float('-inf')
 
-_COMMAND_ID_SET_RGB_LED = 0x20
+    @property
+    def nbytes(self):
+        return self._samples.nbytes + self._times.nbytes
 
+    @property
+    def window(self):
+        """A view of the samples, oldest first."""
+        end = self._next + self.capacity
+        return self._samples[end - self._count:end]
+
+    def range(self, start_time, end_time):
+        end = self._next + self.capacity
+        start = end - self._count
+        times = self._times[start:end]
+        low = 0 if start_time is None else times.searchsorted(start_time, 'left')
+        high = len(times) if end_time is None else times.searchsorted(end_time, 'right')
+        return self._samples[start + low:start + high]
+
+    def append(self, values, timestamp):
+        timestamp = max(timestamp, self._last_time)
+        self._last_time = timestamp
+        sample = (timestamp,) + tuple(numpy.nan if value is None else value for value in values)
+        index = self._next
+        self._samples[index] = sample
+        self._samples[index + self.capacity] = sample
+        self._times[index] = timestamp
+        self._times[index + self.capacity] = timestamp
+        self._next = (index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, batch, timestamp, sample_period_in_seconds):
+        count = min(len(batch), self.capacity)
+        if count == 0:
+            return
 
-def _create_set_rgb_led_command(red,
-                                green,
-                                blue,
-                                save_as_user_led_color,
-                                sequence_number,
-                                wait_for_response,
-                                reset_inactivity_timeout):
-    """
+        batch = batch[len(batch) - count:]
+        samples = numpy.empty(count, dtype=self.dtype)
+        times = samples['time']
+        if 'time' in batch.dtype.names and count and not numpy.isnan(batch['time'][-1]):
+            times[:] = batch['time']
+        else:
+            times[:] = timestamp - sample_period_in_seconds * numpy.arange(count - 1, -1, -1)
+        # A batch that arrived early must not go back before the previous one.
+        numpy.maximum(times, self._last_time, out=times)
+        self._last_time = times[-1]
+        for name in self.dtype.names[1:]:
+            samples[name] = batch[name]
+
+        # Write up to the end of the ring, then wrap to its start.
+        first_count = min(count, self.capacity - self._next)
+        for offset in (0, self.capacity):
+            start = offset + self._next
+            self._samples[start:start + first_count] = samples[:first_count]
+            self._samples[offset:offset + count - first_count] = samples[first_count:]
+            self._times[start:start + first_count] = times[:first_count]
+            self._times[offset:offset + count - first_count] = times[first_count:]
+
+        self._next = (self._next + count) % self.capacity
+        self._count = min(self._count + count, self.capacity)
+
+
+class _ClockModel(object):
+    """Maps a device clock onto the host's monotonic clock.
+
+    host time = offset + device time * (1 + drift), in seconds.
+
+    Two kinds of observations feed the fit:
+        * Round trips bracket a device time between the host's send
+          and receive times. The midpoint is off by at most half the
+          round trip time, so round trips are weighted by 1 / rtt^2
+          and ones slower than twice the median are left out.
+        * Arrivals only bound the host time from above,
+          since a record is made before it is received.
+          Only the fastest arrival of each second of device time is kept,
+          and without round trips the line through them gives the drift.
+          The offset is always moved earlier
+          if the fit would put a record after its arrival,
+          so without round trips host times include
+          the fastest delivery time of the transport.
+    Drift is only fitted over a long enough span of device time.
+
+    Args:
+        device_units_per_second (float):
+            The device clock's resolution.
+        wrap (int, None):
+            The value the device counter wraps at. None if it never wraps.
     """
-    if red < 0 or red > 0xFF:
-        raise ValueError()
 
-    if green < 0 or green > 0xFF:
-        raise ValueError()
+    _MAX_ROUND_TRIPS = 32
+    _ENVELOPE_BUCKET_IN_SECONDS = 1.0
+    _MAX_ENVELOPE_BUCKETS = 64
+    _REFIT_INTERVAL = 8
+    _MIN_DRIFT_SPAN_IN_SECONDS = 10.0
+    # Crystal oscillators are well within this.
+    _MAX_DRIFT = 500e-6
+
+    def __init__(self, device_units_per_second, wrap=None):
+        self._seconds_per_unit = 1.0 / device_units_per_second
+        self._wrap = wrap
+        self._wrap_count = 0
+        self._last_device_value = None
+        # (device time, host time, rtt)
+        self._round_trips = collections.deque(maxlen=self._MAX_ROUND_TRIPS)
+        # (bucket, device time, host receive time) of the fastest arrival per bucket.
+        self._envelope = collections.deque(maxlen=self._MAX_ENVELOPE_BUCKETS)
+        self._num_round_trips = 0
+        self._num_arrivals = 0
+        self._min_rtt = None
+        self._num_unfitted = 0
+        self.offset = None
+        self.drift = 0.0
+
+    @property
+    def stats(self):
+        """A ClockEstimate namedtuple."""
+        return ClockEstimate(self.offset,
+                             self.drift * 1e6,
+                             self._num_round_trips,
+                             self._num_arrivals,
+                             self._min_rtt)
+
+    def to_host_time(self, device_value):
+        """Converts a device time (or an array of them if the clock doesn't wrap)."""
+        if self.offset is None:
+            return None
 
-    if blue < 0 or blue > 0xFF:
-        raise ValueError()
+        return self.offset + self._to_device_seconds(device_value) * (1.0 + self.drift)
+
+    def add_round_trip(self, host_send_time, device_receive_value, device_transmit_value, host_receive_time):
+        device_receive_time = self._to_device_seconds(device_receive_value, update=True)
+        device_transmit_time = self._to_device_seconds(device_transmit_value, update=True)
+        # Leave the device's own processing time out of the round trip.
+        rtt = max(0.0, (host_receive_time - host_send_time) - (device_transmit_time - device_receive_time))
+        self._round_trips.append(((device_receive_time + device_transmit_time) / 2,
+                                  (host_send_time + host_receive_time) / 2,
+                                  rtt))
+        self._num_round_trips += 1
+        if self._min_rtt is None or rtt < self._min_rtt:
+            self._min_rtt = rtt
+        self._refit()
+
+    def add_arrival(self, device_value, host_receive_time):
+        device_time = self._to_device_seconds(device_value, update=True)
+        bucket = int(device_time // self._ENVELOPE_BUCKET_IN_SECONDS)
+        if self._envelope and self._envelope[-1][0] == bucket:
+            _, fastest_device_time, fastest_host_time = self._envelope[-1]
+            if host_receive_time - device_time < fastest_host_time - fastest_device_time:
+                self._envelope[-1] = (bucket, device_time, host_receive_time)
+        else:
+            self._envelope.append((bucket, device_time, host_receive_time))
 
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_SET_RGB_LED,
-                                sequence_number=sequence_number,
-                                data=[red, green, blue,
-                                      1 if save_as_user_led_color else 0],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+        self._num_arrivals += 1
+        self._num_unfitted += 1
+        if self.offset is None or self._num_unfitted >= self._REFIT_INTERVAL:
+            self._refit()
+        else:
+            # Between refits, only keep the record before its arrival.
+            late = self.offset + device_time * (1.0 + self.drift) - host_receive_time
+            if late > 0:
+                self.offset -= late
+
+    def _to_device_seconds(self, device_value, update=False):
+        if self._wrap is None:
+            return device_value * self._seconds_per_unit
+
+        wrap_count = self._wrap_count
+        last_device_value = self._last_device_value
+        if last_device_value is not None:
+            if device_value < last_device_value - self._wrap // 2:
+                wrap_count += 1
+            elif device_value > last_device_value + self._wrap // 2:
+                # A value from before the last wrap.
+                wrap_count -= 1
+
+        if update and (last_device_value is None
+                       or (wrap_count, device_value) > (self._wrap_count, last_device_value)):
+            self._wrap_count = wrap_count
+            self._last_device_value = device_value
+
+        return (device_value + wrap_count * self._wrap) * self._seconds_per_unit
+
+    def _refit(self):
+        self._num_unfitted = 0
+        if self._round_trips:
+            rtts = sorted(rtt for _, _, rtt in self._round_trips)
+            max_rtt = max(2 * rtts[len(rtts) // 2], rtts[0] + 0.001)
+            points = [(device_time, host_time, 1.0 / (rtt + 0.0001) ** 2)
+                      for device_time, host_time, rtt in self._round_trips
+                      if rtt <= max_rtt]
+        else:
+            points = [(device_time, host_time, 1.0) for _, device_time, host_time in self._envelope]
 
+        offset, rate = self._fit_line(points, 1.0 + self.drift)
+        if self._envelope:
+            offset = min(offset, min(host_time - device_time * rate
+                                     for _, device_time, host_time in self._envelope))
 
-_COMMAND_ID_GET_RGB_LED = 0x22
+        self.offset = offset
+        self.drift = rate - 1.0
 
+    def _fit_line(self, points, rate):
+        """Weighted least squares. Returns (offset, rate).
 
-def _create_get_rgb_led_command(sequence_number,
-                                wait_for_response,
-                                reset_inactivity_timeout):
-    """
-    """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_GET_RGB_LED,
-                                sequence_number=sequence_number,
-                                data=[],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+        Keeps rate if the points span too little device time.
+        """
+        total_weight = sum(weight for _, _, weight in points)
+        mean_device_time = sum(weight * device_time for device_time, _, weight in points) / total_weight
+        mean_host_time = sum(weight * host_time for _, host_time, weight in points) / total_weight
+        device_times = [device_time for device_time, _, _ in points]
+        if max(device_times) - min(device_times) >= self._MIN_DRIFT_SPAN_IN_SECONDS:
+            covariance = sum(weight * (device_time - mean_device_time) * (host_time - mean_host_time)
+                             for device_time, host_time, weight in points)
+            variance = sum(weight * (device_time - mean_device_time) ** 2
+                           for device_time, _, weight in points)
+            rate = min(max(covariance / variance, 1.0 - self._MAX_DRIFT), 1.0 + self._MAX_DRIFT)
+
+        return (mean_host_time - rate * mean_device_time, rate)
+
+
+class _SensorStreamTracker(object):
+    """Timestamps sensor data batches and detects dropped packets.
+
+    Sample k of the stream is sampled at device time k / rate_hz,
+    so a _ClockModel fitted to the batches' arrivals
+    maps every sample to host time.
+
+    A lost packet makes every later batch arrive at least
+    a packet period later than the samples counted so far predict.
+    Transport jitter delays single batches too,
+    so a drop is only declared once enough batches in a row are late
+    that jitter alone would almost never explain it.
+    How many depends on the jitter, estimated from the spread
+    of the differences between successive batches' lateness.
+    A burst of batches that were held back
+    catches up one packet period per batch and arrives all at once,
+    so late batches received closer together than the packet period
+    are not counted as a drop.
 
+    Args:
+        rate_hz (float):
+            The sample rate.
+    """
 
-_COMMAND_ID_SET_BACK_LED_OUTPUT = 0x21
+    _MIN_DROP_WINDOW = 4
+    _MAX_DROP_WINDOW = 64
+    # -ln(1e-6). Jitter explains a detected drop about once in a million batches.
+    _DROP_CONFIDENCE = 13.8
+
+    def __init__(self, rate_hz):
+        self.rate_hz = rate_hz
+        self._clock = _ClockModel(rate_hz)
+        self._next_index = 0
+        # (lateness, receive time) of the latest batches.
+        # Keeps batches from before the longest window to measure lateness from.
+        self._arrivals = collections.deque(maxlen=2 * self._MAX_DROP_WINDOW)
+        self._num_packets = 0
+        self._num_samples = 0
+        self._num_dropped_samples = 0
+        self._num_drops = 0
 
+    @property
+    def stats(self):
+        """A SensorStreamStats namedtuple."""
+        return SensorStreamStats(self.rate_hz,
+                                 self._num_packets,
+                                 self._num_samples,
+                                 self._num_dropped_samples,
+                                 self._num_drops,
+                                 self._clock.drift * 1e6)
+
+    def stamp(self, num_samples, receive_time):
+        """Returns the host times of the samples of a batch."""
+        last_index = self._next_index + num_samples - 1
+        # Over the few seconds drops are detected in, drift is negligible,
+        # so lateness is measured from the nominal sample times.
+        self._arrivals.append((receive_time - last_index / self.rate_hz, receive_time))
+        last_index += self._detect_drop(num_samples / self.rate_hz) * num_samples
+
+        self._clock.add_arrival(last_index, receive_time)
+        self._next_index = last_index + 1
+        self._num_packets += 1
+        self._num_samples += num_samples
+        return self._clock.to_host_time(numpy.arange(last_index - num_samples + 1, last_index + 1))
+
+    def _detect_drop(self, packet_period):
+        """Returns the number of packets dropped before the latest batches."""
+        arrivals = self._arrivals
+        if len(arrivals) < 2 * self._MIN_DROP_WINDOW:
+            return 0
+
+        # With exponential jitter, the median difference is ln(2) times its scale.
+        differences = sorted(abs(arrivals[i][0] - arrivals[i - 1][0]) for i in range(1, len(arrivals)))
+        jitter = differences[len(differences) // 2] / math.log(2)
+        window = min(max(self._MIN_DROP_WINDOW,
+                         math.ceil(self._DROP_CONFIDENCE * jitter / (packet_period / 2))),
+                     self._MAX_DROP_WINDOW)
+        # Lateness is measured from the fastest of as many batches before the window.
+        if 2 * window > len(arrivals):
+            return 0
+
+        earlier = list(itertools.islice(arrivals, 0, len(arrivals) - window))
+        recent = list(itertools.islice(arrivals, len(arrivals) - window, len(arrivals)))
+        baseline = min(lateness for lateness, _ in earlier)
+        min_lateness = min(lateness for lateness, _ in recent) - baseline
+        if (min_lateness <= packet_period / 2
+                or recent[-1][1] - recent[0][1] < (window - 1) * packet_period / 2):
+            return 0
+
+        num_dropped_packets = round(min_lateness / packet_period)
+        self._num_dropped_samples += num_dropped_packets * round(packet_period * self.rate_hz)
+        self._num_drops += 1
+        # The late batches just before the window may have come after the drop too.
+        while earlier and earlier[-1][0] - baseline > packet_period / 2:
+            earlier.pop()
+        arrivals.clear()
+        arrivals.extend(earlier)
+        # Jitter can put batches from before the drop in the window too.
+        # Keep them from lowering the baseline.
+        arrivals.extend((max(lateness - num_dropped_packets * packet_period, baseline), receive_time)
+                        for lateness, receive_time in recent)
+        return num_dropped_packets
+
+
+class _AsyncDispatchEntry(object):
+    """The parser and subscribers of one asynchronous message ID code.
 
-def _create_set_back_led_output_command(brightness,
-                                        sequence_number,
-                                        wait_for_response,
-                                        reset_inactivity_timeout):
-    """
+    Args:
+        kind (EventKind or int):
+            The EventKind, or the ID code for messages
+            added with Sphero.register_async_message.
+        parse (callable):
+            Turns the message data into the published event.
     """
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_SET_BACK_LED_OUTPUT,
-                                sequence_number=sequence_number,
-                                data=[brightness],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
 
+    __slots__ = ('kind', 'parse', 'stamp', 'callbacks', 'streams')
 
-_COMMAND_ID_ROLL = 0x30
+    def __init__(self, kind, parse):
+        self.kind = kind
+        self.parse = parse
+        # Called with the parsed event and its receive time.
+        # Returns the event with host timestamps added. None if not needed.
+        self.stamp = None
+        self.callbacks = []
+        self.streams = []
 
 
-def _create_roll_command(speed,
-                         heading_in_degrees,
-                         mode,
-                         sequence_number,
-                         wait_for_response,
-                         reset_inactivity_timeout):
-    """
+class _CallbackDispatcher(object):
+    """Runs event callbacks without starting a thread per event.
+
+    Coroutine functions run as tasks on event_loop
+    and regular functions run on a bounded executor.
+    Every callback has its own queue of events
+    and handles them one at a time, in order.
+    Different callbacks run concurrently.
+
+    Args:
+        executor (concurrent.futures.Executor, None):
+            Runs regular functions.
+            If None, a thread pool is created on first use.
+        max_workers (int):
+            The number of threads of the default thread pool.
     """
-    if heading_in_degrees < 0 or heading_in_degrees > 359:
-        raise ValueError(
-            f'heading_in_degrees must be in the range [0, 359]. heading was {heading_in_degrees}')
 
-    state = 0
-    if mode == RollMode.IN_PLACE_ROTATE:
-        speed = 0
-        state = 1
-    elif mode == RollMode.FAST_ROTATE:
-        state = 2
-    elif mode == RollMode.NORMAL:
-        if speed > 0:
-            state = 1
-        else:
-            state = 0
-    else:
-        raise ValueError('Unknown RollMode.')
+    def __init__(self, executor, max_workers):
+        if executor is None and max_workers < 1:
+            raise ValueError(
+                f'max_callback_workers must be at least 1. max_callback_workers was {max_workers}')
 
-    return _ClientCommandPacket(device_id=_DEVICE_ID_SPHERO,
-                                command_id=_COMMAND_ID_ROLL,
-                                sequence_number=sequence_number,
-                                data=[speed,
-                                      _get_byte_at_index(
-                                          heading_in_degrees, 1),
-                                      _get_byte_at_index(
-                                          heading_in_degrees, 0),
-                                      state],
-                                wait_for_response=wait_for_response,
-                                reset_inactivity_timeout=reset_inactivity_timeout)
+        # The event loop that runs coroutine functions. Set on connect.
+        self.event_loop = None
+        self._executor = executor
+        self._max_workers = max_workers
+        self._subscribers = {}
+        self._lock = threading.Lock()
 
-# endregion
+    @property
+    def stats(self):
+        """A dict mapping each callback to a CallbackStats namedtuple."""
+        with self._lock:
+            return {s.callback: s.stats() for s in self._subscribers.values()}
+
+    def dispatch(self, callback, args):
+        """Queues a call of callback with args. Thread safe."""
+        with self._lock:
+            subscriber = self._subscribers.get(callback)
+            if subscriber is None:
+                subscriber = _CallbackSubscriber(callback)
+                self._subscribers[callback] = subscriber
+
+            subscriber.pending.append((time.monotonic(), args))
+            if subscriber.is_running:
+                # The running drain picks the event up, in order.
+                return
+            subscriber.is_running = True
 
-# region Private Package Classes
+        try:
+            if subscriber.is_coroutine_function:
+                _call_on_loop(self.event_loop, self._start_task, subscriber)
+            else:
+                self._get_executor().submit(self._drain, subscriber)
+        except Exception as error:
+            # The event loop or executor was closed.
+            with self._lock:
+                subscriber.is_running = False
+                subscriber.pending.clear()
+            subscriber.add_error(error)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._max_workers,
+                    thread_name_prefix='spheropy-callback')
+            return self._executor
+
+    def _next_event(self, subscriber):
+        """Pops the subscriber's next event, or stops its drain if there is none."""
+        with self._lock:
+            if not subscriber.pending:
+                subscriber.is_running = False
+                return None
+            return subscriber.pending.popleft()
+
+    def _drain(self, subscriber):
+        while True:
+            event = self._next_event(subscriber)
+            if event is None:
+                return
+
+            receive_time, args = event
+            start_time = time.monotonic()
+            try:
+                subscriber.callback(*args)
+            except Exception as error:
+                subscriber.add_error(error)
+            subscriber.add_call(start_time - receive_time, time.monotonic() - start_time)
+
+    def _start_task(self, subscriber):
+        self.event_loop.create_task(self._drain_async(subscriber))
+
+    async def _drain_async(self, subscriber):
+        while True:
+            event = self._next_event(subscriber)
+            if event is None:
+                return
+
+            receive_time, args = event
+            start_time = time.monotonic()
+            try:
+                await subscriber.callback(*args)
+            except Exception as error:
+                subscriber.add_error(error)
+            subscriber.add_call(start_time - receive_time, time.monotonic() - start_time)
+
+
+class _CallbackSubscriber(object):
+    """The event queue and statistics of one callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.is_coroutine_function = asyncio.iscoroutinefunction(callback)
+        self.pending = collections.deque()
+        self.is_running = False
+        self._num_calls = 0
+        self._total_delay = 0.0
+        self._max_delay = 0.0
+        self._total_run_time = 0.0
+        self._max_run_time = 0.0
+        self._last_run_time = 0.0
+        self._num_errors = 0
+        self._last_error = None
+
+    def add_call(self, delay, run_time):
+        self._num_calls += 1
+        self._total_delay += delay
+        self._max_delay = max(self._max_delay, delay)
+        self._total_run_time += run_time
+        self._max_run_time = max(self._max_run_time, run_time)
+        self._last_run_time = run_time
+
+    def add_error(self, error):
+        self._num_errors += 1
+        self._last_error = error
+
+    def stats(self):
+        num_calls = self._num_calls
+        return CallbackStats(num_calls,
+                             len(self.pending),
+                             self._total_delay / num_calls if num_calls else 0.0,
+                             self._max_delay,
+                             self._total_run_time / num_calls if num_calls else 0.0,
+                             self._max_run_time,
+                             self._last_run_time,
+                             self._num_errors,
+                             self._last_error)
 
 
 class _ClientCommandPacket(object):
     """Represents a command packet sent from the client to a Sphero.
+
+    Args:
+        spec (_CommandSpec):
+            The command to send.
+        sequence_number (int):
+            The sequence number of the command.
+        payload (tuple or bytes):
+            The payload values in the order of spec's payload format,
+            or the payload bytes for commands with a variable length payload.
+        wait_for_response (bool):
+            If True, the Sphero will respond to the command.
+        reset_inactivity_timeout (bool):
+            If True, the command resets the inactivity timer on the Sphero.
     """
+    __slots__ = ['_packet',
+                 '_wait_for_response',
+                 'spec',
+                 'priority',
+                 'is_motion',
+                 'is_emergency_stop',
+                 'emergency_stop_generation',
+                 'write_time',
+                 'is_idempotent']
+
     _START_OF_PACKET_1 = 0xFF
     _START_OF_PACKET_2_BASE = 0xFC
     _START_OF_PACKET_2_ANSWER_MASK = 0x01
     _START_OF_PACKET_2_RESET_INACTIVITY_TIMEOUT_MASK = 0x02
 
     def __init__(self,
-                 device_id,
-                 command_id,
+                 spec,
                  sequence_number=0x00,
-                 data=None,
+                 payload=(),
                  wait_for_response=True,
                  reset_inactivity_timeout=True):
 
-        if data is None:
-            data = []
-
         self._wait_for_response = wait_for_response
+        self.spec = spec
+        self.priority = spec.priority
+        # True if sending the command more than once has the same effect as sending it once.
+        self.is_idempotent = spec.is_idempotent
+        # Set for motion commands that an emergency stop preempts.
+        self.is_motion = spec.is_motion
+        self.is_emergency_stop = False
+        self.emergency_stop_generation = 0
+        # Set when the packet is written. Used to measure round trip times.
+        self.write_time = None
 
         start_of_packet_2 = self._START_OF_PACKET_2_BASE
         if wait_for_response:
@@ -1889,26 +5877,30 @@ class _ClientCommandPacket(object):
         if reset_inactivity_timeout:
             start_of_packet_2 |= self._START_OF_PACKET_2_RESET_INACTIVITY_TIMEOUT_MASK
 
-        self._packet = [self._START_OF_PACKET_1,
-                        start_of_packet_2,
-                        device_id,
-                        command_id,
-                        sequence_number,
-                        min(len(data) + 1, 0xFF), ]
-
-        self._packet.extend(data)
-        self._packet.append(_compute_checksum(self._packet))
+        self._packet = spec.encode(start_of_packet_2, sequence_number, payload)
 
     @property
     def bytes(self):
-        """Get the ClientCommandPacket as a bytes object.
+        """Get the ClientCommandPacket as a bytes-like object.
 
         Used to send the packet to the Sphero.
 
         Returns:
-            The ClientCommandPacket as bytes.
+            A memoryview of the ClientCommandPacket's bytes.
+        """
+        return memoryview(self._packet)
+
+    @property
+    def device_id(self):
+        """
+        """
+        return self._packet[2]
+
+    @property
+    def command_id(self):
         """
-        return bytes(self._packet)
+        """
+        return self._packet[3]
 
     @property
     def sequence_number(self):
@@ -1916,95 +5908,71 @@ class _ClientCommandPacket(object):
         """
         return self._packet[4]
 
+    @sequence_number.setter
+    def sequence_number(self, value):
+        self._packet[4] = value
+        self._packet[-1] = _compute_checksum(self._packet[:-1])
+
     @property
     def wait_for_response(self):
         """
         """
         return self._wait_for_response
 
+    @wait_for_response.setter
+    def wait_for_response(self, value):
+        # The start of packet bytes are not part of the checksum.
+        self._wait_for_response = value
+        if value:
+            self._packet[1] |= self._START_OF_PACKET_2_ANSWER_MASK
+        else:
+            self._packet[1] &= ~self._START_OF_PACKET_2_ANSWER_MASK
 
-class _ResponsePacketStatus(enum.Enum):
-    VALID = enum.auto()
-    NOT_ENOUGH_BUFFER = enum.auto()
-    INVALID_DATA = enum.auto()
-    INCORRECT_LENGTH = enum.auto()
+    @property
+    def expects_response_data(self):
+        """True if the caller needs the data in the command's response."""
+        return self.spec.expects_response_data
 
 
 class _ResponsePacket(object):
-    """Represents a response packet from a Sphero to the client
+    """Represents a response packet from a Sphero to the client.
 
-    Will try to parse buffer provided to constructor as a packet
+    Packets are created by _ReceiveFramer,
+    which validates the framing and checksum.
+    data is a view into the framer's buffer
+    and is only valid until the framer reuses that memory.
+    Call detach to keep the packet.
 
     Args:
-        buffer (list): the raw byte buffer to
-        try and parse as a packet
+        is_async (bool):
+            True for asynchronous messages, False for command responses.
+        code (int):
+            The id code of an asynchronous message,
+            or the message response code of a command response.
+        sequence_number (int):
+            The sequence number of a command response.
+        data (bytes-like):
+            The data of the packet, without the checksum.
     """
-    _START_OF_PACKET_1_INDEX = 0
-    _START_OF_PACKET_2_INDEX = 1
-
-    # async response value indexes
-    _ID_CODE_INDEX = 2
-    _DATA_LENGTH_MSB_INDEX = 3
-    _DATA_LENGTH_LSB_INDEX = 4
-
-    # simple response value indexes
-    _MESSAGE_RESPONSE_CODE_INDEX = 2
-    _SEQUENCE_NUMBER_INDEX = 3
-    _DATA_LENGTH_INDEX = 4
-
-    _DATA_START_INDEX = 5
-
-    # 1 becuase data length includes checksum which is always present
-    _MIN_DATA_LENGTH = 1
-
-    _START_OF_PACKET_1 = 0xFF
-    _START_OF_PACKET_2_SYNC = 0xFF
-    _START_OF_PACKET_2_ASYNC = 0xFE
-
-    def __init__(self, buffer):
-        assert len(
-            buffer) >= _MIN_PACKET_LENGTH, "Buffer is less than the minimum packet length"
-        self.status = _ResponsePacketStatus.VALID
-        self._message_response_code = 0x00
-        self._sequence_number = 0x00
-        self._id_code = 0x00
-
-        self._start_of_packet_byte_1 = buffer[self._START_OF_PACKET_1_INDEX]
-        if self._start_of_packet_byte_1 != self._START_OF_PACKET_1:
-            self.status = _ResponsePacketStatus.INVALID_DATA
-            return
-
-        self._start_of_packet_byte_2 = buffer[self._START_OF_PACKET_2_INDEX]
-
-        self._is_async = self._start_of_packet_byte_2 is self._START_OF_PACKET_2_ASYNC
-        if self._is_async:
-            self._id_code = buffer[self._ID_CODE_INDEX]
-            self._data_length = _pack_bytes([buffer[self._DATA_LENGTH_MSB_INDEX],
-                                             buffer[self._DATA_LENGTH_LSB_INDEX]])
-        else:
-            self._message_response_code = buffer[self._MESSAGE_RESPONSE_CODE_INDEX]
-            self._sequence_number = buffer[self._SEQUENCE_NUMBER_INDEX]
-            self._data_length = buffer[self._DATA_LENGTH_INDEX]
-
-        if self._data_length < self._MIN_DATA_LENGTH:
-            self.status = _ResponsePacketStatus.INCORRECT_LENGTH
-            return
-
-        if self._data_length + _MIN_PACKET_LENGTH - 1 > len(buffer):
-            self.status = _ResponsePacketStatus.NOT_ENOUGH_BUFFER
-            return
-
-        checksum_index = self._checksum_index
-        self._data = buffer[self._DATA_START_INDEX:checksum_index]
-        self._checksum = buffer[checksum_index]
-
-        if not self._is_data_length_valid:
-            self.status = _ResponsePacketStatus.INCORRECT_LENGTH
-            return
-
-        if self._checksum is not _compute_checksum(buffer[:checksum_index]):
-            self.status = _ResponsePacketStatus.INVALID_DATA
-            return
+    __slots__ = ['_is_async',
+                 '_code',
+                 '_sequence_number',
+                 '_data',
+                 'receive_time']
+
+    def __init__(self, is_async, code, sequence_number, data):
+        self._is_async = is_async
+        self._code = code
+        self._sequence_number = sequence_number
+        self._data = data
+        # The host time (time.monotonic()) the packet was received.
+        self.receive_time = None
+
+    def detach(self):
+        """Copies data out of the receive buffer so the packet can be kept."""
+        if not isinstance(self._data, bytes):
+            self._data = bytes(self._data)
+        return self
 
     @property
     def is_async(self):
@@ -2022,13 +5990,13 @@ class _ResponsePacket(object):
     def id_code(self):
         """
         """
-        return self._id_code
+        return self._code if self._is_async else 0x00
 
     @property
     def message_response(self):
         """
         """
-        return self._message_response_code
+        return 0x00 if self._is_async else self._code
 
     @property
     def sequence_number(self):
@@ -2040,20 +6008,473 @@ class _ResponsePacket(object):
     def packet_length(self):
         """
         """
-        return self._data_length + 5
+        return len(self._data) + _MIN_PACKET_LENGTH
+
+
+class _ReceiveFramer(object):
+    """Splits received bytes into response packets.
+
+    Bytes are appended to a preallocated bytearray.
+    Packets are validated in place
+    and their payloads are memoryview slices of the buffer,
+    so received bytes are never copied after they are appended.
+    Consumed bytes are dropped by moving a read offset,
+    and the unconsumed tail is moved to the front of the buffer
+    only when there is no room left at the end.
+
+    The packets returned by feed reference the buffer
+    and are only valid until the next call to feed.
+    Call _ResponsePacket.detach to keep a packet longer.
+
+    Args:
+        capacity (int):
+            The initial size of the buffer in bytes.
+            The buffer grows if a packet does not fit.
+    """
+
+    _START_OF_PACKET_1 = 0xFF
+    _START_OF_PACKET_2_SYNC = 0xFF
+    _START_OF_PACKET_2_ASYNC = 0xFE
+
+    def __init__(self, capacity=4096):
+        self._buffer = bytearray(capacity)
+        self._start = 0
+        self._end = 0
+        self.bytes_received = 0
+        self.packets_framed = 0
+        self.bytes_discarded = 0
 
     @property
-    def _checksum_index(self):
-        """
+    def buffered_byte_count(self):
+        """The number of received bytes that are not part of a framed packet yet."""
+        return self._end - self._start
+
+    def feed(self, data):
+        """Adds received bytes and returns the complete packets.
+
+        Args:
+            data (bytes-like):
+                The received bytes.
+
+        Returns:
+            A list of valid _ResponsePackets, in the order they were received.
         """
-        return self._data_length + 4
+        self._append(data)
+        packets = []
+        buffer = self._buffer
+        view = memoryview(buffer)
+        start = self._start
+        end = self._end
+        append_packet = packets.append
+        start_of_packet_1 = self._START_OF_PACKET_1
+        start_of_packet_2_sync = self._START_OF_PACKET_2_SYNC
+        start_of_packet_2_async = self._START_OF_PACKET_2_ASYNC
+        while end - start >= _MIN_PACKET_LENGTH:
+            # Packet layout:
+            # sync:  SOP1 SOP2 MRSP SEQ DLEN <data> CHK
+            # async: SOP1 SOP2 ID_CODE DLEN_MSB DLEN_LSB <data> CHK
+            # DLEN counts the data and the checksum.
+            start_of_packet_2 = buffer[start + 1]
+            if buffer[start] != start_of_packet_1:
+                data_length = 0
+            elif start_of_packet_2 == start_of_packet_2_sync:
+                data_length = buffer[start + 4]
+            elif start_of_packet_2 == start_of_packet_2_async:
+                data_length = (buffer[start + 3] << 8) | buffer[start + 4]
+            else:
+                data_length = 0
+
+            checksum_index = start + data_length + 4
+            if data_length:
+                if checksum_index >= end:
+                    # Wait to get more data.
+                    break
+
+                if buffer[checksum_index] == ~(sum(view[start + 2:checksum_index]) % 0x100) & 0xFF:
+                    if start_of_packet_2 == start_of_packet_2_sync:
+                        append_packet(_ResponsePacket(False,
+                                                      buffer[start + 2],
+                                                      buffer[start + 3],
+                                                      view[start + 5:checksum_index]))
+                    else:
+                        append_packet(_ResponsePacket(True,
+                                                      buffer[start + 2],
+                                                      0x00,
+                                                      view[start + 5:checksum_index]))
+                    start = checksum_index + 1
+                    continue
+
+            # There is an error in the packet format.
+            # Skip to the next SOP1 byte.
+            next_start = buffer.find(_START_OF_PACKET_1_BYTES, start + 1, end)
+            if next_start < 0:
+                next_start = end
+            self.bytes_discarded += next_start - start
+            start = next_start
+
+        if start == end:
+            start = end = 0
+
+        self._start = start
+        self._end = end
+        self.packets_framed += len(packets)
+        return packets
+
+    def _append(self, data):
+        length = len(data)
+        self.bytes_received += length
+        end = self._end
+        if end + length > len(self._buffer):
+            buffered = end - self._start
+            if buffered + length > len(self._buffer):
+                # Packets handed out by feed may still reference the old buffer,
+                # so allocate a new one instead of resizing in place.
+                buffer = bytearray(max(2 * len(self._buffer), buffered + length))
+                buffer[:buffered] = memoryview(self._buffer)[self._start:end]
+                self._buffer = buffer
+            else:
+                self._buffer[:buffered] = self._buffer[self._start:end]
+            self._start = 0
+            end = buffered
+
+        self._buffer[end:end + length] = data
+        self._end = end + length
+
+# endregion
+
+# region Command Registry
+#
+# Every command is described by a _CommandSpec in the table below.
+# New commands only need a new table entry.
+
+
+_DEVICE_ID_CORE = 0x00
+_DEVICE_ID_SPHERO = 0x02
+
+
+class _CommandSpec(object):
+    """Describes a command and compiles its payload encoder and response decoder.
+
+    Fixed length payloads are encoded by copying a prefilled packet template
+    and packing the payload and sequence number into it in place.
+    The checksum is computed from the precomputed sum of the fixed header bytes
+    so no intermediate lists are allocated.
+
+    Args:
+        name (str):
+            The name of the command.
+        device_id (int):
+            The device id of the command.
+        command_id (int):
+            The command id of the command.
+        payload_format (str, ''):
+            The struct format of the payload, without the byte order.
+            Payloads are big endian.
+            None for variable length payloads, which are given as bytes.
+        payload_ranges (dict, None):
+            Maps the index of a payload value to its (name, min, max)
+            inclusive valid range.
+            Values without a range are only checked against payload_format.
+        response_format (str, None):
+            The struct format of the response data, without the byte order.
+        response_type (callable, None):
+            Called with the unpacked response values to build the result.
+            If None, the result is a list of the values.
+        response_parser (callable, None):
+            Parses response data that response_format can't describe.
+        priority (CommandPriority, CommandPriority.QUERY):
+            The send priority of the command.
+        is_idempotent (bool, True):
+            True if the command is safe to retry.
+        is_motion (bool, False):
+            True if an emergency stop preempts the command.
+    """
+
+    _PAYLOAD_START_INDEX = 6
+
+    def __init__(self,
+                 name,
+                 device_id,
+                 command_id,
+                 payload_format='',
+                 payload_ranges=None,
+                 response_format=None,
+                 response_type=None,
+                 response_parser=None,
+                 priority=CommandPriority.QUERY,
+                 is_idempotent=True,
+                 is_motion=False):
+        self.name = name
+        self.device_id = device_id
+        self.command_id = command_id
+        self.priority = priority
+        self.is_idempotent = is_idempotent
+        self.is_motion = is_motion
+        self.expects_response_data = response_format is not None or response_parser is not None
+        self._payload_ranges = sorted((payload_ranges or {}).items())
+        self._response_type = response_type
+        self._response_parser = response_parser
+        self._response_struct = None
+        if response_format is not None:
+            self._response_struct = struct.Struct('>' + response_format)
+
+        self._payload_struct = None
+        if payload_format is not None:
+            self._payload_struct = struct.Struct('>' + payload_format)
+            data_length = self._payload_struct.size + 1
+            self._template = bytearray((_ClientCommandPacket._START_OF_PACKET_1,
+                                        _ClientCommandPacket._START_OF_PACKET_2_BASE,
+                                        device_id,
+                                        command_id,
+                                        0x00,
+                                        data_length))
+            self._template.extend(bytes(data_length))
+            self._checksum_index = len(self._template) - 1
+            self._header_sum = device_id + command_id + data_length
 
     @property
-    def _is_data_length_valid(self):
-        """
+    def key(self):
+        """The (device_id, command_id) of the command."""
+        return (self.device_id, self.command_id)
+
+    def encode(self, start_of_packet_2, sequence_number, payload):
+        """Encodes a command packet.
+
+        Args:
+            start_of_packet_2 (int):
+                The second start of packet byte.
+            sequence_number (int):
+                The command's sequence number.
+            payload (tuple or bytes):
+                The payload values in payload_format order,
+                or the payload bytes if payload_format is None.
+
+        Returns:
+            The packet as a bytearray.
         """
-        # data_length includes the length of data and the checksum
-        return len(self._data) is self._data_length - 1
+        if self._payload_struct is None:
+            return self._encode_variable_length(start_of_packet_2, sequence_number, payload)
+
+        for index, (name, min_value, max_value) in self._payload_ranges:
+            value = payload[index]
+            if value < min_value or value > max_value:
+                raise ValueError(
+                    f'{name} must be in the range [{min_value}, {max_value}]. {name} was {value}')
+
+        packet = bytearray(self._template)
+        packet[1] = start_of_packet_2
+        packet[4] = sequence_number
+        try:
+            self._payload_struct.pack_into(packet, self._PAYLOAD_START_INDEX, *payload)
+        except struct.error as error:
+            raise ValueError(f'Invalid payload for {self.name}: {error}')
+
+        payload_sum = sum(memoryview(packet)[self._PAYLOAD_START_INDEX:self._checksum_index])
+        packet[self._checksum_index] = ~((self._header_sum + sequence_number + payload_sum) % 0x100) & 0xFF
+        return packet
+
+    def decode_response(self, data):
+        """Decodes the data of the command's response."""
+        if self._response_parser is not None:
+            return self._response_parser(data)
+
+        if self._response_struct is None:
+            return None
+
+        if len(data) < self._response_struct.size:
+            raise ValueError(
+                f'{self.name} response data is {len(data)} bytes long. Expected {self._response_struct.size} bytes.')
+
+        values = self._response_struct.unpack_from(data)
+        if self._response_type is None:
+            return list(values)
+
+        return self._response_type(*values)
+
+    def _encode_variable_length(self, start_of_packet_2, sequence_number, payload):
+        packet = bytearray((_ClientCommandPacket._START_OF_PACKET_1,
+                            start_of_packet_2,
+                            self.device_id,
+                            self.command_id,
+                            sequence_number,
+                            len(payload) + 1))
+        packet.extend(payload)
+        packet.append(_compute_checksum(packet))
+        return packet
+
+
+# Maps command name to _CommandSpec.
+_COMMANDS = {}
+# Maps (device_id, command_id) to _CommandSpec.
+_COMMANDS_BY_ID = {}
+
+
+def _register_command(*args, **kwargs):
+    """Creates a _CommandSpec and adds it to the registry."""
+    spec = _CommandSpec(*args, **kwargs)
+    _COMMANDS[spec.name] = spec
+    _COMMANDS_BY_ID[spec.key] = spec
+    return spec
+
+
+def _create_raw_command_spec(device_id, command_id):
+    """Creates a spec that sends a command's payload as given bytes.
+
+    Registered commands keep their priority and retry behavior.
+    Unknown commands are sent as queries and are never retried.
+    The response data is returned as bytes.
+    """
+    spec = _COMMANDS_BY_ID.get((device_id, command_id))
+    return _CommandSpec(spec.name if spec is not None else 'raw',
+                        device_id,
+                        command_id,
+                        payload_format=None,
+                        response_parser=bytes,
+                        priority=spec.priority if spec is not None else CommandPriority.QUERY,
+                        is_idempotent=spec is not None and spec.is_idempotent,
+                        is_motion=spec is not None and spec.is_motion)
+
+
+def _create_command(spec,
+                    payload,
+                    sequence_number,
+                    wait_for_response,
+                    reset_inactivity_timeout):
+    """Creates a _ClientCommandPacket for spec."""
+    return _ClientCommandPacket(spec,
+                                sequence_number,
+                                payload,
+                                wait_for_response=wait_for_response,
+                                reset_inactivity_timeout=reset_inactivity_timeout)
+
+
+# Maps RollMode to (state, force_zero_speed).
+# A state of None means the state depends on the speed.
+_ROLL_MODE_STATES = {
+    RollMode.NORMAL: (None, False),
+    RollMode.IN_PLACE_ROTATE: (1, True),
+    RollMode.FAST_ROTATE: (2, False),
+}
+
+
+def _get_roll_speed_and_state(speed, mode):
+    """Gets the speed and state bytes of a roll command for mode."""
+    try:
+        state, force_zero_speed = _ROLL_MODE_STATES[mode]
+    except KeyError:
+        raise ValueError('Unknown RollMode.')
+
+    if force_zero_speed:
+        speed = 0
+    elif state is None:
+        state = 1 if speed > 0 else 0
+
+    return speed, state
+
+
+_BYTE_RANGE = (0x00, 0xFF)
+_HEADING_RANGE = (0, 359)
+
+# Core device commands
+_PING = _register_command('ping', _DEVICE_ID_CORE, 0x01)
+_GET_VERSION = _register_command('get_version', _DEVICE_ID_CORE, 0x02,
+                                 response_parser=_parse_version_info)
+_SET_DEVICE_NAME = _register_command('set_device_name', _DEVICE_ID_CORE, 0x10,
+                                     payload_format=None)
+_GET_BLUETOOTH_INFO = _register_command('get_bluetooth_info', _DEVICE_ID_CORE, 0x11,
+                                        response_parser=_parse_bluetooth_info)
+_SET_AUTO_RECONNECT = _register_command('set_auto_reconnect', _DEVICE_ID_CORE, 0x12,
+                                        payload_format='BB',
+                                        payload_ranges={1: ('seconds_after_boot',) + _BYTE_RANGE})
+_GET_AUTO_RECONNECT = _register_command('get_auto_reconnect', _DEVICE_ID_CORE, 0x13,
+                                        response_parser=_parse_auto_reconnect_info)
+_GET_POWER_STATE = _register_command('get_power_state', _DEVICE_ID_CORE, 0x20,
+                                     response_format='BBHHH',
+                                     response_type=PowerState)
+_POLL_PACKET_TIMES = _register_command('poll_packet_times', _DEVICE_ID_CORE, 0x51,
+                                       payload_format='I',
+                                       response_format='III')
+_SET_POWER_NOTIFICATION = _register_command('set_power_notification', _DEVICE_ID_CORE, 0x21,
+                                            payload_format='B')
+
+# Sphero device commands
+_SET_HEADING = _register_command('set_heading', _DEVICE_ID_SPHERO, 0x01,
+                                 payload_format='H',
+                                 payload_ranges={0: ('heading',) + _HEADING_RANGE},
+                                 priority=CommandPriority.CONTROL)
+_SET_STABILIZATION = _register_command('set_stabilization', _DEVICE_ID_SPHERO, 0x02,
+                                       payload_format='B',
+                                       priority=CommandPriority.CONTROL)
+_SELF_LEVEL = _register_command('self_level', _DEVICE_ID_SPHERO, 0x09,
+                                payload_format='BBBB',
+                                payload_ranges={1: ('angle_limit', 0, 90),
+                                                2: ('timeout',) + _BYTE_RANGE,
+                                                3: ('true_time',) + _BYTE_RANGE},
+                                priority=CommandPriority.CONTROL,
+                                is_idempotent=False)
+_SET_DATA_STREAMING = _register_command('set_data_streaming', _DEVICE_ID_SPHERO, 0x11,
+                                        payload_format='HHIBI',
+                                        payload_ranges={1: ('frames_per_packet', 1, 0xFF),
+                                                        3: ('packet_count',) + _BYTE_RANGE})
+_CONFIGURE_COLLISION_DETECTION = _register_command('configure_collision_detection', _DEVICE_ID_SPHERO, 0x12,
+                                                   payload_format='BBBBBB')
+_CONFIGURE_LOCATOR = _register_command('configure_locator', _DEVICE_ID_SPHERO, 0x13,
+                                       payload_format='Bhhh',
+                                       payload_ranges={3: ('yaw_tare',) + _HEADING_RANGE})
+_READ_LOCATOR = _register_command('read_locator', _DEVICE_ID_SPHERO, 0x15,
+                                  response_format='hhhhH',
+                                  response_type=LocatorInfo)
+_SET_RGB_LED = _register_command('set_rgb_led', _DEVICE_ID_SPHERO, 0x20,
+                                 payload_format='BBBB',
+                                 payload_ranges={0: ('red',) + _BYTE_RANGE,
+                                                 1: ('green',) + _BYTE_RANGE,
+                                                 2: ('blue',) + _BYTE_RANGE},
+                                 priority=CommandPriority.COSMETIC)
+_SET_BACK_LED_OUTPUT = _register_command('set_back_led_output', _DEVICE_ID_SPHERO, 0x21,
+                                         payload_format='B',
+                                         payload_ranges={0: ('brightness',) + _BYTE_RANGE},
+                                         priority=CommandPriority.COSMETIC)
+_GET_RGB_LED = _register_command('get_rgb_led', _DEVICE_ID_SPHERO, 0x22,
+                                 response_format='BBB')
+_ROLL = _register_command('roll', _DEVICE_ID_SPHERO, 0x30,
+                          payload_format='BHB',
+                          payload_ranges={0: ('speed',) + _BYTE_RANGE,
+                                          1: ('heading_in_degrees',) + _HEADING_RANGE},
+                          priority=CommandPriority.CONTROL,
+                          is_motion=True)
+_SET_RAW_MOTOR_VALUES = _register_command('set_raw_motor_values', _DEVICE_ID_SPHERO, 0x33,
+                                          payload_format='BBBB',
+                                          payload_ranges={1: ('left_power',) + _BYTE_RANGE,
+                                                          3: ('right_power',) + _BYTE_RANGE},
+                                          priority=CommandPriority.CONTROL,
+                                          is_motion=True)
+
+# endregion
+
+# region Async Message Registry
+
+
+# Maps each asynchronous message ID code to the function that parses its data.
+# Messages without a dedicated parser are published as bytes.
+_ASYNC_MESSAGE_PARSERS = {
+    EventKind.POWER_STATE_CHANGE.value: _parse_power_notification,
+    EventKind.LEVEL_1_DIAGNOSTIC.value: _parse_ascii,
+    EventKind.SENSOR_DATA.value: bytes,
+    EventKind.CONFIG_BLOCK.value: bytes,
+    EventKind.PRE_SLEEP_WARNING.value: _parse_no_data,
+    EventKind.MACRO_MARKER.value: bytes,
+    EventKind.COLLISION.value: _parse_collision_info,
+    EventKind.ORBBASIC_PRINT.value: _parse_ascii,
+    EventKind.ORBBASIC_ERROR_ASCII.value: _parse_ascii,
+    EventKind.ORBBASIC_ERROR_BINARY.value: bytes,
+    EventKind.SELF_LEVEL_COMPLETE.value: _parse_self_level_result,
+    EventKind.GYRO_AXIS_LIMIT_EXCEEDED.value: bytes,
+    EventKind.SOUL_DATA.value: bytes,
+    EventKind.LEVEL_UP.value: bytes,
+    EventKind.SHIELD_DAMAGE.value: bytes,
+    EventKind.XP_UPDATE.value: bytes,
+    EventKind.BOOST_UPDATE.value: bytes,
+}
 
 # endregion
 
@@ -2081,48 +6502,48 @@ def _compute_checksum(packet):
     return ~(sum(packet[2:]) % 0x100) & 0xFF
 
 
-def _get_byte_at_index(value, index):
-    """
-    """
-    # NOTE: We could also use int.to_bytes to just convert
-    # value into a byte array.
-    return value >> index * 8 & 0xFF
+def _call_on_loop(event_loop, callback, *args):
+    """Calls callback on event_loop's thread.
 
+    Calls it right away when already running on event_loop
+    instead of scheduling it.
 
-def _pack_bytes(byte_list):
-    """Packs a list of bytes to be a single unsigned int.
+    Raises:
+        RuntimeError: if event_loop is closed.
+    """
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
 
-    The MSB is the leftmost byte (index 0).
-    The LSB is the rightmost byte (index -1 or len(byte_list) - 1).
-    Big Endian order.
-    Each value in byte_list is assumed to be a byte (range [0, 255]).
-    This assumption is not validated in this function.
+    if running_loop is event_loop:
+        callback(*args)
+    else:
+        event_loop.call_soon_threadsafe(callback, *args)
 
-    Args:
-        byte_list (list):
 
-    Returns:
-        The number resulting from the packed bytes.
-    """
-    return int.from_bytes(byte_list, 'big', signed=False)
+def _set_future_result(future, result):
+    """Sets the result of future unless it is already done.
 
+    The future may have been cancelled by a timeout
+    before the result was delivered.
+    """
+    if not future.done():
+        future.set_result(result)
 
-def _pack_bytes_signed(byte_list):
-    """Packs a list of bytes to be a single signed int.
 
-    The MSB is the leftmost byte (index 0).
-    The LSB is the rightmost byte (index -1 or len(byte_list) - 1).
-    Big Endian order.
-    Each value in byte_list is assumed to be a byte (range [0, 255]).
-    This assumption is not validated in this function.
+def _set_future_exception(future, exception):
+    """Sets the exception of future unless it is already done."""
+    if not future.done():
+        future.set_exception(exception)
 
-    Args:
-        byte_list (list):
 
-    Returns:
-        The number resulting from the packed bytes.
+def _get_byte_at_index(value, index):
     """
-    return int.from_bytes(byte_list, 'big', signed=True)
+    """
+    # NOTE: We could also use int.to_bytes to just convert
+    # value into a byte array.
+    return value >> index * 8 & 0xFF
 
 
 def _is_windows():
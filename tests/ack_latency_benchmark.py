@@ -0,0 +1,137 @@
+"""
+Measures roll() response latency as the telemetry rate goes up.
+
+Does not need a Sphero. The simulated Sphero is a local socket pair
+that answers every command right away and sends collision
+notifications at a fixed rate, which the host consumes from an
+event stream. With command responses handled ahead of telemetry,
+the p99 latency should stay flat as the rate goes up.
+"""
+
+import asyncio
+import select
+import socket
+import statistics
+import threading
+import time
+import spheropy
+import spheropy.spheropy as spheropy_module
+
+TELEMETRY_RATES = [0, 1000, 5000, 20000]
+DURATION_IN_SECONDS = 2.0
+# Telemetry is sent in bursts, like a Bluetooth radio delivers it.
+BURSTS_PER_SECOND = 200
+
+
+def make_collision_packet(i):
+    data = [i & 0xFF] * 16
+    packet = [0xFF, 0xFE, 0x07, 0x00, len(data) + 1] + data
+    packet.append(spheropy_module._compute_checksum(packet))
+    return bytes(packet)
+
+
+def make_ack(sequence_number):
+    packet = [0xFF, 0xFF, 0x00, sequence_number, 0x01]
+    packet.append(spheropy_module._compute_checksum(packet))
+    return bytes(packet)
+
+
+class SocketPairTransport(spheropy.AsyncTransportBase):
+    """Reads the host side of a socket pair on the connection's io_thread."""
+
+    def __init__(self, sock):
+        super().__init__()
+        self._sock = sock
+
+    async def connect(self, num_retry_attempts=1):
+        self._sock.setblocking(False)
+        self.io_thread.register_reader(self._sock, self._handle_readable)
+
+    def write(self, data):
+        self._sock.sendall(data)
+
+    def close(self):
+        self.io_thread.unregister(self._sock, close=True)
+
+    def _handle_readable(self):
+        try:
+            data = self._sock.recv(4096)
+        except BlockingIOError:
+            return
+        if data:
+            self.data_received_handler(data)
+
+
+def simulate_sphero(sock, telemetry_rate, stop_event):
+    """Acks every command and sends collision notifications at telemetry_rate."""
+    packets_per_burst = telemetry_rate // BURSTS_PER_SECOND
+    burst = b''.join(make_collision_packet(i) for i in range(packets_per_burst))
+    interval = 1.0 / BURSTS_PER_SECOND
+    next_burst = time.perf_counter()
+    received = bytearray()
+    while not stop_event.is_set():
+        timeout = max(0.0, next_burst - time.perf_counter()) if burst else 0.1
+        readable, _, _ = select.select([sock], [], [], timeout)
+        if readable:
+            received.extend(sock.recv(4096))
+            acks = bytearray()
+            # Commands are ff ff did cid seq dlen ... chk
+            while len(received) >= 6 and len(received) >= 6 + received[5]:
+                acks.extend(make_ack(received[4]))
+                del received[:6 + received[5]]
+            sock.sendall(acks)
+
+        if burst and time.perf_counter() >= next_burst:
+            sock.sendall(burst)
+            next_burst += interval
+
+
+async def run(telemetry_rate):
+    host_side, robot_side = socket.socketpair()
+    stop_event = threading.Event()
+    robot = threading.Thread(target=simulate_sphero,
+                             args=(robot_side, telemetry_rate, stop_event),
+                             daemon=True)
+    robot.start()
+
+    sphero = spheropy.Sphero()
+    await sphero.connect(transport=SocketPairTransport(host_side))
+    collisions = sphero.events(spheropy.EventKind.COLLISION, maxsize=1024)
+    num_collisions = 0
+
+    async def consume():
+        nonlocal num_collisions
+        async for _ in collisions:
+            num_collisions += 1
+
+    consumer = asyncio.ensure_future(consume())
+
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION_IN_SECONDS:
+        sent = time.perf_counter()
+        await sphero.roll(50, 0)
+        latencies.append((time.perf_counter() - sent) * 1e3)
+
+    collisions.close()
+    await consumer
+    stop_event.set()
+    robot.join()
+    sphero.disconnect()
+    robot_side.close()
+
+    latencies.sort()
+    print('{:>5} telemetry packets/s: {:>5} rolls, {:>6} collisions, '
+          'latency median {:.3f} ms p99 {:.3f} ms'.format(
+              telemetry_rate, len(latencies), num_collisions,
+              statistics.median(latencies),
+              latencies[int(len(latencies) * 0.99)]))
+
+
+async def main():
+    for telemetry_rate in TELEMETRY_RATES:
+        await run(telemetry_rate)
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
@@ -0,0 +1,30 @@
+"""
+"""
+
+import asyncio
+import time
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    # Send the LED, heading and roll updates in one write.
+    # Only the roll waits for a response.
+    async with sphero.batch():
+        await sphero.set_rgb_led(green=0xFF)
+        await sphero.set_heading(90)
+        await sphero.roll(64, 0)
+
+    time.sleep(1)
+
+    async with sphero.batch():
+        await sphero.set_rgb_led(red=0xFF)
+        await sphero.roll(0, 0)
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
@@ -0,0 +1,98 @@
+"""
+Measures what a wire capture adds to the receive path.
+
+Does not need a Sphero. Feeds a stream of collision notifications
+and command responses, split into 20 byte chunks like BLE delivers
+them, to a Sphero on a transport that does nothing, with and without
+a capture running, and compares the time per chunk spent receiving,
+decoding and dispatching.
+
+The capture's writer thread is replaced by writing the queued records
+between batches, outside the measured time, and that cost is
+reported on its own. The capture goes to a temporary file.
+"""
+
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import spheropy
+import spheropy.spheropy as spheropy_module
+
+CHUNK_SIZE = 20
+NUM_PACKETS = 2000
+BATCH_SIZE = 200
+ROUNDS = 50
+
+
+def make_stream():
+    packets = []
+    for i in range(NUM_PACKETS):
+        if i % 10 == 0:
+            packet = [0xFF, 0xFF, 0x00, i & 0xFF, 0x01]
+        else:
+            data = [i & 0xFF] * 16
+            packet = [0xFF, 0xFE, 0x07, 0x00, len(data) + 1] + data
+        packet.append(spheropy_module._compute_checksum(packet))
+        packets.extend(packet)
+    stream = bytes(packets)
+    return [stream[i:i + CHUNK_SIZE] for i in range(0, len(stream), CHUNK_SIZE)]
+
+
+async def measure(sphero, chunks, wire_capture):
+    """Returns the receive and the capture write time per chunk in nanoseconds."""
+    receive_time = 0
+    write_time = 0
+    for i in range(0, len(chunks), BATCH_SIZE):
+        start = time.perf_counter_ns()
+        for chunk in chunks[i:i + BATCH_SIZE]:
+            sphero._handle_data_received(chunk)
+        # Let the receive worker handle the queued telemetry.
+        while sphero.receive_stats.queue_depth:
+            await asyncio.sleep(0)
+        receive_time += time.perf_counter_ns() - start
+
+        if wire_capture is not None:
+            start = time.perf_counter_ns()
+            with wire_capture._lock:
+                wire_capture._write_pending()
+            write_time += time.perf_counter_ns() - start
+
+    return receive_time / len(chunks), write_time / len(chunks)
+
+
+async def main():
+    chunks = make_stream()
+    sphero = spheropy.Sphero()
+    await sphero.connect(transport=spheropy.AsyncTransportBase())
+    # Nobody reads the stream, so once full it drops its oldest event each time.
+    collisions = sphero.events(spheropy.EventKind.COLLISION)
+    off_times = []
+    on_times = []
+    write_times = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.bin')
+        for _ in range(ROUNDS):
+            off_times.append((await measure(sphero, chunks, None))[0])
+            wire_capture = sphero.start_wire_capture(path)
+            # Stop the writer thread so it doesn't run during the measurement.
+            wire_capture._stop_event.set()
+            wire_capture._wake_event.set()
+            wire_capture._writer.join()
+            on_time, write_time = await measure(sphero, chunks, wire_capture)
+            on_times.append(on_time)
+            write_times.append(write_time)
+            sphero.stop_wire_capture()
+
+    collisions.close()
+    sphero.disconnect()
+    off = statistics.median(off_times)
+    on = statistics.median(on_times)
+    print('receive path: {:.0f} ns per chunk without capture, {:.0f} ns with, {:+.1f}%'.format(
+        off, on, (on - off) / off * 100))
+    print('writer thread: {:.0f} ns per chunk'.format(statistics.median(write_times)))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
@@ -0,0 +1,36 @@
+"""
+"""
+
+import asyncio
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    clock_estimate = await sphero.sync_clock()
+    print("Clock Estimate: {}".format(clock_estimate))
+
+    await sphero.configure_collision_detection(True, 45, 110, 45, 110, 100)
+    sphero.on_collision.append(lambda collision_info: print("Collision at host time {:.3f}".format(
+        collision_info.host_time)))
+
+    async with sphero.events(spheropy.EventKind.SENSOR_DATA) as batches:
+        await sphero.start_streaming(spheropy.SensorChannel.ACCELEROMETER,
+                                     rate_hz=200,
+                                     frames_per_packet=10)
+        for _ in range(100):
+            batch = await batches.__anext__()
+
+        await sphero.stop_streaming()
+        print("Last Sample Time: {:.3f}".format(batch['time'][-1]))
+
+    print("Stream Stats: {}".format(sphero.streaming_stats))
+    print("Clock Estimate: {}".format(await sphero.sync_clock()))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
@@ -2,7 +2,6 @@
 """
 
 import asyncio
-import time
 from test_utils import parse_args
 import spheropy
 
@@ -20,12 +19,13 @@ async def main():
 
     collision_detected = False
 
-    def handle_collision(collision_data):
+    # Coroutine callbacks run on this event loop,
+    # so they can send commands directly.
+    async def handle_collision(collision_data):
         nonlocal collision_detected
         collision_detected = True
-        event_loop = asyncio.new_event_loop()
-        event_loop.run_until_complete(sphero.roll(0, 0))
-        event_loop.run_until_complete(sphero.set_rgb_led(red=0xFF))
+        await sphero.roll(0, 0)
+        await sphero.set_rgb_led(red=0xFF)
 
         print("Collision Data:")
         print("X Impact: {}".format(collision_data.x_impact))
@@ -36,7 +36,7 @@ async def main():
         print("Y Magnitude: {}".format(collision_data.y_magnitude))
         print("Speed: {}".format(collision_data.speed))
         print("Timestamp: {}".format(collision_data.timestamp))
-        time.sleep(4)
+        await asyncio.sleep(4)
 
     sphero.on_collision.append(handle_collision)
 
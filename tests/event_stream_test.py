@@ -0,0 +1,37 @@
+"""
+"""
+
+import asyncio
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    await sphero.configure_collision_detection(
+        True,
+        45, 110,
+        45, 110,
+        20)
+
+    async with sphero.events(spheropy.EventKind.COLLISION, maxsize=8) as collisions:
+        await sphero.set_rgb_led(green=0xFF)
+        await sphero.roll(127, 0)
+        try:
+            collision_info = await asyncio.wait_for(collisions.__anext__(), 10)
+        except asyncio.TimeoutError:
+            print("FAIL: collision not detected.")
+            collision_info = None
+
+        await sphero.roll(0, 0)
+        if collision_info is not None:
+            await sphero.set_rgb_led(red=0xFF)
+            print("Collision Data: {}".format(collision_info))
+            print("Stream Stats: {}".format(collisions.stats))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
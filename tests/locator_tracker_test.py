@@ -0,0 +1,33 @@
+"""
+"""
+
+import asyncio
+import time
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    await sphero.configure_locator()
+    tracker = spheropy.LocatorTracker(sphero)
+    mode = await tracker.start(rate_hz=20)
+    print("Tracking by {}.".format(mode))
+
+    await sphero.roll(64, 0)
+    for _ in range(20):
+        await asyncio.sleep(0.1)
+        print("Position: {}".format(tracker.position_at(time.monotonic())))
+
+    await sphero.roll(0, 0)
+    await asyncio.sleep(1)
+    print("Locator Info: {}".format(tracker.locator_info))
+    await tracker.stop()
+    print("Tracker Stats: {}".format(tracker.stats))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
@@ -0,0 +1,90 @@
+"""
+Measures the cost of decoding one response in nanoseconds.
+
+Does not need a Sphero. Compares the precompiled struct parsers with
+the field by field parsing (slices and int.from_bytes) they replaced,
+on the data of the responses a Sphero streams most often.
+"""
+
+import time
+import spheropy.spheropy as spheropy_module
+
+ITERATIONS = 200000
+
+COLLISION_DATA = bytes([0xFF, 0x9C, 0x00, 0x64, 0x03, 0xE8, 0x01,
+                        0x01, 0x2C, 0x00, 0xC8, 0x40, 0x00, 0x01, 0xE2, 0x40])
+LOCATOR_DATA = bytes([0xFF, 0xF6, 0x00, 0x14, 0x00, 0x05, 0xFF, 0xFB, 0x00, 0x07])
+POWER_STATE_DATA = bytes([0x01, 0x02, 0x02, 0xF3, 0x00, 0x2A, 0x0E, 0x10])
+VERSION_DATA = bytes(range(10))
+
+
+def _pack_bytes(byte_list):
+    return int.from_bytes(byte_list, 'big', signed=False)
+
+
+def _pack_bytes_signed(byte_list):
+    return int.from_bytes(byte_list, 'big', signed=True)
+
+
+def field_collision_info(data):
+    return spheropy_module.CollisionInfo(_pack_bytes_signed(data[0:2]),
+                                         _pack_bytes_signed(data[2:4]),
+                                         _pack_bytes_signed(data[4:6]),
+                                         data[6],
+                                         _pack_bytes(data[7:9]),
+                                         _pack_bytes(data[9:11]),
+                                         data[11],
+                                         _pack_bytes(data[12:16]),
+                                         None)
+
+
+def field_locator_info(data):
+    return spheropy_module.LocatorInfo(_pack_bytes_signed(data[0:2]),
+                                       _pack_bytes_signed(data[2:4]),
+                                       _pack_bytes_signed(data[4:6]),
+                                       _pack_bytes_signed(data[6:8]),
+                                       _pack_bytes(data[8:10]))
+
+
+def field_power_state(data):
+    return spheropy_module.PowerState(data[0],
+                                      data[1],
+                                      _pack_bytes(data[2:4]),
+                                      _pack_bytes(data[4:6]),
+                                      _pack_bytes(data[6:8]))
+
+
+def field_version_info(data):
+    return spheropy_module.VersionInfo(*(data[i] if len(data) > i else None for i in range(10)))
+
+
+CASES = [
+    ('collision', COLLISION_DATA, field_collision_info,
+     spheropy_module._parse_collision_info),
+    ('locator', LOCATOR_DATA, field_locator_info,
+     spheropy_module._READ_LOCATOR.decode_response),
+    ('power state', POWER_STATE_DATA, field_power_state,
+     spheropy_module._GET_POWER_STATE.decode_response),
+    ('version', VERSION_DATA, field_version_info,
+     spheropy_module._parse_version_info),
+]
+
+
+def measure(parse, data):
+    # Received packets hand their data to the parsers as a memoryview.
+    view = memoryview(data)
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        parse(view)
+    return (time.perf_counter() - start) / ITERATIONS * 1e9
+
+
+def main():
+    for name, data, field_parse, struct_parse in CASES:
+        assert field_parse(memoryview(data)) == struct_parse(memoryview(data)), name
+        print('{:>11}: fields {:>6.0f} ns, struct {:>6.0f} ns'.format(
+            name, measure(field_parse, data), measure(struct_parse, data)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Measures CPU use and event latency as the number of connections grows.
+
+Does not need a Sphero. Each simulated Sphero is a local socket pair
+that receives timestamped asynchronous packets at a fixed rate.
+Compares a receive thread plus a decode thread per connection
+(the threading model before IoReactor) with a shared IoReactor.
+The CPU use includes the thread that simulates the Spheros.
+"""
+
+import queue
+import socket
+import statistics
+import struct
+import threading
+import time
+import spheropy
+import spheropy.spheropy as spheropy_module
+
+ROBOT_COUNTS = [1, 10, 40]
+PACKETS_PER_SECOND = 50
+DURATION_IN_SECONDS = 2.0
+_ID_CODE_BENCHMARK = 0x7F
+
+
+def make_packet():
+    data = struct.pack('>Q', time.perf_counter_ns())
+    packet = [0xFF, 0xFE, _ID_CODE_BENCHMARK, 0x00, len(data) + 1] + list(data)
+    packet.append(spheropy_module._compute_checksum(packet))
+    return bytes(packet)
+
+
+class LatencyRecorder(object):
+
+    def __init__(self):
+        self.latencies = []
+
+    def handle_packet(self, response_packet):
+        sent = struct.unpack('>Q', response_packet.data)[0]
+        self.latencies.append((time.perf_counter_ns() - sent) / 1e6)
+
+
+def start_threaded(sock, recorder, stop_event):
+    """A receive thread and a decode thread, like before IoReactor."""
+    received = queue.Queue()
+
+    def receive():
+        while not stop_event.is_set():
+            try:
+                data = sock.recv(1024)
+            except OSError:
+                return
+            if not data:
+                return
+            received.put(data)
+
+    def decode():
+        framer = spheropy_module._ReceiveFramer()
+        while True:
+            data = received.get()
+            if data is None:
+                return
+            for response_packet in framer.feed(data):
+                recorder.handle_packet(response_packet)
+
+    threads = [threading.Thread(target=receive, daemon=True),
+               threading.Thread(target=decode, daemon=True)]
+    for thread in threads:
+        thread.start()
+    return lambda: received.put(None)
+
+
+def start_reactor(sock, recorder, io_reactor):
+    worker = spheropy_module._ReceiveWorker(recorder.handle_packet, recorder.handle_packet, io_reactor)
+    worker.start(None)
+    sock.setblocking(False)
+
+    def on_readable():
+        try:
+            data = sock.recv(1024)
+        except BlockingIOError:
+            return
+        if data:
+            worker.put(data)
+
+    worker.io_thread.register_reader(sock, on_readable)
+    return worker.stop
+
+
+def run(mode, robot_count):
+    pairs = [socket.socketpair() for _ in range(robot_count)]
+    recorder = LatencyRecorder()
+    stop_event = threading.Event()
+    io_reactor = spheropy.IoReactor()
+    stops = []
+    for _, robot_side in pairs:
+        if mode == 'threads':
+            stops.append(start_threaded(robot_side, recorder, stop_event))
+        else:
+            stops.append(start_reactor(robot_side, recorder, io_reactor))
+
+    thread_count = threading.active_count()
+    interval = 1.0 / PACKETS_PER_SECOND
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    next_send = wall_start
+    while time.perf_counter() - wall_start < DURATION_IN_SECONDS:
+        for host_side, _ in pairs:
+            host_side.send(make_packet())
+        next_send += interval
+        time.sleep(max(0.0, next_send - time.perf_counter()))
+
+    time.sleep(0.1)
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+    stop_event.set()
+    for stop in stops:
+        stop()
+    for host_side, robot_side in pairs:
+        host_side.close()
+        robot_side.close()
+    io_reactor.stop()
+
+    latencies = sorted(recorder.latencies)
+    print('{:>3} robots, {:>7}: {:>3} threads, {:>5.1f}% CPU, '
+          'latency median {:.3f} ms p99 {:.3f} ms'.format(
+              robot_count, mode, thread_count, cpu * 100,
+              statistics.median(latencies),
+              latencies[int(len(latencies) * 0.99)]))
+
+
+def main():
+    for robot_count in ROBOT_COUNTS:
+        run('threads', robot_count)
+        run('reactor', robot_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures the receive framer's throughput in bytes per second.
+
+Does not need a Sphero. Compares _ReceiveFramer against the list based
+framing that _process_messages used before,
+on a stream of acks and collision notifications split into
+Bluetooth sized chunks.
+"""
+
+import time
+import spheropy.spheropy as spheropy_module
+
+# Small writes from a serial port and large reads from a busy socket.
+CHUNK_SIZES = [64, 1024, 16384]
+PACKET_COUNT = 50000
+
+
+def make_stream():
+    stream = bytearray()
+    for i in range(PACKET_COUNT):
+        if i % 4 == 0:
+            packet = [0xFF, 0xFE, 0x07, 0x00, 0x11] + [i % 0x100] * 16
+        else:
+            packet = [0xFF, 0xFF, 0x00, i % 0x100, 0x04, 0x01, 0x02, 0x03]
+        packet.append(spheropy_module._compute_checksum(packet))
+        stream.extend(packet)
+        if i % 1000 == 0:
+            # Some line noise to exercise resynchronization.
+            stream.extend(b'\x00\x13\x37')
+    return bytes(stream)
+
+
+def list_framer(chunks):
+    """The framing loop as it was before _ReceiveFramer."""
+    count = 0
+    message = []
+    for chunk in chunks:
+        message.extend(chunk)
+        while len(message) >= spheropy_module._MIN_PACKET_LENGTH:
+            data_length = message[4] if message[1] == 0xFF else (message[3] << 8) | message[4]
+            if message[0] != 0xFF or message[1] not in (0xFF, 0xFE) or data_length < 1:
+                del message[:1]
+                del message[:message.index(0xFF) if 0xFF in message else len(message)]
+                continue
+            if data_length + 5 > len(message):
+                break
+            data = message[5:data_length + 4]
+            checksum = message[data_length + 4]
+            if checksum != spheropy_module._compute_checksum(message[:data_length + 4]):
+                del message[:1]
+                continue
+            # Build the packet so both framers pay for it.
+            spheropy_module._ResponsePacket(message[1] == 0xFE, message[2], message[3], data)
+            count += 1
+            del message[:data_length + 5]
+    return count
+
+
+def ring_framer(chunks):
+    count = 0
+    framer = spheropy_module._ReceiveFramer()
+    for chunk in chunks:
+        count += len(framer.feed(chunk))
+    return count
+
+
+def measure(name, framer, chunk_size, stream):
+    chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    start = time.perf_counter()
+    count = framer(chunks)
+    elapsed = time.perf_counter() - start
+    print('{:>5} byte chunks, {}: {:>7} packets, {:>6.1f} MB/s'.format(
+        chunk_size, name, count, len(stream) / elapsed / 1e6))
+
+
+def main():
+    stream = make_stream()
+    for chunk_size in CHUNK_SIZES:
+        measure('list', list_framer, chunk_size, stream)
+        measure('ring', ring_framer, chunk_size, stream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+"""
+
+import asyncio
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    async with sphero.events(spheropy.EventKind.SENSOR_DATA) as batches:
+        rate_hz = await sphero.start_streaming(
+            spheropy.SensorChannel.ACCELEROMETER | spheropy.SensorChannel.IMU_ANGLES,
+            rate_hz=400,
+            frames_per_packet=20)
+        print("Streaming at {} Hz.".format(rate_hz))
+
+        sample_count = 0
+        loop = asyncio.get_event_loop()
+        end_time = loop.time() + 5
+        while loop.time() < end_time:
+            batch = await batches.__anext__()
+            sample_count += len(batch)
+
+        await sphero.stop_streaming()
+        print("Received {} samples.".format(sample_count))
+        print("Mean Accel Z: {:.3f} G".format(batch['accel_z'].mean()))
+        print("Yaw: {} degrees".format(batch['imu_yaw'][-1]))
+        print("Stream Stats: {}".format(batches.stats))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
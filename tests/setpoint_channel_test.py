@@ -0,0 +1,38 @@
+"""
+"""
+
+import asyncio
+from test_utils import parse_args
+import spheropy
+
+
+async def sweep_headings():
+    for heading in range(0, 360, 5):
+        yield (64, heading)
+        await asyncio.sleep(0.01)
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    # Produce setpoints faster than the link can carry them.
+    # Stale setpoints are dropped instead of queued.
+    async with sphero.setpoint_channel(spheropy.SetpointKind.ROLL) as roll_channel:
+        await roll_channel.feed(sweep_headings())
+        roll_channel.update(0, 0)
+        await roll_channel.drain()
+        print(roll_channel.stats)
+
+    async with sphero.setpoint_channel(spheropy.SetpointKind.RGB_LED) as led_channel:
+        for red in range(0x100):
+            led_channel.update(red=red)
+            await asyncio.sleep(0.001)
+
+        await led_channel.drain()
+        print(led_channel.stats)
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
@@ -0,0 +1,41 @@
+"""
+"""
+
+import asyncio
+import time
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    store = spheropy.TelemetryStore(capacity=4096)
+    store.attach(sphero)
+    await sphero.start_streaming(spheropy.SensorChannel.ACCELEROMETER,
+                                 rate_hz=100,
+                                 frames_per_packet=10)
+    await sphero.configure_locator()
+    await sphero.roll(64, 0)
+    for _ in range(20):
+        store.append('locator', await sphero.get_locator_info())
+        await asyncio.sleep(0.1)
+
+    await sphero.roll(0, 0)
+    await sphero.stop_streaming()
+
+    now = time.monotonic()
+    print("Channels: {}".format(store.channels))
+    print("Memory: {} bytes".format(store.memory_in_bytes))
+    print("Latest Locator Info: {}".format(store.latest('locator')))
+    print("Max Speed (last second): {} cm/s".format(
+        store.max('locator', 'speed_over_ground', now - 1.0, now)))
+    print("Mean Accel Z (last second): {} G".format(
+        store.mean('sensor_data', 'accel_z', now - 1.0, now)))
+    print("Sensor Data Rate: {:.1f} Hz".format(store.rate('sensor_data')))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())
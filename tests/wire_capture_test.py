@@ -0,0 +1,29 @@
+"""
+"""
+
+import asyncio
+from test_utils import parse_args
+import spheropy
+
+
+async def main():
+    script_args = parse_args()
+    sphero = spheropy.Sphero()
+    await sphero.connect(num_retry_attempts=3, use_ble=script_args.use_ble)
+
+    wire_capture = sphero.start_wire_capture('sphero_capture.bin')
+    await sphero.ping()
+    await sphero.get_power_state()
+    await sphero.roll(64, 0)
+    await asyncio.sleep(1)
+    await sphero.roll(0, 0)
+    sphero.stop_wire_capture()
+    print("Capture Stats: {}".format(wire_capture.stats))
+
+    for record in spheropy.WireCapture.read('sphero_capture.bin'):
+        direction = 'sent' if record.direction == spheropy.WireCapture.SENT else 'received'
+        print("{} {:>8}: {}".format(record.time_ns, direction, record.data.hex()))
+
+if __name__ == "__main__":
+    main_loop = asyncio.get_event_loop()
+    main_loop.run_until_complete(main())